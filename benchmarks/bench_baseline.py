@@ -0,0 +1,340 @@
+#!/usr/bin/env python3.6
+
+# runs the extractor the scraper had before the schema driven get_results()
+# over saved Customer Report pages and compares its dicts with the current
+# get_results(). The old code is kept below as it was, except that it no
+# longer takes the selenium driver (it only used it to turn the Virtual Tour
+# offset off for the reportsPDF.asp url, which saved pages don't come from)
+# and that the misindented comment in get_results() is a comment again.
+# Exits with 1 when the old extractor fails on a page or the results differ,
+# so a corpus can be checked before it is used for before/after comparisons.
+# The old get_listing_total() only looks for 100 listings, larger pages are
+# compared over their first 100.
+# --write stores the old extractor's dicts next to each page (page.json),
+# that is how the expected results in tests/fixtures/ are made.
+# pages can be generated with benchmarks/synthetic_report.py
+# usage: python benchmarks/bench_baseline.py corpus/*
+#        python benchmarks/bench_baseline.py tests/fixtures/*.html --write
+
+import os
+import sys
+import json
+import argparse
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from listing_scraper import read_report_file, parse_html, get_listing_index, get_results as current_results
+
+parser = argparse.ArgumentParser()
+parser.add_argument("pages",nargs="+",help="saved Customer Report pages (.html, .gz, .bz2, .xz)")
+parser.add_argument("--write",action="store_true",help="write the old extractor's results to <page>.json")
+
+def get_listing_entry(num,soup):
+    """
+    Finds the HTML location for each housing listing available.
+    Returns beautifulsoup object
+  
+    Parameters
+    ----------
+    num : integer value corresponding to the listing number
+          of a given housing property on the mls printable reports site
+          values start from 0
+          
+    soup : beautifulsoup object from running the get_soup() function
+           with a webdriver object after loading the printable reports page
+    """
+    return soup.findAll('span',{'id':'L{}'.format(num)})[0]
+
+def get_listing_id(listing):
+    """
+    Finds the mls generated unique id for a particular housing listing
+    
+    Parameters
+    ----------
+    listing : beautifulsoup object that is returned after
+              running the get_listing_entry() function
+    """
+    return listing.findAll('table')[1].find('div')['id']
+
+def get_listing_photo_count(listing):
+    """
+    Count the number of images associated with an indivdual housing listing
+    on the mls printable reports site.
+    
+    Parameters
+    ----------
+    listing : beautifulsoup object that is returned after
+              running the get_listing_entry() function
+    """
+    return int(listing.findAll('div',
+                           {'id':"CountDiv{id_}"\
+                                .format(id_=get_listing_id(listing))
+                            }
+                          )[0].text.replace('\xa0HD','').split()[~0])
+                          
+def get_listing_total(soup):
+    """
+    Finds the total number of housing listings on the mls
+    Printable reports page
+    
+    Parameters
+    ----------
+    soup : beautifulsoup object returned from runing
+           the get_soup() function after loading the
+           printable reports site in the selenium webdriver
+    """
+  
+    listing_count = 0
+    for i in range(100):
+        if soup.findAll('span',{'id':f"L{i}"}) != []:
+            listing_count += 1
+    return listing_count
+
+def get_results(listing):
+    """
+    Single function that acquires all data corresiponding to an individual
+    mls listing. Results are returned as a dictionary object
+    
+    Parameters
+    ----------
+    listing : beautifulsoup object that is returned after
+              running the get_listing_entry() function
+    """
+    
+    def get_thumbnail_urls(listing):
+        """
+        Finds and returns a list of all urls for all thumbnail images
+        of a given housing listing on the mls printable reports page
+        
+        Parameters
+        ----------
+        listing : beautifulsoup object that is returned after
+                  running the get_listing_entry() function
+        """
+        try:
+            id_ = get_listing_id(listing)
+            photo_count = get_listing_photo_count(listing)
+            return [f'http://pxlimages.xmlsweb.com/NJMLS/M/Images/{id_}.{cnt}.JPG?v=1' for cnt in range(1, photo_count + 1)]
+        except:
+            return [listing.find('img')['src']]
+                    
+    def get_box_vals(listing):
+        """
+        Finds basic information about a given housing listing on mls. This is the block of
+        information that adjacent to the right of the thumbnail image for each listing
+        Including: last price, ml_num, address, town, zipcode, county, county locale,
+                   area code, direct, original listing price, days on market
+                   
+        Parameters
+        ----------
+        listing : beautifulsoup object that is returned after
+                  running the get_listing_entry() function
+        """
+        box = listing.findAll('td',{'width':'55%'})[0]
+        last_price = int(box.text.strip().replace('\t','').split("LP:\n")[1].split('\n')[0].replace("$",'').replace(",",''))
+        ml_num = box.text.strip().replace('\t','').split("ML#:\n")[1].split('\n')[0].strip()
+        address = box.text.strip().replace('\t','').split("Addr:\n")[1].split('\n')[0].strip()
+        town = box.text.strip().replace('\t','').split("Town:\n")[1].split('\n')[0].strip()
+        zipcode = box.text.strip().replace('\t','').split("Zip:\n")[1].split('\n')[0].strip()
+        county = box.text.strip().replace('\t','').split("County:\n")[1].split('\n')[0].title().strip()
+        county_locale = box.text.strip().replace('\t','').split("County Locale#:\n")[1].split('\n')[0].strip()
+        areacode = box.text.strip().replace('\t','').split("Area#:\n")[1].split('\n')[0].strip()
+        direct = box.text.strip().replace('\t','').split("Direct:\n")[1].split('\n')[0].strip()
+        original_lp = int(box.text.strip().replace('\t','').split("Orig LP:\n")[1].split('\n')[0].replace("$",'').replace(",",''))
+        days_on_mkt = int(box.text.strip().replace('\t','').split("DOM:\n")[1].split('\n')[0])
+        
+        return {"last_price":last_price,
+                "ml_num":ml_num,
+                "address":address,
+                "town":town,
+                "zipcode":zipcode,
+                "county":county,
+                "county_locale":county_locale,
+                "areacode":areacode,
+                "direct":direct,
+                "original_lp":original_lp,
+                "days_on_mkt":days_on_mkt}
+
+    # Account for 'Virtual Tour' link. Data for listings that include the 'Virtual Tour' are offset by 1 when compared
+    # To the listings that do not contain the 'Virtual Tour' link. The VT variable is boolean and coerced into an integer
+    # That way, adding VT to the row index accounts for row offset.
+    VT = True if 'Virtual'.lower() in listing.text.lower() and 'Tour'.lower() in listing.text.lower() else False
+                    
+    results1 = dict(zip([x for x in listing.findAll('table')[15 + VT].text.replace('#\n\n','#').split('\n\t') if x != '\n'],
+                        [x for x in listing.findAll('table')[16 + VT].text.replace('#\n\n','#').replace("\xa0",'empty').split('\n\t') if x != '\n']))
+    try:
+        results1['Tax Condo #'] = results1.get('Tax Condo #').replace('\n\n','')
+    except:
+        results1['Tax Condo #'] = 'empty'
+    results2 = dict(zip([x for x in listing.findAll('table')[17 + VT].text.replace('Sub-Style\n\n','Sub-Style').split('\n\t') if x != '\n'],
+                        [x for x in listing.findAll('table')[18 + VT].text.replace('#\n\n','#').replace("\xa0","empty").split('\n\t') if x != '\n']))
+    try:
+        results2['Sub-Style'] = results2.get('Sub-Style').replace('\n\n','')
+    except:
+        results2['Sub-Style'] = 'empty'
+    try:
+        results2['Taxes'] = results2.get('Taxes').replace("$","").replace(",","")
+    except:
+        results2['Taxes'] = 'empty'
+    
+    monthly_maintenance = listing.findAll('table')[19 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","")
+    maintenance_includes = listing.findAll('table')[19 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
+    gnd_flr = listing.findAll('table')[20 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
+    EL = listing.findAll('table')[20 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
+    first_fl = listing.findAll('table')[21 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
+    JH = listing.findAll('table')[21 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
+    second_fl = listing.findAll('table')[22 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
+    SH = listing.findAll('table')[22 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
+    third_fl = listing.findAll('table')[23 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
+    basement = listing.findAll('table')[24 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
+    assessments = listing.findAll('table')[25 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
+    municipal_assessment = listing.findAll('table')[25 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
+    try:
+        # some reason, this value is not entered and the contents returns [] - so the try/catch is used
+        easements = listing.findAll('table')[25 + VT].findAll('td')[5].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
+    except:
+        easements = 'empty'
+    items_included = listing.findAll('table')[26 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
+    items_not_included = listing.findAll('table')[26 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
+    
+    results3 = {
+        "monthly_maintenance":monthly_maintenance,
+        "maintenance_includes":maintenance_includes,
+        "gnd_flr":gnd_flr,
+        "elementary_school":EL,
+        "first_fl":first_fl,
+        "jr_highschool":JH,
+        "second_fl":second_fl,
+        "high_school":SH,
+        "third_fl":third_fl,
+        "basement":basement,
+        "assessments":assessments,
+        "municipal_assessment":municipal_assessment,
+        "easements":easements,
+        "items_included":items_included,
+        "items_not_included":items_not_included,
+    }
+    
+    building_complex = listing.findAll('table')[28 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    unit_num = listing.findAll('table')[28 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    model_line = listing.findAll('table')[28 + VT].findAll('td')[5].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    approx_unit_sqtf = listing.findAll('table')[29 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    underlying_mtg = listing.findAll('table')[29 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    yrs_remaining = listing.findAll('table')[29 + VT].findAll('td')[5].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    number_of_shares = listing.findAll('table')[30 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip() 
+    number_of_stories = listing.findAll('table')[30 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip() 
+    stairs = listing.findAll('table')[30 + VT].findAll('td')[5].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    building_assoc_charges = listing.findAll('table')[31 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    board_finance_requirements = listing.findAll('table')[31 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    management_company = listing.findAll('table')[32 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    management_phone = listing.findAll('table')[32 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+
+    results4 = {
+        "building_complex":building_complex,
+        "unit_num":unit_num,
+        "model_line":model_line,
+        "approx_unit_sqtf":approx_unit_sqtf,
+        "underlying_mtg":underlying_mtg,
+        "yrs_remaining":yrs_remaining,
+        "number_of_shares":number_of_shares,
+        "number_of_stories":number_of_stories,
+        "stairs":stairs,
+        "building_assoc_charges":building_assoc_charges,
+        "board_finance_requirements":board_finance_requirements,
+        "management_company":management_company,
+        "management_phone":management_phone
+    }
+
+    waterfront = listing.findAll('table')[34 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    garage = listing.findAll('table')[34 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    life_style = listing.findAll('table')[35 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    heating = listing.findAll('table')[36 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    cooling = listing.findAll('table')[36 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    fireplace = listing.findAll('table')[37 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    basement_features = listing.findAll('table')[37 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    building_amenities = listing.findAll('table')[38 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    maintenance_included = listing.findAll('table')[38 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    appliances_included = listing.findAll('table')[39 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    year_built = listing.findAll('table')[40 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    ownership = listing.findAll('table')[40 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    floor_plan = listing.findAll('table')[41 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    views = listing.findAll('table')[41 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    misc = listing.findAll('table')[42 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    pets = listing.findAll('table')[42 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    laundry = listing.findAll('table')[43 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+    possession = listing.findAll('table')[43 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
+
+    results5 = {
+        "waterfront":waterfront,
+        "garage":garage,
+        "life_style":life_style,
+        "heating":heating,
+        "cooling":cooling,
+        "fireplace":fireplace,
+        "basement_features":basement_features,
+        "building_amenities":building_amenities,
+        "maintenance_included":maintenance_included,
+        "appliances_included":appliances_included,
+        "year_built":year_built,
+        "ownership":ownership,
+        "floor_plan":floor_plan,
+        "views":views,
+        "misc":misc,
+        "pets":pets,
+        "laundry":laundry,
+        "possession":possession
+    }
+    return dict(**results1,
+                **results2,
+                **results3,
+                **results4,
+                **results5,
+                **get_box_vals(listing),
+                image_urls="||".join(get_thumbnail_urls(listing))
+               )
+
+def baseline_results(html):
+    """
+    Returns the old get_results() dicts of every listing on a page, parsed
+    with html5lib like the old scraper did
+
+    Parameters
+    ----------
+    html : string of HTML code
+    """
+    soup = BeautifulSoup(html,'html5lib')
+    return [get_results(get_listing_entry(i,soup)) for i in range(get_listing_total(soup))]
+
+def json_path(path):
+    """
+    Returns the path of the expected results of a saved page
+    """
+    name = os.path.basename(path)
+    return os.path.join(os.path.dirname(path), name.split('.')[0] + '.json')
+
+def main():
+    args = parser.parse_args()
+    failed = False
+    for path in args.pages:
+        html = read_report_file(path)
+        try:
+            expected = baseline_results(html)
+        except Exception as e:
+            print(f"{path}: old extractor failed: {e!r}")
+            failed = True
+            continue
+        index = get_listing_index(parse_html(html))
+        results = [current_results(index[num]) for num in sorted(index)]
+        same = results[:len(expected)] == expected
+        failed = failed or not same
+        print(f"{path}: {len(results)} listings ({len(expected)} read by the old extractor), same as the old extractor: {same}")
+        if args.write:
+            with open(json_path(path),'w',encoding='utf-8') as results:
+                json.dump(expected,results,indent=1)
+                results.write('\n')
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
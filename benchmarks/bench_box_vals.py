@@ -0,0 +1,107 @@
+#!/usr/bin/env python3.6
+
+# micro-benchmark for the listing box parser (listing_scraper.parse_box_text)
+# pages can be generated with benchmarks/synthetic_report.py
+# usage: python benchmarks/bench_box_vals.py saved_reports/*.html --repeat 200
+
+import os
+import sys
+import time
+import argparse
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from listing_scraper import parse_box_text
+
+parser = argparse.ArgumentParser()
+parser.add_argument("pages",nargs="+",help="saved Customer Report html files")
+parser.add_argument("--repeat",type=int,default=100)
+
+def load_boxes(paths):
+    """
+    Reads saved printable reports pages and returns the text of every
+    listing box found in them
+
+    Parameters
+    ----------
+    paths : list of string paths to saved html files
+    """
+    boxes = []
+    for path in paths:
+        with open(path, encoding='utf-8') as page:
+            soup = BeautifulSoup(page.read(), 'html5lib')
+        boxes.extend(box.text for box in soup.findAll('td',{'width':'55%'}))
+    return boxes
+
+def split_box_text(text):
+    """
+    Previous get_box_vals() implementation, one split chain per field.
+    Kept only as the baseline for this benchmark.
+
+    Parameters
+    ----------
+    text : string text of the listing box
+    """
+    return {"last_price":int(text.strip().replace('\t','').split("LP:\n")[1].split('\n')[0].replace("$",'').replace(",",'')),
+            "ml_num":text.strip().replace('\t','').split("ML#:\n")[1].split('\n')[0].strip(),
+            "address":text.strip().replace('\t','').split("Addr:\n")[1].split('\n')[0].strip(),
+            "town":text.strip().replace('\t','').split("Town:\n")[1].split('\n')[0].strip(),
+            "zipcode":text.strip().replace('\t','').split("Zip:\n")[1].split('\n')[0].strip(),
+            "county":text.strip().replace('\t','').split("County:\n")[1].split('\n')[0].title().strip(),
+            "county_locale":text.strip().replace('\t','').split("County Locale#:\n")[1].split('\n')[0].strip(),
+            "areacode":text.strip().replace('\t','').split("Area#:\n")[1].split('\n')[0].strip(),
+            "direct":text.strip().replace('\t','').split("Direct:\n")[1].split('\n')[0].strip(),
+            "original_lp":int(text.strip().replace('\t','').split("Orig LP:\n")[1].split('\n')[0].replace("$",'').replace(",",'')),
+            "days_on_mkt":int(text.strip().replace('\t','').split("DOM:\n")[1].split('\n')[0])}
+
+def time_parser(parse, boxes, repeat):
+    """
+    Returns the best wall time (seconds) of parsing every box once,
+    out of repeat runs
+
+    Parameters
+    ----------
+    parse : function taking the text of one listing box
+
+    boxes : list of box texts returned from load_boxes()
+
+    repeat : integer number of timed runs
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for box in boxes:
+            parse(box)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    args = parser.parse_args()
+    boxes = load_boxes(args.pages)
+    if not boxes:
+        sys.exit("No listing boxes found in {}".format(args.pages))
+
+    # the old parser raises on incomplete boxes (the new one returns None fields)
+    # so both are timed over the boxes the old one can read
+    complete = []
+    mismatches = 0
+    for box in boxes:
+        try:
+            expected = split_box_text(box)
+        except (IndexError, ValueError):
+            continue
+        complete.append(box)
+        if expected != parse_box_text(box):
+            mismatches += 1
+    if not complete:
+        sys.exit("None of the listing boxes could be read by the old parser")
+
+    split_time = time_parser(split_box_text, complete, args.repeat)
+    regex_time = time_parser(parse_box_text, complete, args.repeat)
+    print(f"boxes: {len(boxes)}  complete: {len(complete)}  mismatches: {mismatches}")
+    print(f"split chain:  {split_time * 1e6 / len(complete):8.2f} us/box")
+    print(f"single regex: {regex_time * 1e6 / len(complete):8.2f} us/box  ({split_time / regex_time:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3.6
+
+# compares the beautiful soup parser backends on saved Customer Report pages:
+# parse time, peak memory, and whether get_results() returns the same dicts
+# as html5lib (the parser the scraper used originally)
+# pages can be generated with benchmarks/synthetic_report.py
+# usage: python benchmarks/bench_parsers.py saved_reports/*.html
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from listing_scraper import PARSERS, parse_html, get_listing_index, get_results
+
+REFERENCE_PARSER = 'html5lib'
+
+parser = argparse.ArgumentParser()
+parser.add_argument("pages",nargs="+",help="saved Customer Report html files")
+parser.add_argument("--parsers",nargs="+",default=list(PARSERS),choices=PARSERS)
+
+def run_parser(html, parser_name):
+    """
+    Parses one page with the given backend and extracts every listing.
+    Returns a tuple of (list of result dicts, parse seconds, extract seconds,
+    peak traced memory in bytes while parsing)
+
+    Parameters
+    ----------
+    html : string of HTML code
+
+    parser_name : name of the beautiful soup tree builder, one of PARSERS
+    """
+    # memory is traced on a separate parse, tracing slows the parser down
+    tracemalloc.start()
+    parse_html(html, parser_name)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    soup = parse_html(html, parser_name)
+    parse_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = get_listing_index(soup)
+    results = [get_results(index[num]) for num in sorted(index)]
+    return results, parse_time, time.perf_counter() - start, peak
+
+def main():
+    args = parser.parse_args()
+    parsers = [REFERENCE_PARSER] + [name for name in args.parsers if name != REFERENCE_PARSER]
+    all_equal = True
+    for path in args.pages:
+        with open(path, encoding='utf-8') as page:
+            html = page.read()
+        print(f"{path} ({len(html) / 1e6:.1f} MB)")
+        reference = None
+        for name in parsers:
+            results, parse_time, extract_time, peak = run_parser(html, name)
+            if reference is None:
+                reference = results
+            same = results == reference
+            all_equal = all_equal and same
+            print(f"  {name:<12} listings: {len(results):4d}  parse: {parse_time:7.3f}s  "
+                  f"extract: {extract_time:7.3f}s  peak: {peak / 2**20:7.1f} MB  "
+                  f"same as {REFERENCE_PARSER}: {same}")
+    if not all_equal:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
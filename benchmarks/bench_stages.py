@@ -0,0 +1,234 @@
+#!/usr/bin/env python3.6
+
+# per-stage benchmark of the scraper's parsing over a corpus of saved
+# Customer Report pages (files or a report archive, see report_archive.py).
+# Pages are grouped by size (small < 10 listings, medium < 100, large 100+)
+# and by whether they have Virtual Tour rows. Each page runs in a fresh
+# process so its peak RSS is its own. Results are written as JSON, and
+# --compare flags groups whose listings/sec dropped against an earlier run.
+# benchmarks/synthetic_report.py writes a corpus with a page for every group
+# usage: python benchmarks/bench_stages.py saved_reports/* --output bench.json
+#        python benchmarks/bench_stages.py --archive archive/ --compare bench.json
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+import multiprocessing
+import datetime as dt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from listing_scraper import (PARSERS, DEFAULT_PARSER, parse_html, read_report_file, get_listing_index,
+                             get_listing_total, get_box_vals, get_results, get_extractor)
+import report_archive
+
+STAGES = ('read', 'soup', 'index', 'total', 'box_vals', 'results')
+# stages that make up scraping a page once it is downloaded, used for listings/sec
+EXTRACTION_STAGES = ('soup', 'index', 'results')
+SIZE_GROUPS = ((10, 'small'), (100, 'medium'), (float('inf'), 'large'))
+
+parser = argparse.ArgumentParser()
+parser.add_argument("pages",nargs="*",help="saved Customer Report pages (.html, .gz, .zst, .bz2, .xz)")
+parser.add_argument("--archive",default=None,help="also benchmark every page stored in this report archive")
+parser.add_argument("--parser",default=DEFAULT_PARSER,choices=PARSERS)
+parser.add_argument("--repeat",type=int,default=3,help="timed runs per page, the fastest is kept per stage")
+parser.add_argument("--output",default=None,help="json file to write the results to")
+parser.add_argument("--compare",default=None,help="json results of an earlier run to check for regressions")
+parser.add_argument("--tolerance",type=float,default=0.2,help="allowed listings/sec drop against --compare, 0.2 = 20%%")
+
+def page_group(listings, virtual_tour):
+    """
+    Returns the corpus group of a page, e.g. 'medium' or 'large+vt'
+
+    Parameters
+    ----------
+    listings : integer number of listings on the page
+
+    virtual_tour : True when the page has Virtual Tour rows
+    """
+    size = next(name for limit, name in SIZE_GROUPS if listings < limit)
+    return size + '+vt' if virtual_tour else size
+
+def bench_page(path, parser_name, repeat):
+    """
+    Runs every stage on one saved page repeat times. Meant to run in its own
+    process, see run_isolated(). Returns a dictionary with the listing count,
+    group, best seconds per stage, listings/sec and peak RSS in MB
+
+    Parameters
+    ----------
+    path : string path of the saved page
+
+    parser_name : name of the beautiful soup tree builder, one of PARSERS
+
+    repeat : integer number of timed runs
+    """
+    extractor = get_extractor()
+    best = dict.fromkeys(STAGES, float('inf'))
+    for _ in range(repeat):
+        timings = {}
+        start = time.perf_counter()
+        html = read_report_file(path)
+        timings['read'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        soup = parse_html(html, parser_name)
+        timings['soup'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = get_listing_index(soup)
+        timings['index'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        listings = get_listing_total(soup, index)
+        timings['total'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for num in sorted(index):
+            get_box_vals(index[num])
+        timings['box_vals'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for num in sorted(index):
+            get_results(index[num], extractor)
+        timings['results'] = time.perf_counter() - start
+
+        for stage, seconds in timings.items():
+            best[stage] = min(best[stage], seconds)
+        soup.decompose()
+
+    extraction = sum(best[stage] for stage in EXTRACTION_STAGES)
+    virtual_tour = 'Virtual Tour' in html
+    return {'path': path,
+            'listings': listings,
+            'virtual_tour': virtual_tour,
+            'group': page_group(listings, virtual_tour),
+            'seconds': best,
+            'listings_per_sec': listings / extraction if extraction > 0 else None,
+            # ru_maxrss is in kilobytes on linux
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+def run_isolated(path, parser_name, repeat):
+    """
+    Runs bench_page() in a new process, so the peak RSS isn't carried over
+    from earlier pages
+
+    Parameters
+    ----------
+    path, parser_name, repeat : see bench_page()
+    """
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(bench_page, (path, parser_name, repeat))
+
+def summarize(pages):
+    """
+    Adds up the page results per group. Returns a dictionary of group ->
+    pages, listings, seconds per stage, listings/sec and the highest peak RSS
+
+    Parameters
+    ----------
+    pages : list of dictionaries returned from bench_page()
+    """
+    groups = {}
+    for page in pages:
+        group = groups.setdefault(page['group'], {'pages': 0,
+                                                  'listings': 0,
+                                                  'seconds': dict.fromkeys(STAGES, 0.0),
+                                                  'peak_rss_mb': 0.0})
+        group['pages'] += 1
+        group['listings'] += page['listings']
+        for stage, seconds in page['seconds'].items():
+            group['seconds'][stage] += seconds
+        group['peak_rss_mb'] = max(group['peak_rss_mb'], page['peak_rss_mb'])
+    for group in groups.values():
+        extraction = sum(group['seconds'][stage] for stage in EXTRACTION_STAGES)
+        group['listings_per_sec'] = group['listings'] / extraction if extraction > 0 else None
+    return groups
+
+def git_revision():
+    """
+    Returns the commit the benchmark ran on, or None outside of a git checkout
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(groups, baseline, tolerance):
+    """
+    Prints the listings/sec change of every group against an earlier run.
+    Returns the names of the groups that got slower than tolerance allows
+
+    Parameters
+    ----------
+    groups : dictionary returned from summarize()
+
+    baseline : results dictionary of an earlier run, as written by main()
+
+    tolerance : allowed relative drop, e.g. 0.2 for 20%
+    """
+    regressions = []
+    for name, group in sorted(groups.items()):
+        before = baseline.get('groups', {}).get(name, {}).get('listings_per_sec')
+        if not before or not group['listings_per_sec']:
+            continue
+        change = group['listings_per_sec'] / before - 1
+        slower = change < -tolerance
+        if slower:
+            regressions.append(name)
+        print(f"  {name:<10} {before:9.1f} -> {group['listings_per_sec']:9.1f} listings/sec "
+              f"({change:+.0%}){'  REGRESSION' if slower else ''}")
+    return regressions
+
+def main():
+    args = parser.parse_args()
+    paths = list(args.pages)
+    if args.archive is not None:
+        paths.extend(report_archive.object_paths(args.archive))
+    if not paths:
+        sys.exit("No pages to benchmark, pass saved pages and/or --archive")
+
+    pages = []
+    for path in paths:
+        page = run_isolated(path, args.parser, args.repeat)
+        pages.append(page)
+        stages = "  ".join(f"{stage}: {page['seconds'][stage] * 1000:8.1f}ms" for stage in STAGES)
+        print(f"{path}\n  {page['group']:<10} listings: {page['listings']:4d}  {stages}\n"
+              f"  listings/sec: {page['listings_per_sec'] or 0:9.1f}  peak rss: {page['peak_rss_mb']:7.1f} MB")
+
+    groups = summarize(pages)
+    print("groups:")
+    for name, group in sorted(groups.items()):
+        print(f"  {name:<10} pages: {group['pages']:3d}  listings: {group['listings']:5d}  "
+              f"listings/sec: {group['listings_per_sec'] or 0:9.1f}  peak rss: {group['peak_rss_mb']:7.1f} MB")
+    missing = [page_group(size, vt) for size in (1, 10, 100) for vt in (False, True)
+               if page_group(size, vt) not in groups]
+    if missing:
+        print(f"no pages in the corpus for: {', '.join(missing)} (see synthetic_report.py)")
+
+    results = {'created': dt.datetime.now().isoformat(timespec='seconds'),
+               'revision': git_revision(),
+               'python': platform.python_version(),
+               'parser': args.parser,
+               'repeat': args.repeat,
+               'pages': pages,
+               'groups': groups}
+    if args.output is not None:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=1)
+
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        print(f"compared to {args.compare} ({baseline.get('revision')}):")
+        if compare(groups, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3.6
+
+# startup time budget for the command line entry points: times `<script> --help`
+# in a fresh interpreter and checks that importing the script leaves the slow
+# dependencies (pandas, selenium, bigquery, the gmail api client) unimported.
+# exits with 1 when an entry point is over its budget or imports one of them
+# usage: python benchmarks/bench_startup.py --repeat 5
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# seconds for `<script> --help`, best of --repeat runs
+STARTUP_BUDGETS = {'listing_scraper.py':0.3,
+                   'get_listing_token.py':0.15,
+                   'pipeline.py':0.35}
+
+# modules only the code paths that parse html, talk to a browser, pandas or google load
+DEFERRED_MODULES = ('bs4',
+                    'pandas',
+                    'numpy',
+                    'selenium',
+                    'requests',
+                    'google.cloud.bigquery',
+                    'google.api_core',
+                    'googleapiclient',
+                    'apiclient',
+                    'oauth2client')
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--repeat",type=int,default=5)
+parser.add_argument("--scale",type=float,default=1.0,help="multiply every budget, e.g. on a slow machine")
+
+def time_help(script,repeat):
+    """
+    Returns the best wall time (seconds) of running `script --help` in a new
+    python process, out of repeat runs
+
+    Parameters
+    ----------
+    script : string file name of the entry point, relative to the repository
+
+    repeat : integer number of timed runs
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(ROOT, script), '--help'],
+                       check=True, stdout=subprocess.DEVNULL, cwd=ROOT)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def loaded_deferred_modules(script):
+    """
+    Imports the entry point in a new python process and returns the
+    DEFERRED_MODULES that got imported with it
+
+    Parameters
+    ----------
+    script : string file name of the entry point, relative to the repository
+    """
+    module = os.path.splitext(script)[0]
+    check = (f"import sys, json; import {module}; "
+             f"print(json.dumps([m for m in {list(DEFERRED_MODULES)!r} if m in sys.modules]))")
+    output = subprocess.run([sys.executable, '-c', check], check=True,
+                            stdout=subprocess.PIPE, cwd=ROOT).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+def main():
+    args = parser.parse_args()
+    over_budget = False
+    for script, budget in STARTUP_BUDGETS.items():
+        budget *= args.scale
+        seconds = time_help(script, args.repeat)
+        loaded = loaded_deferred_modules(script)
+        ok = seconds <= budget and not loaded
+        over_budget = over_budget or not ok
+        print(f"{script:<22} --help: {seconds:6.3f}s  budget: {budget:5.2f}s  "
+              f"eager imports: {', '.join(loaded) or 'none'}  {'ok' if ok else 'OVER'}")
+    if over_budget:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3.6
+
+# generates synthetic Customer Report pages with the layout the scraper reads:
+# one <span id="L{n}"> per listing holding its tables in page order, the
+# listing box, the photo counter, the two label tables and the label/value
+# field tables described by listing_schema.json. Every size is written twice,
+# the second time with a 'Virtual Tour' row on every third listing, which moves
+# every later table of that listing down by one. Values are random but fixed by
+# --seed, so a corpus can be rebuilt exactly to reproduce a benchmark run.
+# The label tables are laid out the way the original split based extractor
+# reads them, so benchmarks/bench_baseline.py can check a corpus against it.
+# usage: python benchmarks/synthetic_report.py corpus/
+#        python benchmarks/synthetic_report.py corpus/ --sizes 5 40 120 --gzip
+#        python benchmarks/bench_baseline.py corpus/*
+#        python benchmarks/bench_stages.py corpus/*
+
+import os
+import sys
+import gzip
+import random
+import argparse
+from html import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from listing_scraper import load_schema
+
+# small, medium and large in bench_stages.py's SIZE_GROUPS
+DEFAULT_SIZES = (5, 40, 120)
+# labels of the two label tables (the anchor first) and the cells whose text
+# ends in blank lines on the real page, see label_replace in listing_schema.json
+LABEL_ROWS = (('Bedrooms', 'Full Baths', 'Half Baths', 'Master Bath', 'For Lease', 'Tax Condo #'),
+              ('Taxes', 'Approx Lot Dimensions', 'Sewer', 'Water Source', 'Style', 'Sub-Style'))
+TRAILING_BLANK_LINES = ('Tax Condo #', 'Sub-Style')
+# tables that hold no field, in the order they appear in front of the label tables
+FILLER = ('Customer Report', None, 'Remarks', 'Directions', 'Showing Instructions', 'Listing Office',
+          'Listing Agent', 'Co-Listing Agent', 'Compensation', 'Status', 'Photos', 'Map',
+          'Disclosures', 'Rooms', 'Room Sizes')
+# table holding the listing id, photos and the listing box
+HEADER_TABLE = 1
+# the 'Virtual Tour' row is a table of its own, right after the header table
+VIRTUAL_TOUR_TABLE = 2
+
+TOWNS = (('Hoboken', '07030', 'HUDSON'), ('Montclair', '07042', 'ESSEX'), ('Ridgewood', '07450', 'BERGEN'),
+         ('Westfield', '07090', 'UNION'), ('Princeton', '08540', 'MERCER'), ('Summit', '07901', 'UNION'))
+STREETS = ('Maple Ave', 'Park St', 'Washington St', 'Hillside Rd', 'Orchard Ln', 'Bloomfield Ave')
+WORDS = ('Gas', 'Forced Air', 'Central Air', 'Hardwood', 'Finished', 'Attached', 'Wood Burning',
+         'Dishwasher', 'Refrigerator', 'Washer', 'Dryer', 'Fee Simple', 'Colonial', 'Lake', 'None',
+         'Pool', 'Gym', 'Doorman', 'Elevator', 'Closing', 'Cats OK', 'In Unit', 'City', 'Park')
+
+def field_tables(schema):
+    """
+    Returns a dictionary of table number -> list of (cell number, label) for
+    the field tables of a listing without a Virtual Tour row
+
+    Parameters
+    ----------
+    schema : dictionary returned from listing_scraper.load_schema()
+    """
+    tables = {}
+    for field in schema['fields']:
+        tables.setdefault(field['table'], []).append((field['cell'], field['label']))
+    return tables
+
+def cell(text):
+    """
+    Returns the html of one table cell on its own line, the way the report indents them
+    """
+    return f'\n\t<td>{text}</td>'
+
+def table(cells):
+    """
+    Returns the html of a one-row table of cells
+    """
+    return '<table><tr>{}\n</tr></table>\n'.format(''.join(cells))
+
+def label_row(texts):
+    """
+    Returns the html of a one-row label table (labels or values). The
+    original extractor split the text of these tables on '\n\t', so the
+    cells are separated by '\n\t' with nothing in front of the first one,
+    and the row ends in '\n\t\n', which that split turns into a '\n' it skips
+    """
+    return '<table><tr>{}\n\t\n</tr></table>\n'.format('\n\t'.join(f'<td>{text}</td>' for text in texts))
+
+def listing_values(rng, num):
+    """
+    Returns the random values of one listing: the listing id, the listing
+    box (label, text) pairs and the photo count
+    """
+    town, zipcode, county = rng.choice(TOWNS)
+    price = rng.randrange(150, 3000) * 1000
+    box = (('LP', f'${price:,}'),
+           ('ML#', str(1900000 + num)),
+           ('Addr', f'{rng.randrange(1, 999)} {rng.choice(STREETS)}'),
+           ('Town', town),
+           ('Zip', zipcode),
+           ('County', county),
+           ('County Locale#', str(rng.randrange(100, 999))),
+           ('Area#', str(rng.randrange(10, 99))),
+           ('Direct', f'{rng.choice(STREETS)} to {rng.choice(STREETS)}'),
+           ('Orig LP', f'${price + rng.choice((0, 0, 10000, 25000)):,}'),
+           ('DOM', str(rng.randrange(0, 400))))
+    return str(3000000 + num), box, rng.randrange(1, 30)
+
+def value(rng, label):
+    """
+    Returns a random html value for a label/value cell. Some are &nbsp;, the
+    way the report shows a value that was never entered
+    """
+    if rng.random() < 0.15:
+        return '&nbsp;'
+    if label in ('Taxes', 'Monthly Maint', 'Assessments', 'Municipal Assessment', 'Building Assoc Charges'):
+        return f'${rng.randrange(100, 30000):,}'
+    if label in ('Bedrooms', 'Full Baths', 'Half Baths', '# of Stories', 'Yrs Remaining', '# of Shares'):
+        return str(rng.randrange(1, 6))
+    if label == 'Year Built':
+        return str(rng.randrange(1880, 2019))
+    return escape(', '.join(rng.sample(WORDS, rng.randrange(1, 4))))
+
+def build_listing(rng, schema, num, virtual_tour):
+    """
+    Returns the html of one listing span
+
+    Parameters
+    ----------
+    rng : random.Random
+
+    schema : dictionary returned from listing_scraper.load_schema()
+
+    num : integer listing number, the span id is L{num}
+
+    virtual_tour : add a 'Virtual Tour' row
+    """
+    listing_id, box, photos = listing_values(rng, num)
+    label_tables = [(entry['labels'], entry['values'], labels)
+                    for entry, labels in zip(schema['label_tables'], LABEL_ROWS)]
+    fields = field_tables(schema)
+    last = max(list(fields) + [values for _, values, _ in label_tables])
+
+    tables = []
+    for number in range(last + 1):
+        if number == HEADER_TABLE:
+            box_html = '<br>\n'.join(f'<b>{label}:</b>\n{escape(text)}' for label, text in box)
+            tables.append(table([f'\n\t<td width="45%"><div id="{listing_id}">'
+                                 f'<img src="http://pxlimages.xmlsweb.com/NJMLS/M/Images/{listing_id}.1.JPG?v=1"></div>'
+                                 f'<div id="CountDiv{listing_id}">1 of {photos}&nbsp;HD</div></td>',
+                                 f'\n\t<td width="55%">\n{box_html}\n</td>']))
+            continue
+        label_table = [(labels, values, names) for labels, values, names in label_tables if number in (labels, values)]
+        if label_table:
+            labels, values, names = label_table[0]
+            if number == labels:
+                tables.append(label_row([name + ('\n\n' if name in TRAILING_BLANK_LINES else '') for name in names]))
+            else:
+                tables.append(label_row([value(rng, name) for name in names]))
+        elif number in fields:
+            cells = {}
+            for position, label in fields[number]:
+                cells[position - 1] = cell(f'{escape(label)}:')
+                # easements are often left out completely, an empty cell
+                cells[position] = cell('' if label == 'Easements' and rng.random() < 0.3 else value(rng, label))
+            tables.append(table([cells[position] for position in sorted(cells)]))
+        else:
+            title = FILLER[number] if number < len(FILLER) and FILLER[number] else f'Section {number}'
+            tables.append(table([cell(title), cell(escape(' '.join(rng.sample(WORDS, 3))))]))
+    if virtual_tour:
+        tables.insert(VIRTUAL_TOUR_TABLE, table([cell(f'<a href="http://tours.example.com/{listing_id}">Virtual Tour</a>')]))
+    return f'<span id="L{num}">\n{"".join(tables)}</span>\n'
+
+def build_report(listings, virtual_tour=False, seed=0, schema=None):
+    """
+    Returns the html of a synthetic Customer Report page
+
+    Parameters
+    ----------
+    listings : integer number of listings on the page
+
+    virtual_tour : give every third listing (the first one included) a 'Virtual Tour' row
+
+    seed : integer seed of the random values
+
+    schema : dictionary returned from listing_scraper.load_schema(), listing_schema.json when not given
+    """
+    rng = random.Random(seed)
+    schema = schema if schema is not None else load_schema()
+    body = ''.join(build_listing(rng, schema, num, virtual_tour and num % 3 == 0) for num in range(listings))
+    return ('<!DOCTYPE html>\n<html><head><title>Customer Report</title></head>\n'
+            f'<body>\n{body}</body></html>\n')
+
+parser = argparse.ArgumentParser()
+parser.add_argument("output",help="directory to write the pages to")
+parser.add_argument("--sizes",nargs="+",type=int,default=list(DEFAULT_SIZES),help="listings per page, one page with and one without Virtual Tour rows per size")
+parser.add_argument("--seed",type=int,default=0)
+parser.add_argument("--gzip",action="store_true",help="write .html.gz instead of .html")
+
+def main():
+    args = parser.parse_args()
+    os.makedirs(args.output, exist_ok=True)
+    for size in args.sizes:
+        for virtual_tour in (False, True):
+            html = build_report(size, virtual_tour, seed=args.seed + size)
+            name = f"report_{size}{'_vt' if virtual_tour else ''}.html"
+            path = os.path.join(args.output, name + ('.gz' if args.gzip else ''))
+            with (gzip.open(path, 'wt', encoding='utf-8') if args.gzip else open(path, 'w', encoding='utf-8')) as page:
+                page.write(html)
+            print(f"{path} ({size} listings, {len(html) / 1e6:.1f} MB)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3.6
+
+# BigQuery sink for scraped housing rows. Rows are written in batches either
+# as load jobs from an in-memory NDJSON buffer or as streaming inserts.
+# Every call goes through the client passed in, so a local stand-in object with
+# load_table_from_file()/get_job()/insert_rows_json() can be used in place of bigquery.Client.
+# google.cloud.bigquery is only imported once rows are written
+
+import io
+import json
+import time
+import uuid
+import datetime as dt
+
+SINK_MODES = ('load','stream')
+DEFAULT_TABLE = 'housing.mls'
+DEFAULT_BATCH_SIZE = 500
+
+def retryable_errors():
+    """
+    Returns the exception types worth another attempt: rate limits and
+    transient server side failures
+    """
+    from google.api_core import exceptions as api_exceptions
+    return (api_exceptions.TooManyRequests,
+            api_exceptions.InternalServerError,
+            api_exceptions.BadGateway,
+            api_exceptions.ServiceUnavailable,
+            api_exceptions.GatewayTimeout)
+
+def partition_table(table_id,partition_date):
+    """
+    Returns the table id with a partition decorator, e.g. housing.mls$20190601.
+    Writing to the decorated table fills the same partition that
+    _PARTITIONTIME = TIMESTAMP('2019-06-01') selects
+
+    Parameters
+    ----------
+    table_id : string dataset.table id
+
+    partition_date : datetime.date or 'YYYY-MM-DD' string
+    """
+    if isinstance(partition_date,str):
+        partition_date = dt.date.fromisoformat(partition_date)
+    return f"{table_id}${partition_date:%Y%m%d}"
+
+def to_ndjson(rows):
+    """
+    Serializes a batch of row dictionaries into an in-memory newline delimited
+    json buffer, the format load_table_from_file() reads
+
+    Parameters
+    ----------
+    rows : list of dictionaries, column name -> value
+    """
+    buffer = io.BytesIO()
+    for row in rows:
+        buffer.write(json.dumps(row,ensure_ascii=False).encode('utf-8'))
+        buffer.write(b'\n')
+    buffer.seek(0)
+    return buffer
+
+def with_retry(call,retries=3,backoff=2.0):
+    """
+    Runs call(), retrying retryable_errors() with exponential backoff
+
+    Parameters
+    ----------
+    call : function without arguments
+
+    retries : number of extra attempts after the first one
+
+    backoff : seconds to wait before the first retry, doubled after every attempt
+    """
+    retryable = retryable_errors()
+    for attempt in range(retries + 1):
+        try:
+            return call()
+        except retryable:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+def load_batch(client,rows,table_id,retries=3):
+    """
+    Writes one batch of rows with a load job and waits for it to complete.
+    Returns the number of rows BigQuery reports as loaded
+
+    Parameters
+    ----------
+    client : bigquery.Client or a stand-in with load_table_from_file() and get_job()
+
+    rows : list of dictionaries, column name -> value
+
+    table_id : string table id, see partition_table()
+
+    retries : see with_retry()
+    """
+    from google.cloud import bigquery
+    from google.api_core.exceptions import Conflict
+    job_config = bigquery.LoadJobConfig(source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+                                        write_disposition=bigquery.WriteDisposition.WRITE_APPEND)
+    # the job id is kept across attempts, so when an attempt submitted the job
+    # and only its response got lost, the retry finds that job instead of
+    # appending the rows a second time
+    job_ids = [f"mls_load_{uuid.uuid4().hex}"]
+    def run_job():
+        try:
+            job = client.load_table_from_file(to_ndjson(rows),table_id,job_id=job_ids[-1],job_config=job_config)
+        except Conflict:
+            job = client.get_job(job_ids[-1])
+        try:
+            job.result()
+        except retryable_errors():
+            if job.error_result is not None:
+                # the job itself failed and loaded nothing, the next attempt is a new job
+                job_ids.append(f"mls_load_{uuid.uuid4().hex}")
+            raise
+        return job.output_rows if job.output_rows is not None else len(rows)
+    return with_retry(run_job,retries)
+
+def stream_batch(client,rows,table_id,retries=3):
+    """
+    Writes one batch of rows with streaming inserts. Rows rejected by BigQuery
+    raise a RuntimeError. Returns the number of rows inserted
+
+    Parameters
+    ----------
+    client : bigquery.Client or a stand-in with insert_rows_json()
+
+    rows : list of dictionaries, column name -> value
+
+    table_id : string table id, see partition_table()
+
+    retries : see with_retry()
+    """
+    # the insert ids are kept across attempts, so when a failed attempt did
+    # write the rows, BigQuery drops them as duplicates on the retry
+    row_ids = [uuid.uuid4().hex for _ in rows]
+    errors = with_retry(lambda: client.insert_rows_json(table_id,rows,row_ids=row_ids),retries)
+    if errors:
+        raise RuntimeError(f"BigQuery rejected {len(errors)} rows, first error: {errors[0]}")
+    return len(rows)
+
+def write_rows(client,rows,table_id=DEFAULT_TABLE,partition_date=None,mode='load',batch_size=DEFAULT_BATCH_SIZE,retries=3):
+    """
+    Writes rows to a (time partitioned) BigQuery table in batches and waits
+    for every batch to finish. Returns a dictionary with the number of rows and
+    batches written, the elapsed seconds and the rows per second
+
+    Parameters
+    ----------
+    client : bigquery.Client or a local stand-in, see the module comment
+
+    rows : list of dictionaries, column name -> value
+
+    table_id : string dataset.table id
+
+    partition_date : datetime.date or 'YYYY-MM-DD' string of the partition to
+                     write to. None writes to the table without a decorator
+
+    mode : 'load' for load jobs, 'stream' for streaming inserts
+
+    batch_size : maximum number of rows per load job / insert request
+
+    retries : see with_retry()
+    """
+    if mode not in SINK_MODES:
+        raise ValueError(f"Unknown sink mode {mode!r}, expected one of {SINK_MODES}")
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    write_batch = load_batch if mode == 'load' else stream_batch
+    destination = partition_table(table_id,partition_date) if partition_date is not None else table_id
+
+    start = time.perf_counter()
+    written = 0
+    batches = 0
+    for first in range(0,len(rows),batch_size):
+        written += write_batch(client,rows[first:first + batch_size],destination,retries)
+        batches += 1
+    seconds = time.perf_counter() - start
+    return {'rows':written,
+            'batches':batches,
+            'seconds':seconds,
+            'rows_per_sec':written / seconds if seconds > 0 else float('inf')}
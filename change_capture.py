@@ -0,0 +1,127 @@
+#!/usr/bin/env python3.6
+
+# Change-data capture for the daily load. A content hash of every listing is
+# kept per ml_num in a local json state file, so only new or changed listings
+# (price change, new photos, relisting, ...) are loaded in full. Listings that
+# are unchanged since the last run produce a small delta record instead.
+#
+# days_on_mkt grows by one every day, so it is left out of the hash. It counts
+# as a change only when it differs from the value expected from the last run
+# (last days_on_mkt + days since), e.g. when a listing is taken off and relisted.
+
+import os
+import json
+import hashlib
+import datetime as dt
+
+DEFAULT_STATE_PATH = 'listing_state.json'
+DEFAULT_DELTA_TABLE = 'housing.mls_delta'
+KEY_COLUMN = 'ml_num'
+VOLATILE_COLUMNS = ('days_on_mkt',)
+DELTA_COLUMNS = ('ml_num','last_price','days_on_mkt')
+
+def load_state(path=DEFAULT_STATE_PATH):
+    """
+    Reads the state file of earlier runs. Returns a dictionary of
+    ml_num -> {'hash', 'days_on_mkt', 'date'}, empty when the file does not exist
+
+    Parameters
+    ----------
+    path : string path of the json state file
+    """
+    try:
+        with open(path) as state_file:
+            return json.load(state_file)
+    except FileNotFoundError:
+        return {}
+
+def save_state(state,path=DEFAULT_STATE_PATH):
+    """
+    Writes the state file, replacing the old one only once the new one is complete
+
+    Parameters
+    ----------
+    state : dictionary returned from load_state() and updated by split_changes()
+
+    path : string path of the json state file
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path,'w') as state_file:
+        json.dump(state,state_file,separators=(',',':'))
+    os.replace(tmp_path,path)
+
+def content_hash(row):
+    """
+    Returns a hex digest of every value of a row except VOLATILE_COLUMNS
+
+    Parameters
+    ----------
+    row : dictionary, column name -> sanitized value
+    """
+    content = {name:value for name, value in row.items() if name not in VOLATILE_COLUMNS}
+    return hashlib.blake2b(json.dumps(content,sort_keys=True,ensure_ascii=False).encode('utf-8'),
+                           digest_size=16).hexdigest()
+
+def to_int(value):
+    """
+    Returns a sanitized value as an int, or None for 'empty' and other non numbers
+
+    Parameters
+    ----------
+    value : string or number
+    """
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+def dom_as_expected(days_on_mkt,seen,scrape_date):
+    """
+    True when days_on_mkt is what the last run's value has grown to by scrape_date
+
+    Parameters
+    ----------
+    days_on_mkt : int or None, value scraped today
+
+    seen : state entry of the listing, see load_state()
+
+    scrape_date : datetime.date of this run
+    """
+    if days_on_mkt is None or seen.get('days_on_mkt') is None:
+        return days_on_mkt == seen.get('days_on_mkt')
+    elapsed = (scrape_date - dt.date.fromisoformat(seen['date'])).days
+    return days_on_mkt == seen['days_on_mkt'] + elapsed
+
+def split_changes(rows,state,scrape_date):
+    """
+    Splits sanitized BigQuery rows into the rows to load in full (new or changed
+    listings, and rows without an ml_num) and delta records for the unchanged ones.
+    state is updated in place; call save_state() once both have been loaded.
+    Returns a tuple of (changed rows, delta records)
+
+    Parameters
+    ----------
+    rows : list of dictionaries, column name -> sanitized value
+
+    state : dictionary returned from load_state()
+
+    scrape_date : datetime.date or 'YYYY-MM-DD' string of this run
+    """
+    if isinstance(scrape_date,str):
+        scrape_date = dt.date.fromisoformat(scrape_date)
+    changed = []
+    deltas = []
+    for row in rows:
+        ml_num = row.get(KEY_COLUMN)
+        if ml_num in (None, '', 'empty'):
+            changed.append(row)
+            continue
+        digest = content_hash(row)
+        days_on_mkt = to_int(row.get('days_on_mkt'))
+        seen = state.get(ml_num)
+        if seen is not None and seen['hash'] == digest and dom_as_expected(days_on_mkt,seen,scrape_date):
+            deltas.append({name:row.get(name) for name in DELTA_COLUMNS})
+        else:
+            changed.append(row)
+        state[ml_num] = {'hash':digest,'days_on_mkt':days_on_mkt,'date':str(scrape_date)}
+    return changed, deltas
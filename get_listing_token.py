@@ -1,16 +1,9 @@
 #!/usr/bin/env python3.6
 
-from googleapiclient.discovery import build
-from httplib2 import Http
-from oauth2client import file, client, tools
-import os, logging, sys, argparse, email, base64, time, pytz, html5lib, requests
-from oauth2client.client import flow_from_clientsecrets
-from oauth2client.client import FlowExchangeError
-from apiclient.discovery import build
-from apiclient import errors
-from bs4 import BeautifulSoup
-import numpy as np
-import pandas as pd
+# the google api client, oauth2client and beautiful soup are imported in the
+# functions that use them, so --help and importing this module stay fast and
+# need no credentials
+import os, argparse, email, email.utils, base64, json
 import datetime as dt
 
 def gprint(text):
@@ -23,17 +16,32 @@ def bprint(text):
     
 parser = argparse.ArgumentParser()
 parser.add_argument("--user",default="<email>")
+parser.add_argument("--sender",default="patty@paulaclarkrealtor.com",help="only messages from this address are fetched")
+parser.add_argument("--state",default="token_state.json",help="json file remembering which messages were already processed")
+parser.add_argument("--full",action="store_true",help="ignore the state file and go through every message again")
+parser.add_argument("--batch-size",type=int,default=50,help="messages fetched per batch http request (gmail allows up to 100)")
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = 'https://www.googleapis.com/auth/gmail.readonly'
 
+def GetService():
+    """Authorize with the stored credentials and build the Gmail API service.
 
-store = file.Storage('token.json')
-creds = store.get()
-if not creds or creds.invalid:
-    flow = client.flow_from_clientsecrets('credentials.json', SCOPES)
-    creds = tools.run_flow(flow, store)
-service = build('gmail', 'v1', http=creds.authorize(Http()))
+  Runs the OAuth flow in the browser when token.json is missing or invalid.
+
+  Returns:
+    Authorized Gmail API service instance.
+  """
+    from apiclient.discovery import build
+    from httplib2 import Http
+    from oauth2client import file, client, tools
+
+    store = file.Storage('token.json')
+    creds = store.get()
+    if not creds or creds.invalid:
+        flow = client.flow_from_clientsecrets('credentials.json', SCOPES)
+        creds = tools.run_flow(flow, store)
+    return build('gmail', 'v1', http=creds.authorize(Http()))
 
 def ListMessages(service, user, query=''):
     """Gets a list of messages.
@@ -47,68 +55,247 @@ def ListMessages(service, user, query=''):
       List of messages that match the criteria of the query. Note that the
       returned list contains Message IDs, you must use get with the
       appropriate id to get the details of a Message.
+
+    Raises:
+      apiclient.errors.HttpError when a list request fails, after printing it.
     """
+    from apiclient import errors
     try:
         response = service.users().messages().list(userId=user, q=query).execute()
-        messages = response['messages']
+        messages = response.get('messages', [])
 
         while 'nextPageToken' in response:
             page_token = response['nextPageToken']
             response = service.users().messages().list(userId=user, q=query,
                                          pageToken=page_token).execute()
-            messages.extend(response['messages'])
+            messages.extend(response.get('messages', []))
 
         return messages
-    except (errors.HttpError, error):
+    except errors.HttpError as error:
+        # revoked credentials (401) included, the caller decides what to do
         print ('An error occurred: %s' % error)
-        if error.resp.status == 401:
-      # Credentials have been revoked.
-      # TODO: Redirect the user to the authorization URL.
-          raise NotImplementedError()
+        raise
             
-def GetMimeMessage(service, user_id, msg_id):
-    """Get a Message and use it to create a MIME Message.
+def GetMimeMessages(service, user_id, msg_ids, batch_size=50):
+    """Get many Messages as MIME Messages, batch_size Messages per HTTP round trip.
 
   Args:
     service: Authorized Gmail API service instance.
     user_id: User's email address. The special value "me"
     can be used to indicate the authenticated user.
-    msg_id: The ID of the Message required.
+    msg_ids: List of the IDs of the Messages required.
+    batch_size: Number of Messages fetched per batch request, at most 100.
 
   Returns:
-    A MIME Message, consisting of data from Message.
+    A list of (Message ID, MIME Message, internalDate) tuples in the same order as msg_ids.
+    internalDate is the time Gmail received the Message, in epoch milliseconds.
+    Messages that could not be fetched (e.g. a rate limited sub-request of
+    the batch) are left out.
   """
+    mime_msgs = {}
+
+    def collect(request_id, response, exception):
+        if exception is not None:
+            print ('An error occurred: %s' % exception)
+            return
+        msg_str = base64.urlsafe_b64decode(response['raw'].encode('ASCII'))
+        mime_msgs[request_id] = (request_id, email.message_from_bytes(msg_str), int(response['internalDate']))
+
+    for first in range(0, len(msg_ids), batch_size):
+        batch = service.new_batch_http_request(callback=collect)
+        for msg_id in msg_ids[first:first + batch_size]:
+            batch.add(service.users().messages().get(userId=user_id, id=msg_id,
+                                                     format='raw'), request_id=msg_id)
+        batch.execute()
+
+    return [mime_msgs[msg_id] for msg_id in msg_ids if msg_id in mime_msgs]
+
+def GetTokenUrl(msg):
+    """Find the tokenized mls login link in a listing email.
+
+  Args:
+    msg: MIME Message sent by the realtor.
+
+  Returns:
+    The tokenlogin url, or None when the Message has no token.
+  """
+    from bs4 import BeautifulSoup
     try:
-        message = service.users().messages().get(userId=user_id, id=msg_id,
-                                             format='raw').execute()
+        links = BeautifulSoup(msg.get_payload(),'html5lib').findAll('a')
+        token = [link.replace('"','')[2:] for link in [link.get('?token') for link in links] if link is not None][0]
+    except:
+        return None
+    return f"http://www.priv.njmlsnew.xmlsweb.com/cc2/account/tokenlogin?token={token}"
+
+# a Message that failed this many times is given up on
+MAX_ATTEMPTS = 5
+
+def LoadState(path):
+    """Load the high-water mark of earlier runs.
+
+  Args:
+    path: Path of the json state file. A missing file means nothing was processed yet.
+
+  Returns:
+    A dict with 'newest_internal_date' (epoch milliseconds of the newest
+    processed Message, 0 when none), 'processed' (Message ID -> internalDate)
+    and 'retry' (Message ID -> failed attempts, for Messages to fetch again).
+  """
+    try:
+        with open(path) as state_file:
+            state = json.load(state_file)
+    except FileNotFoundError:
+        state = {}
+    return {'newest_internal_date': state.get('newest_internal_date', 0),
+            'processed': state.get('processed', {}),
+            'retry': state.get('retry', {})}
+
+def SaveState(path, state):
+    """Write the state file, replacing the old one only once the new one is complete.
+
+  Args:
+    path: Path of the json state file.
+    state: Dict returned from LoadState() and updated by HarvestTokenUrls().
+  """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as state_file:
+        json.dump(state, state_file)
+    os.replace(tmp_path, path)
+
+def FetchNewMessages(service, user_id, sender, state, batch_size=50):
+    """List and fetch the Messages that arrived since the last run, and the ones to retry.
+
+  Gmail's after: search has one second resolution, so the query starts one
+  second before the newest processed Message and the IDs processed around
+  that time are skipped. state is not changed, see MarkProcessed() and MarkRetry().
+
+  Args:
+    service: Authorized Gmail API service instance.
+    user_id: User's email address. The special value "me"
+    can be used to indicate the authenticated user.
+    sender: Email address the listing emails come from.
+    state: Dict returned from LoadState().
+    batch_size: Number of Messages fetched per batch request.
 
-        print ('Message snippet: %s' % message['snippet'])
+  Returns:
+    A tuple (fetched, failed). fetched is a list of (Message ID, MIME Message,
+    internalDate) tuples, oldest first. failed lists the IDs that could not be fetched.
+  """
+    query = 'from:{}'.format(sender)
+    if state['newest_internal_date']:
+        query += ' after:{}'.format(state['newest_internal_date'] // 1000 - 1)
+    msg_ids = [message['id'] for message in ListMessages(service, user_id, query=query)
+               if message['id'] not in state['processed'] and message['id'] not in state['retry']]
+    msg_ids += list(state['retry'])
+
+    fetched = GetMimeMessages(service, user_id, msg_ids, batch_size)
+    fetched_ids = {msg_id for msg_id, _, _ in fetched}
+    failed = [msg_id for msg_id in msg_ids if msg_id not in fetched_ids]
+    return sorted(fetched, key=lambda message: message[2]), failed
+
+def GetSenderTokenUrl(msg, sender):
+    """Find the tokenized mls login link in a Message, if it was sent by sender.
+
+  Args:
+    msg: MIME Message.
+    sender: Email address the listing emails come from.
+
+  Returns:
+    The tokenlogin url, or None when the Message is from someone else or has no token.
+  """
+    if email.utils.parseaddr(msg['From'] or '')[1].lower() != sender.lower():
+        return None
+    return GetTokenUrl(msg)
 
-        msg_str = base64.urlsafe_b64decode(message['raw'].encode('ASCII'))
+def MarkProcessed(state, msg_id, internal_date):
+    """Record a Message as done, it is neither listed nor retried again.
 
-        mime_msg = email.message_from_bytes(msg_str)
+  Args:
+    state: Dict returned from LoadState().
+    msg_id: The ID of the Message.
+    internal_date: internalDate of the Message, in epoch milliseconds.
+  """
+    state['processed'][msg_id] = internal_date
+    state['newest_internal_date'] = max(state['newest_internal_date'], internal_date)
+    state['retry'].pop(msg_id, None)
+
+def MarkRetry(state, msg_id, attempts):
+    """Keep a Message that failed to be fetched again on the next run.
+
+  Args:
+    state: Dict returned from LoadState().
+    msg_id: The ID of the Message.
+    attempts: Number of times the Message failed so far, this time included.
+
+  Returns:
+    False when the Message failed MAX_ATTEMPTS times and was given up on.
+  """
+    if attempts >= MAX_ATTEMPTS:
+        state['retry'].pop(msg_id, None)
+        return False
+    state['retry'][msg_id] = attempts
+    return True
+
+def PruneProcessed(state):
+    """Forget the processed IDs that the next query can no longer list.
+
+  Args:
+    state: Dict returned from LoadState().
+  """
+    # the next query starts at the whole second before the newest Message,
+    # every ID from that second on can be listed again
+    since = (state['newest_internal_date'] // 1000 - 1) * 1000
+    state['processed'] = {msg_id: seen for msg_id, seen in state['processed'].items()
+                          if seen >= since}
+
+def HarvestTokenUrls(service, user_id, sender, state, batch_size=50):
+    """Fetch the Messages that arrived since the last run and return their tokens.
+
+  Every fetched Message is marked processed, Messages that could not be
+  fetched are kept to retry. state is updated in place; call SaveState()
+  once the urls have been handed on.
+
+  Args:
+    service: Authorized Gmail API service instance.
+    user_id: User's email address. The special value "me"
+    can be used to indicate the authenticated user.
+    sender: Email address the listing emails come from.
+    state: Dict returned from LoadState().
+    batch_size: Number of Messages fetched per batch request.
+
+  Returns:
+    A list of (Date header, tokenlogin url) tuples for the new Messages, oldest first.
+  """
+    fetched, failed = FetchNewMessages(service, user_id, sender, state, batch_size)
+    token_urls = []
+    for msg_id, msg, internal_date in fetched:
+        url = GetSenderTokenUrl(msg, sender)
+        if url is not None:
+            token_urls.append((msg['Date'], url))
+        MarkProcessed(state, msg_id, internal_date)
+    for msg_id in failed:
+        if not MarkRetry(state, msg_id, state['retry'].get(msg_id, 0) + 1):
+            print ('Giving up on message %s after %d failed fetches' % (msg_id, MAX_ATTEMPTS))
+    PruneProcessed(state)
+    return token_urls
 
-        return mime_msg
-    except errors.HttpError:
-        print ('An error occurred: %s')
-        
 def main():
     userID = parser.parse_args().user
-    MESSAGES = ListMessages(service,userID)
-    print ("user id: {}\nMessages: {}\n\n\n".format(userID,len(MESSAGES)))
-    
-    for _,message in enumerate (MESSAGES):
-        msg = GetMimeMessage(service,userID,message['id'])
-        if msg['From'] == '<patty@paulaclarkrealtor.com>':
-            date = msg['Date']
-            bprint (f"Message #{_} is from patty@paulaclarkrealtor.com\n\n")
-            try:
-                links = BeautifulSoup(msg.get_payload(),'html5lib').findAll('a')
-                token = [link.replace('"','')[2:] for link in [link.get('?token') for link in links] if link is not None][0]
-            except:
-                print("No token found!")
-                pass
-            gprint (f"{date} - http://www.priv.njmlsnew.xmlsweb.com/cc2/account/tokenlogin?token={token}\n\n")
+    sender = parser.parse_args().sender
+    state_path = parser.parse_args().state
+    if parser.parse_args().full:
+        state = {'newest_internal_date': 0, 'processed': {}, 'retry': {}}
+    else:
+        state = LoadState(state_path)
+    since = dt.datetime.fromtimestamp(state['newest_internal_date'] / 1000, tz=dt.timezone.utc) if state['newest_internal_date'] else 'the beginning'
+    print ("user id: {}\nNew messages since: {}\nMessages to retry: {}\n\n\n".format(userID, since, len(state['retry'])))
+
+    # the sender filter runs on gmail's side, only new matching messages are listed and downloaded
+    token_urls = HarvestTokenUrls(GetService(), userID, sender, state, parser.parse_args().batch_size)
+    for date, url in token_urls:
+        gprint (f"{date} - {url}\n\n")
+    SaveState(state_path, state)
+    bprint (f"{len(token_urls)} new tokens")
             
 if __name__ == "__main__":
     main()            
@@ -1,40 +1,85 @@
 #!/usr/bin/env python3.6
 
-# data cleaning, html parsing, and date/time management libraries
-import numpy as np
-import pandas as pd
-import requests
-import html5lib
+# date/time management libraries. pandas, selenium, requests, beautiful soup
+# and google.cloud.bigquery are slow to import and are imported inside the
+# functions that use them, so --help and the stages that don't need them
+# don't pay for them
 import time
 import datetime as dt
-import pytz
-
-# Selenium & BeautifulSoup scraping/web browser automation libraries
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.keys import Keys
-from bs4 import BeautifulSoup
-
-from selenium import webdriver
-from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.support.ui import WebDriverWait # available since 2.4.0
-from selenium.webdriver.support import expected_conditions as EC # available since 2.26.0
-from google.cloud import bigquery
-from time import sleep
 import sys
+import os
+import re
+import json
+import bz2
+import lzma
 import argparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+import bq_sink
+import change_capture
+import local_sink
+import photo_prefetch
+import price_history
+import report_archive
+import run_metrics
+
+DEFAULT_TIMEOUT = 60
+FETCH_MODES = ('auto','direct','selenium')
+PARSERS = ('lxml','html.parser','html5lib')
+DEFAULT_PARSER = 'lxml'
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),'listing_schema.json')
 
 parser = argparse.ArgumentParser()
-parser.add_argument("--url",<#REPLACE ME>')
+parser.add_argument("--url",default='<#REPLACE ME>')
+parser.add_argument("--urls-file",default=None,help="batch mode: file with report urls, or output of get_listing_token.py. '-' reads stdin")
+parser.add_argument("--from-html",nargs="+",default=None,metavar="PATH",help="replay mode: parse saved report pages (.html, .gz, .bz2, .xz) instead of scraping")
+parser.add_argument("--from-archive",default=None,metavar="DIR",help="replay mode: parse the pages stored in a report archive, see --archive")
+parser.add_argument("--archive-date",default=None,help="with --from-archive: only replay pages scraped on this YYYY-MM-DD date")
+parser.add_argument("--scrape-date",default=None,help="with --from-html: YYYY-MM-DD date the pages were scraped on, used for the BigQuery and parquet partitions and the price history. Needed unless the replay only goes to --output")
+parser.add_argument("--archive",default=None,metavar="DIR",help="keep a compressed copy of every fetched report page in this archive directory")
 parser.add_argument("--selenium",default="http://selenium:4444/wd/hub")
-client = bigquery.Client()
-TODAY = str(dt.date.today())
+parser.add_argument("--sessions",type=int,default=4,help="batch mode: selenium sessions open at the same time")
+parser.add_argument("--parse-workers",type=int,default=None,help="batch mode: worker processes for parsing, 0 parses in the main process")
+parser.add_argument("--fetch",default="auto",choices=FETCH_MODES,help="download the report over http, drive selenium, or try http first")
+parser.add_argument("--timeout",type=float,default=DEFAULT_TIMEOUT,help="seconds to wait for each page to be ready")
+parser.add_argument("--parser",default=DEFAULT_PARSER,choices=PARSERS,help="beautiful soup html parser backend")
+parser.add_argument("--streaming",action="store_true",help="parse the report one listing at a time to keep memory flat")
+parser.add_argument("--no-pandas",action="store_true",help="skip building a DataFrame when BigQuery is the only output")
+parser.add_argument("--table",default=bq_sink.DEFAULT_TABLE,help="time partitioned BigQuery table to load into")
+parser.add_argument("--sink",default="load",choices=bq_sink.SINK_MODES,help="BigQuery load jobs or streaming inserts")
+parser.add_argument("--batch-size",type=int,default=bq_sink.DEFAULT_BATCH_SIZE,help="rows per load job / insert request")
+parser.add_argument("--schema",default=SCHEMA_PATH,help="json file mapping output columns to their location on the report page")
+parser.add_argument("--output",default=None,help="write the rows to a local .csv, .ndjson or .parquet file instead of BigQuery")
+parser.add_argument("--parquet-dir",default=None,help="append typed rows to a parquet dataset partitioned by scrape date instead of loading to BigQuery")
+parser.add_argument("--photos",default=None,choices=photo_prefetch.PHOTO_MODES,help="check (head) or download (get) every listing photo and keep only the urls that work")
+parser.add_argument("--photo-cache",default=photo_prefetch.DEFAULT_CACHE_DIR,help="with --photos: cache of checked listings and downloaded images")
+parser.add_argument("--photo-workers",type=int,default=8,help="with --photos: photo requests in flight at the same time")
+parser.add_argument("--photo-rate",type=float,default=10.0,help="with --photos: maximum photo requests per second, 0 for no limit")
+parser.add_argument("--history-db",default=None,help="also add the prices of every listing to this sqlite price history, see price_history.py")
+parser.add_argument("--metrics",default=None,help="write stage timings and per-field fallback counts to this file: .prom for a prometheus textfile, anything else appends json lines")
+parser.add_argument("--changes-only",action="store_true",help="load only new or changed listings, unchanged ones go to --delta-table as small delta records")
+parser.add_argument("--state",default=change_capture.DEFAULT_STATE_PATH,help="with --changes-only: json file with the content hash of every listing seen")
+parser.add_argument("--delta-table",default=change_capture.DEFAULT_DELTA_TABLE,help="with --changes-only: time partitioned BigQuery table for the delta records")
 
 # helper funcs
 
-def get_soup(driver):
+def parse_html(html,parser=DEFAULT_PARSER):
+    """
+    Creates a beautiful soup object (bs4.BeautifulSoup) from a string of HTML code.
+    
+    Parameters
+    ----------
+    html : string of HTML code, e.g. driver.page_source or a saved report page
+
+    parser : name of the beautiful soup tree builder, one of PARSERS.
+             'lxml' is the fastest, 'html5lib' the slowest but the most lenient
+    """
+    from bs4 import BeautifulSoup
+    if parser not in PARSERS:
+        raise ValueError(f"Unknown html parser {parser!r}, expected one of {PARSERS}")
+    return BeautifulSoup(html,parser)
+
+def get_soup(driver,parser=DEFAULT_PARSER):
     """
     Creates a beautiful soup object (bs4.BeautifulSoup) from an active selenium driver instance
     for purposes of parsing the underlying HTML code.
@@ -43,8 +88,10 @@ def get_soup(driver):
     ----------
     driver : Selenium webdriver object. Must execute driver.get(url) prior to
              calling this get_soup() function
+
+    parser : name of the beautiful soup tree builder, see parse_html()
     """
-    return BeautifulSoup(driver.page_source,'html5lib')
+    return parse_html(driver.page_source,parser)
 
 def gprint(text):
     """
@@ -79,7 +126,36 @@ def get_printable_reports_url(driver):
     """
     return driver.find_element_by_link_text('Printable Reports').get_property('href')
                     
-def open_printable_reports_page(driver):
+# seconds spent in each wait_for() call of the current run, by wait name
+wait_times = {}
+
+def wait_for(driver,condition,timeout,name):
+    """
+    Polls until an expected condition is met instead of sleeping for a fixed
+    time, and records how long it took in wait_times. Raises
+    selenium.common.exceptions.TimeoutException after timeout seconds.
+    Returns whatever the condition returns
+
+    Parameters
+    ----------
+    driver : Selenium webdriver object
+
+    condition : callable taking the driver, e.g. from
+                selenium.webdriver.support.expected_conditions
+
+    timeout : maximum number of seconds to wait
+
+    name : string used as the key in wait_times and in the timeout message
+    """
+    from selenium.webdriver.support.ui import WebDriverWait
+    start = time.perf_counter()
+    try:
+        return WebDriverWait(driver,timeout,poll_frequency=0.25).until(condition,message=f"Timed out waiting for {name}")
+    finally:
+        wait_times[name] = time.perf_counter() - start
+        run_metrics.add_time(f'wait_{name}',wait_times[name])
+
+def open_printable_reports_page(driver,timeout=DEFAULT_TIMEOUT):
     """
     Loads the printable reports page in a new tab. Webdriver switches window
     to newly opened tab. Either text link at the top 1/4 of page says "Printable Reports"
@@ -91,18 +167,52 @@ def open_printable_reports_page(driver):
     
     driver : Selenium webdriver object. Must execute driver.get(url) prior to
              calling this function
+
+    timeout : maximum number of seconds to wait for each step (new tab, page title, first listing)
     """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import TimeoutException
+    handles = driver.window_handles
     try:
         driver.find_element_by_link_text('Printable Reports').click()
     except:
         driver.find_elements_by_class_name("icon-print-report")[0].click()
         
-    sleep(5)
-    driver.switch_to.window(driver.window_handles[1]) #Points selenium driver to the new tab
-    assert driver.title == "Customer Report"
+    wait_for(driver,EC.new_window_is_opened(handles),timeout,'report_tab')
+    new_handle = [handle for handle in driver.window_handles if handle not in handles][0]
+    driver.switch_to.window(new_handle) #Points selenium driver to the new tab
+    wait_for(driver,EC.title_is("Customer Report"),timeout,'report_title')
+    try:
+        wait_for(driver,EC.presence_of_element_located((By.CSS_SELECTOR,'span#L0')),timeout,'first_listing')
+    except TimeoutException:
+        bprint("No listing found on the printable reports page")
     print("")
                     
-def get_listing_entry(num,soup):
+# tokenized report links and the color codes gprint/bprint wrap them in
+REPORT_URL = re.compile(r'https?://[^\s"\'<>]+')
+ANSI_COLOR = re.compile(r'\x1b\[[0-9;]*m')
+
+# id of a listing span, e.g. L12
+LISTING_ID = re.compile(r'^L(\d+)$')
+
+def get_listing_index(soup):
+    """
+    Finds every housing listing on the printable reports page in a single
+    pass over the document. Returns a dictionary of listing number -> beautifulsoup
+    object, the index get_listing_total() and get_listing_entry() read from.
+
+    Parameters
+    ----------
+    soup : beautifulsoup object from running the get_soup() function
+           with a webdriver object after loading the printable reports page
+    """
+    index = {}
+    for span in soup.find_all('span',{'id':LISTING_ID}):
+        index.setdefault(int(LISTING_ID.match(span['id']).group(1)), span)
+    return index
+
+def get_listing_entry(num,soup,index=None):
     """
     Finds the HTML location for each housing listing available.
     Returns beautifulsoup object
@@ -115,8 +225,42 @@ def get_listing_entry(num,soup):
           
     soup : beautifulsoup object from running the get_soup() function
            with a webdriver object after loading the printable reports page
+
+    index : dictionary returned from get_listing_index(). Pass it in when looking
+            up more than one listing, otherwise the whole page is searched again
+    """
+    if index is None:
+        index = get_listing_index(soup)
+    return index[num]
+
+# opening tag of a listing, e.g. <span id="L12">
+LISTING_START = re.compile(r'''<span\b[^>]*?\bid\s*=\s*["']?L(\d+)["'\s>/]''', re.IGNORECASE)
+
+def iter_listings(html,parser=DEFAULT_PARSER):
+    """
+    Splits the printable reports page source at every <span id="L{n}"> tag
+    and parses each listing on its own, so only one listing is held in memory
+    at a time. Yields tuples of (listing number, beautifulsoup object) where the
+    beautifulsoup object is the same span get_listing_entry() returns. A listing
+    is destroyed once the next one is requested, so extract from it right away.
+
+    Parameters
+    ----------
+    html : string of HTML code, e.g. driver.page_source
+
+    parser : name of the beautiful soup tree builder, see parse_html()
     """
-    return soup.findAll('span',{'id':'L{}'.format(num)})[0]
+    starts = [(match.start(), int(match.group(1))) for match in LISTING_START.finditer(html)]
+    for k, (start, num) in enumerate(starts):
+        end = starts[k + 1][0] if k + 1 < len(starts) else len(html)
+        with run_metrics.timer('soup'):
+            soup = parse_html(html[start:end],parser)
+        listing = soup.find('span',{'id':f'L{num}'})
+        if listing is not None:
+            yield num, listing
+        # the tree is full of parent/child reference cycles, break them so the
+        # memory is released now instead of at the next garbage collection
+        soup.decompose()
 
 def get_listing_id(listing):
     """
@@ -129,6 +273,287 @@ def get_listing_id(listing):
     """
     return listing.findAll('table')[1].find('div')['id']
 
+def index_listing(listing):
+    """
+    Walks a housing listing once and indexes every table along with the
+    table cells (td tags) found inside of it. Returns a tuple (tables, cells)
+    where tables[n] is equivalent to listing.findAll('table')[n] and cells[n]
+    is equivalent to listing.findAll('table')[n].findAll('td')
+
+    Parameters
+    ----------
+    listing : beautifulsoup object that is returned after
+              running the get_listing_entry() function
+    """
+    tables = []
+    cells = []
+    position = {}
+    for tag in listing.find_all(['table','td']):
+        if tag.name == 'table':
+            position[id(tag)] = len(tables)
+            tables.append(tag)
+            cells.append([])
+            continue
+        # a td belongs to every table it is nested in, not only the closest one
+        for parent in tag.parents:
+            if id(parent) in position:
+                cells[position[id(parent)]].append(tag)
+            if parent is listing:
+                break
+    return tables, cells
+
+# cleanup steps that a field in listing_schema.json can list under "normalize"
+NORMALIZERS = {
+    'strip_money': lambda value: value.replace("$","").replace(",",""),
+    'nbsp_empty': lambda value: value.replace('\xa0','empty'),
+    'collapse_newlines': lambda value: value.replace('\n\n',''),
+    'strip': lambda value: value.strip(),
+}
+
+def load_schema(path=SCHEMA_PATH):
+    """
+    Reads the field schema that maps each output column to its location
+    on the printable reports page. Returns the parsed json as a dictionary
+
+    Parameters
+    ----------
+    path : string path to a json schema file, defaults to listing_schema.json
+           located next to this script
+    """
+    with open(path) as schema_file:
+        return json.load(schema_file)
+
+def compile_schema(schema):
+    """
+    Turns a field schema from load_schema() into an extractor that
+    extract_fields() applies to every listing. Normalizer names are resolved
+    to functions up front so a misspelled step fails before any page is loaded.
+
+    Parameters
+    ----------
+    schema : dictionary returned from load_schema()
+    """
+    def compile_steps(names):
+        try:
+            steps = [NORMALIZERS[name] for name in names]
+        except KeyError as e:
+            raise ValueError(f"Unknown normalizer in listing schema: {e.args[0]}")
+        def normalize(value):
+            for step in steps:
+                value = step(value)
+            return value
+        return normalize
+
+    # label cells read from the page are stored under the schema's spelling of the key
+    keys = [column['key'] for column in schema['columns']]
+    keys += [fixup['key'] for entry in schema['label_tables'] for fixup in entry.get('fixups', [])]
+    label_keys = {normalize_label(key):key for key in keys}
+
+    label_tables = []
+    for entry in schema['label_tables']:
+        fixups = [(fixup['key'], compile_steps(fixup.get('normalize', [])), fixup.get('default'))
+                  for fixup in entry.get('fixups', [])]
+        label_tables.append((normalize_label(entry.get('anchor', '')),
+                             entry['labels'],
+                             entry['values'],
+                             [tuple(pair) for pair in entry.get('label_replace', [])],
+                             [tuple(pair) for pair in entry.get('value_replace', [])],
+                             fixups))
+
+    fields = [(field['name'],
+               normalize_label(field.get('label', '')),
+               field['table'],
+               field['cell'],
+               compile_steps(field.get('normalize', [])),
+               field.get('default'))
+              for field in schema['fields']]
+
+    return {'label_tables':label_tables,
+            'label_keys':label_keys,
+            'fields':fields,
+            'columns':[(column['name'], column['key']) for column in schema['columns']]}
+
+_client = None
+
+def get_client():
+    """
+    Returns the BigQuery client, created on first use so that replays to a
+    local file don't need cloud credentials
+    """
+    global _client
+    if _client is None:
+        from google.cloud import bigquery
+        _client = bigquery.Client()
+    return _client
+
+_extractor = None
+
+def get_extractor():
+    """
+    Returns the compiled extractor for the schema shipped in
+    listing_schema.json. The schema is only read and compiled once.
+    """
+    global _extractor
+    if _extractor is None:
+        _extractor = compile_schema(load_schema())
+    return _extractor
+
+def clean_label(text):
+    """
+    Collapses the whitespace of a label cell's text and drops a trailing
+    colon, e.g. "\n\tYear\xa0Built :\n" becomes "Year Built"
+
+    Parameters
+    ----------
+    text : string
+    """
+    return ' '.join(text.split()).rstrip(':').strip()
+
+def normalize_label(text):
+    """
+    Normalizes the text of a label cell (or a label from the schema) so that
+    "Year Built:", "year built" and "Year\xa0Built :" all compare equal
+
+    Parameters
+    ----------
+    text : string
+    """
+    return clean_label(text).lower()
+
+def label_key(extractor, text):
+    """
+    Returns the output key for the text of a label cell in a label table:
+    the schema's spelling when the label matches a schema key, otherwise
+    the cleaned text, see clean_label()
+
+    Parameters
+    ----------
+    extractor : dictionary returned from compile_schema()
+
+    text : string text of the label cell
+    """
+    return extractor['label_keys'].get(normalize_label(text), clean_label(text))
+
+def table_cells(tables, cells, num):
+    """
+    Returns the cells that belong directly to table number num, leaving out
+    the cells of any table nested inside of it
+
+    Parameters
+    ----------
+    tables, cells : tuple returned from running the index_listing() function
+
+    num : integer index of the table
+    """
+    return [cell for cell in cells[num] if cell.find_parent('table') is tables[num]]
+
+def map_labels(tables, cells):
+    """
+    Maps the normalized text of every label position to a list of
+    (table number, next cell) tuples, one per place the text shows up. On
+    the printable reports page labels ("Heating", "Garage", "Year Built",
+    ...) sit in the even cells of a table and the cell following a label
+    holds its value, so only even cells are taken. A value cell can still
+    hold the text of a label (in the value row of a label table, or on a
+    page laid out differently), see closest_label() for picking one.
+
+    Parameters
+    ----------
+    tables, cells : tuple returned from running the index_listing() function
+    """
+    labels = {}
+    for num in range(len(tables)):
+        own_cells = table_cells(tables, cells, num)
+        for k in range(0, len(own_cells), 2):
+            label = normalize_label(own_cells[k].get_text())
+            if label:
+                labels.setdefault(label, []).append((num, own_cells[k + 1] if k + 1 < len(own_cells) else None))
+    return labels
+
+def closest_label(labels, label, table):
+    """
+    Returns the (table number, next cell) tuple of the place a label shows
+    up nearest to the table the schema expects it in, or None when the
+    label isn't on the page. On a tie the first place is kept
+
+    Parameters
+    ----------
+    labels : dictionary returned from map_labels()
+
+    label : normalized label text
+
+    table : integer table number the label is expected in, with the
+            Virtual Tour offset already added
+    """
+    if label not in labels:
+        return None
+    return min(labels[label], key=lambda place: abs(place[0] - table))
+
+def extract_fields(extractor, tables, cells, labels=None):
+    """
+    Applies a compiled extractor to one indexed housing listing. Returns a
+    dictionary of every schema field in schema order.
+
+    Fields are located by their label cell, the one nearest to the schema's
+    table when the text shows up more than once. The table number in the
+    schema is shifted by however far the anchor of the first label table
+    moved (the 'Virtual Tour' row offset), and read directly when a label
+    can't be found on the page.
+
+    Parameters
+    ----------
+    extractor : dictionary returned from compile_schema()
+
+    tables, cells : tuple returned from running the index_listing() function
+
+    labels : dictionary returned from map_labels(), built when not given
+    """
+    def replace_all(text, pairs):
+        for old, new in pairs:
+            text = text.replace(old, new)
+        return text
+
+    if labels is None:
+        labels = map_labels(tables, cells)
+
+    results = {}
+    offset = None
+    for anchor, label_num, value_num, label_replace, value_replace, fixups in extractor['label_tables']:
+        place = closest_label(labels, anchor, label_num + (offset or 0))
+        shift = place[0] - label_num if place is not None else (offset or 0)
+        if offset is None and place is not None:
+            offset = shift
+        # read cell by cell rather than splitting table.text, the whitespace
+        # between cells differs from one html parser to the next
+        pairs = dict(zip([label_key(extractor, x) for x in (replace_all(cell.get_text(), label_replace) for cell in table_cells(tables, cells, label_num + shift)) if x != '\n'],
+                         [x for x in (replace_all(cell.get_text(), value_replace) for cell in table_cells(tables, cells, value_num + shift)) if x != '\n']))
+        for key, normalize, default in fixups:
+            try:
+                pairs[key] = normalize(pairs.get(key))
+            except (AttributeError, TypeError):
+                run_metrics.count('field_defaults',key)
+                pairs[key] = default
+        results.update(pairs)
+    offset = offset or 0
+
+    for name, label, table, cell, normalize, default in extractor['fields']:
+        try:
+            place = closest_label(labels, label, table + offset)
+            if place is not None and place[1] is not None:
+                value_cell = place[1]
+            else:
+                run_metrics.count('field_fallbacks',name)
+                value_cell = cells[table + offset][cell]
+            results[name] = normalize(value_cell.contents[0])
+        except IndexError:
+            # some values are never entered on the mls site and the cell contents are []
+            if default is None:
+                run_metrics.count('field_failures',name)
+                raise
+            run_metrics.count('field_defaults',name)
+            results[name] = default
+    return results
+
 def get_listing_photo_count(listing):
     """
     Count the number of images associated with an indivdual housing listing
@@ -145,7 +570,7 @@ def get_listing_photo_count(listing):
                             }
                           )[0].text.replace('\xa0HD','').split()[~0])
                           
-def get_listing_total(soup):
+def get_listing_total(soup,index=None):
     """
     Finds the total number of housing listings on the mls
     Printable reports page
@@ -155,502 +580,722 @@ def get_listing_total(soup):
     soup : beautifulsoup object returned from runing
            the get_soup() function after loading the
            printable reports site in the selenium webdriver
+
+    index : dictionary returned from get_listing_index(), built when not given
     """
-  
-    listing_count = 0
-    for i in range(100):
-        if soup.findAll('span',{'id':f"L{i}"}) != []:
-            listing_count += 1
-    return listing_count
+    if index is None:
+        index = get_listing_index(soup)
+    return len(index)
 
-def get_results(listing,driver):
+def get_thumbnail_urls(listing):
     """
-    Single function that acquires all data corresiponding to an individual
-    mls listing. Results are returned as a dictionary object
+    Finds and returns a list of all urls for all thumbnail images
+    of a given housing listing on the mls printable reports page
     
     Parameters
     ----------
     listing : beautifulsoup object that is returned after
               running the get_listing_entry() function
     """
-    
-    def get_thumbnail_urls(listing):
-        """
-        Finds and returns a list of all urls for all thumbnail images
-        of a given housing listing on the mls printable reports page
-        
-        Parameters
-        ----------
-        listing : beautifulsoup object that is returned after
-                  running the get_listing_entry() function
-        """
-        try:
-            id_ = get_listing_id(listing)
-            photo_count = get_listing_photo_count(listing)
-            return [f'http://pxlimages.xmlsweb.com/NJMLS/M/Images/{id_}.{cnt}.JPG?v=1' for cnt in range(1, photo_count + 1)]
-        except:
-            return [listing.find('img')['src']]
-                    
-    def get_box_vals(listing):
-        """
-        Finds basic information about a given housing listing on mls. This is the block of
-        information that adjacent to the right of the thumbnail image for each listing
-        Including: last price, ml_num, address, town, zipcode, county, county locale,
-                   area code, direct, original listing price, days on market
-                   
-        Parameters
-        ----------
-        listing : beautifulsoup object that is returned after
-                  running the get_listing_entry() function
-        """
-        box = listing.findAll('td',{'width':'55%'})[0]
-        last_price = int(box.text.strip().replace('\t','').split("LP:\n")[1].split('\n')[0].replace("$",'').replace(",",''))
-        ml_num = box.text.strip().replace('\t','').split("ML#:\n")[1].split('\n')[0].strip()
-        address = box.text.strip().replace('\t','').split("Addr:\n")[1].split('\n')[0].strip()
-        town = box.text.strip().replace('\t','').split("Town:\n")[1].split('\n')[0].strip()
-        zipcode = box.text.strip().replace('\t','').split("Zip:\n")[1].split('\n')[0].strip()
-        county = box.text.strip().replace('\t','').split("County:\n")[1].split('\n')[0].title().strip()
-        county_locale = box.text.strip().replace('\t','').split("County Locale#:\n")[1].split('\n')[0].strip()
-        areacode = box.text.strip().replace('\t','').split("Area#:\n")[1].split('\n')[0].strip()
-        direct = box.text.strip().replace('\t','').split("Direct:\n")[1].split('\n')[0].strip()
-        original_lp = int(box.text.strip().replace('\t','').split("Orig LP:\n")[1].split('\n')[0].replace("$",'').replace(",",''))
-        days_on_mkt = int(box.text.strip().replace('\t','').split("DOM:\n")[1].split('\n')[0])
-        
-        return {"last_price":last_price,
-                "ml_num":ml_num,
-                "address":address,
-                "town":town,
-                "zipcode":zipcode,
-                "county":county,
-                "county_locale":county_locale,
-                "areacode":areacode,
-                "direct":direct,
-                "original_lp":original_lp,
-                "days_on_mkt":days_on_mkt}
-
-     """Account for 'Virtual Tour' link. Data for listings that include the 'Virtual Tour' are offset by 1 when compared
-     To the listings that do not contain the 'Virtual Tour' link. The VT variable is boolean and coerced into an integer
-     That way, adding VT to the row index accounts for row offset."""
-    VT = True if 'Virtual'.lower() in listing.text.lower() and 'Tour'.lower() in listing.text.lower() else False
-    if driver.current_url == "http://www.priv.njmlsnew.xmlsweb.com/reportsPDF.asp":
-        VT = 0
-                    
-    results1 = dict(zip([x for x in listing.findAll('table')[15 + VT].text.replace('#\n\n','#').split('\n\t') if x != '\n'],
-                        [x for x in listing.findAll('table')[16 + VT].text.replace('#\n\n','#').replace("\xa0",'empty').split('\n\t') if x != '\n']))
-    try:
-        results1['Tax Condo #'] = results1.get('Tax Condo #').replace('\n\n','')
-    except:
-        results1['Tax Condo #'] = 'empty'
-    results2 = dict(zip([x for x in listing.findAll('table')[17 + VT].text.replace('Sub-Style\n\n','Sub-Style').split('\n\t') if x != '\n'],
-                        [x for x in listing.findAll('table')[18 + VT].text.replace('#\n\n','#').replace("\xa0","empty").split('\n\t') if x != '\n']))
     try:
-        results2['Sub-Style'] = results2.get('Sub-Style').replace('\n\n','')
+        id_ = get_listing_id(listing)
+        photo_count = get_listing_photo_count(listing)
+        return [f'http://pxlimages.xmlsweb.com/NJMLS/M/Images/{id_}.{cnt}.JPG?v=1' for cnt in range(1, photo_count + 1)]
     except:
-        results2['Sub-Style'] = 'empty'
-    try:
-        results2['Taxes'] = results2.get('Taxes').replace("$","").replace(",","")
-    except:
-        results2['Taxes'] = 'empty'
-    
-    monthly_maintenance = listing.findAll('table')[19 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","")
-    maintenance_includes = listing.findAll('table')[19 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
-    gnd_flr = listing.findAll('table')[20 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
-    EL = listing.findAll('table')[20 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
-    first_fl = listing.findAll('table')[21 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
-    JH = listing.findAll('table')[21 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
-    second_fl = listing.findAll('table')[22 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
-    SH = listing.findAll('table')[22 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
-    third_fl = listing.findAll('table')[23 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
-    basement = listing.findAll('table')[24 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
-    assessments = listing.findAll('table')[25 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
-    municipal_assessment = listing.findAll('table')[25 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
-    try:
-        # some reason, this value is not entered and the contents returns [] - so the try/catch is used
-        easements = listing.findAll('table')[25 + VT].findAll('td')[5].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
-    except:
-        easements = 'empty'
-    items_included = listing.findAll('table')[26 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
-    items_not_included = listing.findAll('table')[26 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty')
-    
-    results3 = {
-        "monthly_maintenance":monthly_maintenance,
-        "maintenance_includes":maintenance_includes,
-        "gnd_flr":gnd_flr,
-        "elementary_school":EL,
-        "first_fl":first_fl,
-        "jr_highschool":JH,
-        "second_fl":second_fl,
-        "high_school":SH,
-        "third_fl":third_fl,
-        "basement":basement,
-        "assessments":assessments,
-        "municipal_assessment":municipal_assessment,
-        "easements":easements,
-        "items_included":items_included,
-        "items_not_included":items_not_included,
-    }
+        run_metrics.count('field_fallbacks','image_urls')
+        return [listing.find('img')['src']]
+
+# label on the printable reports page -> output column, in output order
+BOX_FIELDS = {
+    'LP':'last_price',
+    'ML#':'ml_num',
+    'Addr':'address',
+    'Town':'town',
+    'Zip':'zipcode',
+    'County':'county',
+    'County Locale#':'county_locale',
+    'Area#':'areacode',
+    'Direct':'direct',
+    'Orig LP':'original_lp',
+    'DOM':'days_on_mkt',
+}
+# longer labels go first so 'Orig LP' is never read as 'LP'
+BOX_PATTERN = re.compile('({}):\n([^\n]*)'.format('|'.join(re.escape(label) for label in sorted(BOX_FIELDS, key=len, reverse=True))))
+
+def parse_box_text(text):
+    """
+    Parses the text of a listing box (see get_box_vals()) in a single scan.
+    Returns a dictionary with every BOX_FIELDS column. Fields that are missing
+    from the text, or prices/day counts that aren't numbers, are None.
+
+    Parameters
+    ----------
+    text : string text of the listing box
+    """
+    raw = {}
+    for label, value in BOX_PATTERN.findall(text.strip().replace('\t','')):
+        raw.setdefault(label, value)
+
+    def to_int(value):
+        try:
+            return int(value.replace("$",'').replace(",",''))
+        except (AttributeError, ValueError):
+            return None
+
+    box_vals = {column:(raw[label].strip() if label in raw else None) for label, column in BOX_FIELDS.items()}
+    box_vals['last_price'] = to_int(raw.get('LP'))
+    box_vals['original_lp'] = to_int(raw.get('Orig LP'))
+    box_vals['days_on_mkt'] = to_int(raw.get('DOM'))
+    if box_vals['county'] is not None:
+        box_vals['county'] = box_vals['county'].title()
+    return box_vals
+
+def get_box_vals(listing):
+    """
+    Finds basic information about a given housing listing on mls. This is the block of
+    information that adjacent to the right of the thumbnail image for each listing
+    Including: last price, ml_num, address, town, zipcode, county, county locale,
+               area code, direct, original listing price, days on market
+               
+    Parameters
+    ----------
+    listing : beautifulsoup object that is returned after
+              running the get_listing_entry() function
+    """
+    box = listing.find('td',{'width':'55%'})
+    box_vals = parse_box_text(box.text if box is not None else '')
+    for column, value in box_vals.items():
+        if value is None:
+            run_metrics.count('field_missing',column)
+    return box_vals
+
+def get_results(listing,extractor=None):
+    """
+    Single function that acquires all data corresiponding to an individual
+    mls listing. Results are returned as a dictionary object
     
-    building_complex = listing.findAll('table')[28 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    unit_num = listing.findAll('table')[28 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    model_line = listing.findAll('table')[28 + VT].findAll('td')[5].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    approx_unit_sqtf = listing.findAll('table')[29 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    underlying_mtg = listing.findAll('table')[29 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    yrs_remaining = listing.findAll('table')[29 + VT].findAll('td')[5].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    number_of_shares = listing.findAll('table')[30 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip() 
-    number_of_stories = listing.findAll('table')[30 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip() 
-    stairs = listing.findAll('table')[30 + VT].findAll('td')[5].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    building_assoc_charges = listing.findAll('table')[31 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    board_finance_requirements = listing.findAll('table')[31 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    management_company = listing.findAll('table')[32 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    management_phone = listing.findAll('table')[32 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-
-    results4 = {
-        "building_complex":building_complex,
-        "unit_num":unit_num,
-        "model_line":model_line,
-        "approx_unit_sqtf":approx_unit_sqtf,
-        "underlying_mtg":underlying_mtg,
-        "yrs_remaining":yrs_remaining,
-        "number_of_shares":number_of_shares,
-        "number_of_stories":number_of_stories,
-        "stairs":stairs,
-        "building_assoc_charges":building_assoc_charges,
-        "board_finance_requirements":board_finance_requirements,
-        "management_company":management_company,
-        "management_phone":management_phone
-    }
-
-    waterfront = listing.findAll('table')[34 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    garage = listing.findAll('table')[34 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    life_style = listing.findAll('table')[35 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    heating = listing.findAll('table')[36 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    cooling = listing.findAll('table')[36 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    fireplace = listing.findAll('table')[37 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    basement_features = listing.findAll('table')[37 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    building_amenities = listing.findAll('table')[38 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    maintenance_included = listing.findAll('table')[38 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    appliances_included = listing.findAll('table')[39 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    year_built = listing.findAll('table')[40 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    ownership = listing.findAll('table')[40 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    floor_plan = listing.findAll('table')[41 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    views = listing.findAll('table')[41 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    misc = listing.findAll('table')[42 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    pets = listing.findAll('table')[42 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    laundry = listing.findAll('table')[43 + VT].findAll('td')[1].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-    possession = listing.findAll('table')[43 + VT].findAll('td')[3].contents[0].replace("$","").replace(",","").replace('\xa0','empty').strip()
-
-    results5 = {
-        "waterfront":waterfront,
-        "garage":garage,
-        "life_style":life_style,
-        "heating":heating,
-        "cooling":cooling,
-        "fireplace":fireplace,
-        "basement_features":basement_features,
-        "building_amenities":building_amenities,
-        "maintenance_included":maintenance_included,
-        "appliances_included":appliances_included,
-        "year_built":year_built,
-        "ownership":ownership,
-        "floor_plan":floor_plan,
-        "views":views,
-        "misc":misc,
-        "pets":pets,
-        "laundry":laundry,
-        "possession":possession
-    }
-    return dict(**results1,
-                **results2,
-                **results3,
-                **results4,
-                **results5,
+    Parameters
+    ----------
+    listing : beautifulsoup object that is returned after
+              running the get_listing_entry() function
+
+    extractor : compiled field schema returned from compile_schema(). Defaults
+                to the schema shipped in listing_schema.json
+    """
+
+    if extractor is None:
+        extractor = get_extractor()
+
+    # every table and its cells are looked up once and then read by index
+    tables, cells = index_listing(listing)
+
+    return dict(**extract_fields(extractor, tables, cells),
                 **get_box_vals(listing),
                 image_urls="||".join(get_thumbnail_urls(listing))
                )
 
-def main():
-    url = parser.parse_args().url
-    remote_selenium = parser.parse_args().selenium 
-    print (f"You Entered the url: {url}\nSelenium URI: {remote_selenium}")
-    
+# output columns (by schema column name) that are not kept as text
+HOUSING_DTYPES = {
+    'last_price':'Int64',
+    'original_lp':'Int64',
+    'days_on_mkt':'Int64',
+    'taxes':'Float64',
+}
+
+def build_housing_frame(rows,extractor,index=None,dtypes=HOUSING_DTYPES):
+    """
+    Builds the housing DataFrame in one go from a list of get_results() dictionaries.
+    Columns listed in dtypes are converted to their numeric dtype, values
+    that aren't numbers (e.g. 'empty' taxes) become missing values.
+
+    Parameters
+    ----------
+    rows : list of dictionaries returned from get_results()
+
+    extractor : dictionary returned from compile_schema(), maps the schema
+                column names in HOUSING_DTYPES to get_results() keys
+
+    index : optional list used as the DataFrame index, e.g. listing numbers
+
+    dtypes : dictionary of schema column name -> pandas dtype, {} keeps the
+             values as they were scraped, see sanitize_frame()
+    """
+    import pandas as pd
+    housing_df = pd.DataFrame.from_records(rows,index=index)
+    keys = dict(extractor['columns'])
+    for name, dtype in dtypes.items():
+        key = keys.get(name, name)
+        if key in housing_df.columns:
+            housing_df[key] = pd.to_numeric(housing_df[key],errors='coerce').astype(dtype)
+    return housing_df
+
+def check_columns(rows,extractor):
+    """
+    Raises a ValueError when a schema column key is found in none of the
+    rows. That happens when a label on the page no longer matches the
+    schema, and the column would otherwise load as 'empty' for every listing
+
+    Parameters
+    ----------
+    rows : list of dictionaries returned from get_results()
+
+    extractor : dictionary returned from compile_schema()
+    """
+    if not rows:
+        return
+    found = set().union(*rows)
+    missing = [key for _, key in extractor['columns'] if key not in found]
+    if missing:
+        raise ValueError(f"Schema keys not found in any listing: {missing}. "
+                         "Check the labels on the page against listing_schema.json")
+
+# removes quotes from a value that gets pasted into a SQL statement
+QUOTES = str.maketrans('','','"\'')
+
+def sanitize_value(value,strip_quotes=True):
+    """
+    Converts a single get_results() value to the text that is loaded into
+    BigQuery. Missing values become 'empty'
+
+    Parameters
+    ----------
+    value : any value from a get_results() dictionary
+
+    strip_quotes : remove single and double quotes, only needed when the
+                   value ends up inside a SQL string
+    """
+    if value is None:
+        return 'empty'
+    return str(value).translate(QUOTES) if strip_quotes else str(value)
+
+def sanitize_row(row,extractor,strip_quotes=True):
+    """
+    Returns a tuple of sanitized values for one get_results() dictionary,
+    ordered by the schema columns
+
+    Parameters
+    ----------
+    row : dictionary returned from get_results()
+
+    extractor : dictionary returned from compile_schema()
+
+    strip_quotes : see sanitize_value()
+    """
+    return tuple(sanitize_value(row.get(key),strip_quotes) for _, key in extractor['columns'])
+
+def sanitize_frame(housing_df,extractor,strip_quotes=True):
+    """
+    Column-wise version of sanitize_row() for a DataFrame from build_housing_frame().
+    Returns a DataFrame of text columns named and ordered by the schema columns.
+    Whole-number floats (int columns with missing values) are written without
+    a trailing '.0'. Gives the same text as sanitize_row() for a frame built
+    with dtypes={}; numeric dtypes would load e.g. taxes '10588.50' as
+    '10588.5' and taxes that aren't a number as 'empty'
+
+    Parameters
+    ----------
+    housing_df : DataFrame returned from build_housing_frame(rows,extractor,dtypes={})
+
+    extractor : dictionary returned from compile_schema()
+
+    strip_quotes : see sanitize_value()
+    """
+    import pandas as pd
+    # the columns of the frame are the keys found in any of its rows
+    check_columns([dict.fromkeys(housing_df.columns)] if len(housing_df) else [],extractor)
+
+    sanitized = {}
+    for name, key in extractor['columns']:
+        if key not in housing_df.columns:
+            sanitized[name] = pd.Series('empty',index=housing_df.index)
+            continue
+        column = housing_df[key]
+        text = column.astype('string')
+        if pd.api.types.is_float_dtype(column):
+            whole = column.notna() & (column % 1 == 0)
+            text[whole] = column[whole].astype('Int64').astype('string')
+        text = text.fillna('empty')
+        sanitized[name] = text.str.translate(QUOTES) if strip_quotes else text
+    return pd.DataFrame(sanitized,index=housing_df.index)
+
+def fetch_report_selenium(url,remote_selenium,timeout=DEFAULT_TIMEOUT):
+    """
+    Opens a tokenized mls link in a remote selenium session, follows it to the
+    printable reports page and returns the page source. The session is closed
+    before returning
+
+    Parameters
+    ----------
+    url : string tokenized mls url, e.g. from get_listing_token.py
+
+    remote_selenium : string uri of the remote selenium-server
+
+    timeout : maximum number of seconds to wait for each page to be ready
+    """
+    from selenium import webdriver
+    from selenium.webdriver.support import expected_conditions as EC
     gprint("Connecting To remote selenium-server...")
-    driver = webdriver.Remote(remote_selenium, webdriver.DesiredCapabilities.CHROME)
-
-    # load mls listing page
-    driver.get(url)
-    gprint("Verifying page title - this may take a moment..,\n")
-    sleep(10)
-    assert driver.title == 'Dashboard | Collab Center'
-    bprint("Initial MLS page loaded.")
-    
-    # get link and load printable reports page
-    
-    #printable_reports_url = get_printable_reports_url(driver)
-    #driver.get(printable_reports_url)
-    open_printable_reports_page(driver)
-    gprint("10 Second sleep while page loads...\n")    
-    #sleep(10)
-    assert driver.title == 'Customer Report'
-    
-    bprint("Successfully loaded Printable Reports page:\n{}".format(driver.current_url))
+    with run_metrics.timer('selenium_connect'):
+        driver = webdriver.Remote(remote_selenium, webdriver.DesiredCapabilities.CHROME)
+    try:
+        # load mls listing page
+        with run_metrics.timer('page_load'):
+            driver.get(url)
+        gprint("Verifying page title - this may take a moment..,\n")
+        wait_for(driver,EC.title_is('Dashboard | Collab Center'),timeout,'dashboard_title')
+        bprint("Initial MLS page loaded.")
+        
+        # get link and load printable reports page
+        
+        #printable_reports_url = get_printable_reports_url(driver)
+        #driver.get(printable_reports_url)
+        open_printable_reports_page(driver,timeout)
+        assert driver.title == 'Customer Report'
+        
+        bprint("Successfully loaded Printable Reports page:\n{}".format(driver.current_url))
+        return driver.page_source
+    finally:
+        driver.quit()
+
+def fetch_report_html(url,remote_selenium,timeout=DEFAULT_TIMEOUT,fetch_mode='auto',adapter=None):
+    """
+    Returns the page source of the printable reports page for a tokenized mls link.
+    'direct' downloads it over http (see report_fetch.py), 'selenium' drives a
+    remote browser, and 'auto' tries the direct download first and only starts
+    a browser when that fails
+
+    Parameters
+    ----------
+    url : string tokenized mls url, e.g. from get_listing_token.py
+
+    remote_selenium : string uri of the remote selenium-server
+
+    timeout : maximum number of seconds to wait for each page to be ready
+
+    fetch_mode : one of FETCH_MODES
+
+    adapter : connection pool shared by the direct downloads of many reports,
+              see report_fetch.new_adapter()
+    """
+    if fetch_mode not in FETCH_MODES:
+        raise ValueError(f"Unknown fetch mode {fetch_mode!r}, expected one of {FETCH_MODES}")
+    if fetch_mode != 'selenium':
+        import requests
+        import report_fetch
+        try:
+            with run_metrics.timer('fetch_direct'):
+                html = report_fetch.fetch_report_direct(url,timeout=timeout,adapter=adapter)
+            bprint(f"Downloaded Printable Reports page without a browser: {url}")
+            return html
+        except (report_fetch.ReportFetchError, requests.RequestException) as e:
+            run_metrics.count('report_failures','fetch_direct')
+            if fetch_mode == 'direct':
+                raise
+            bprint(f"Direct download failed ({e}), falling back to selenium")
+    return fetch_report_selenium(url,remote_selenium,timeout)
+
+def new_fetch_adapter(fetch_mode,pool_size):
+    """
+    Returns the connection pool that the direct downloads of a batch of
+    reports share, see report_fetch.new_adapter(), or None when fetch_mode
+    never downloads directly. Close it once the batch is done
+
+    Parameters
+    ----------
+    fetch_mode : one of FETCH_MODES
+
+    pool_size : number of kept-alive connections, e.g. the number of reports fetched at once
+    """
+    if fetch_mode == 'selenium':
+        return None
+    import report_fetch
+    return report_fetch.new_adapter(pool_size)
+
+def parse_report(html,parser_name=DEFAULT_PARSER,schema_path=SCHEMA_PATH,streaming=False):
+    """
+    Extracts every housing listing from the source of a printable reports page.
+    Returns a list of get_results() dictionaries in listing order. Only takes
+    picklable arguments so it can run in a worker process
+
+    Parameters
+    ----------
+    html : string of HTML code of the printable reports page
+
+    parser_name : name of the beautiful soup tree builder, see parse_html()
+
+    schema_path : string path to the json field schema, see load_schema()
+
+    streaming : parse one listing at a time, see iter_listings()
+    """
+    extractor = get_extractor() if schema_path == SCHEMA_PATH else compile_schema(load_schema(schema_path))
+    if streaming:
+        # each listing is parsed on its own and freed after extraction
+        listings = iter_listings(html,parser_name)
+    else:
+        # prime beautiful soup
+        with run_metrics.timer('soup'):
+            soup = parse_html(html,parser_name)
+            index = get_listing_index(soup)
+        listings = ((i, get_listing_entry(i,soup,index)) for i in sorted(index))
     
-    # prime beautiful soup
-    soup = get_soup(driver)
+    rows = []
+    for i, listing_temp in listings:
+        print (f"Acquiring Data for Listing {i}...")
+        with run_metrics.timer('extract'):
+            rows.append(get_results(listing_temp,extractor))
+    return rows
+
+REPORT_OPENERS = {'.bz2':bz2.open,
+                  '.xz':lzma.open}
+
+def read_report_file(path):
+    """
+    Reads a saved printable reports page, decompressing .gz, .zst, .bz2 and .xz
+    files. Returns the page source
+
+    Parameters
+    ----------
+    path : string path of the saved page, e.g. a page of a report archive
+    """
+    if path.lower().endswith(('.gz','.zst')):
+        return report_archive.read_object(path)
+    opener = REPORT_OPENERS.get(os.path.splitext(path)[1].lower(),open)
+    with opener(path,'rt',encoding='utf-8',errors='replace') as page:
+        return page.read()
+
+def parse_report_file(path,parser_name=DEFAULT_PARSER,schema_path=SCHEMA_PATH,streaming=False):
+    """
+    parse_report() for a saved page, see read_report_file(). Reading happens
+    in the worker process too, so only the path is sent to it
+
+    Parameters
+    ----------
+    path : string path of the saved page
+
+    parser_name, schema_path, streaming : see parse_report()
+    """
+    return parse_report(read_report_file(path),parser_name,schema_path,streaming)
+
+def replay_reports(paths,dates,parse_workers=0,parser_name=DEFAULT_PARSER,schema_path=SCHEMA_PATH,streaming=False):
+    """
+    Parses saved printable reports pages, one file per worker process.
+    Files that fail are reported and skipped. Returns a dictionary of scrape
+    date -> list of get_results() dictionaries, dates in the order they first
+    appear, rows ordered by file and then by listing
+
+    Parameters
+    ----------
+    paths : list of string paths of saved pages, see read_report_file()
+
+    dates : list of 'YYYY-MM-DD' strings, the date each page was scraped on
+
+    parse_workers : number of worker processes, 0 parses in this process
+
+    parser_name, schema_path, streaming : see parse_report()
+    """
+    parse_options = dict(parser_name=parser_name,schema_path=schema_path,streaming=streaming)
+    if parse_workers > 0:
+        with ProcessPoolExecutor(max_workers=parse_workers) as parse_pool:
+            parsed = [parse_pool.submit(run_metrics.collected,parse_report_file,path,**parse_options) for path in paths]
+            outcomes = []
+            for future in parsed:
+                try:
+                    file_rows, metrics = future.result()
+                except Exception as e:
+                    outcomes.append(e)
+                    continue
+                run_metrics.merge(metrics)
+                outcomes.append(file_rows)
+    else:
+        outcomes = []
+        for path in paths:
+            try:
+                outcomes.append(parse_report_file(path,**parse_options))
+            except Exception as e:
+                outcomes.append(e)
+
+    batches = {}
+    for path, date, outcome in zip(paths,dates,outcomes):
+        if isinstance(outcome,Exception):
+            run_metrics.count('report_failures','parse')
+            bprint(f"Skipping {path}: {outcome!r}")
+        else:
+            batches.setdefault(date,[]).extend(outcome)
+    return batches
+
+def read_report_urls(lines):
+    """
+    Picks the tokenized mls urls out of text lines, e.g. a file with one url
+    per line or the colored output of get_listing_token.py. Returns a list of
+    unique urls in the order they first appear
+
+    Parameters
+    ----------
+    lines : iterable of strings
+    """
+    urls = []
+    for line in lines:
+        for url in REPORT_URL.findall(ANSI_COLOR.sub('',line)):
+            if url not in urls:
+                urls.append(url)
+    return urls
+
+def scrape_reports(urls,remote_selenium,sessions=1,parse_workers=0,timeout=DEFAULT_TIMEOUT,fetch_mode='auto',
+                   parser_name=DEFAULT_PARSER,schema_path=SCHEMA_PATH,streaming=False,archive=None,scrape_date=None):
+    """
+    Loads many printable reports pages at once over a bounded pool of remote selenium
+    sessions and parses every page in a pool of worker processes as soon as it
+    arrives. Reports that fail are reported and skipped. Returns a list of
+    get_results() dictionaries, ordered by report and then by listing
+
+    Parameters
+    ----------
+    urls : list of tokenized mls urls
+
+    remote_selenium : string uri of the remote selenium-server
+
+    sessions : maximum number of selenium sessions open at the same time
+
+    parse_workers : number of worker processes for parsing, 0 parses in this process
+
+    timeout, fetch_mode, parser_name, schema_path, streaming : see fetch_report_html() and parse_report()
+
+    archive : string path of a report archive to store every fetched page in, see report_archive.py
+
+    scrape_date : 'YYYY-MM-DD' string the pages are archived under, today when not given
+    """
+    parse_options = dict(parser_name=parser_name,schema_path=schema_path,streaming=streaming)
+    parse_pool = ProcessPoolExecutor(parse_workers) if parse_workers > 0 else None
+    adapter = new_fetch_adapter(fetch_mode,sessions)
+    parsed = {}
+    try:
+        with ThreadPoolExecutor(max_workers=sessions) as browsers:
+            pages = {browsers.submit(fetch_report_html,url,remote_selenium,timeout,fetch_mode,adapter):num for num, url in enumerate(urls)}
+            for page in as_completed(pages):
+                num = pages[page]
+                try:
+                    html = page.result()
+                except Exception as e:
+                    run_metrics.count('report_failures','fetch')
+                    bprint(f"Skipping report {urls[num]}: {e!r}")
+                    continue
+                if archive is not None:
+                    report_archive.archive_page(archive,html,urls[num],scrape_date)
+                if parse_pool is not None:
+                    parsed[num] = parse_pool.submit(run_metrics.collected,parse_report,html,**parse_options)
+                else:
+                    parsed[num] = parse_report(html,**parse_options)
+
+        rows = []
+        for num in sorted(parsed):
+            try:
+                if parse_pool is not None:
+                    report_rows, metrics = parsed[num].result()
+                    run_metrics.merge(metrics)
+                else:
+                    report_rows = parsed[num]
+                rows.extend(report_rows)
+            except Exception as e:
+                run_metrics.count('report_failures','parse')
+                bprint(f"Skipping report {urls[num]}, parsing failed: {e!r}")
+        return rows
+    finally:
+        if parse_pool is not None:
+            parse_pool.shutdown()
+        if adapter is not None:
+            adapter.close()
+
+def run(args):
+    """
+    Scrapes (or replays) the reports given on the command line and loads the
+    listings to BigQuery or a local file. Rows go to the partition of the
+    date they were scraped on: today, --scrape-date, or for archive replays
+    the date in the archive index
+
+    Parameters
+    ----------
+    args : command line arguments parsed by parser
+    """
+    remote_selenium = args.selenium 
+    extractor = compile_schema(load_schema(args.schema))
+    if args.changes_only and (args.output is not None or args.parquet_dir is not None):
+        parser.error("--changes-only loads to BigQuery and can't be used with --output or --parquet-dir")
+    if args.output is not None:
+        try:
+            local_sink.output_format(args.output)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.from_html is not None and args.from_archive is not None:
+        parser.error("use either --from-html or --from-archive")
+    if args.scrape_date is not None:
+        if args.from_html is None:
+            parser.error("--scrape-date only applies to --from-html, archive replays use the dates in the archive index")
+        try:
+            dt.date.fromisoformat(args.scrape_date)
+        except ValueError:
+            parser.error(f"--scrape-date must be a YYYY-MM-DD date, got {args.scrape_date!r}")
+    elif args.from_html is not None:
+        # everything but --output is stored under the scrape date
+        dated = [name for name, used in (('BigQuery',args.output is None and args.parquet_dir is None),
+                                         ('--parquet-dir',args.parquet_dir is not None),
+                                         ('--history-db',args.history_db is not None)) if used]
+        if dated:
+            parser.error(f"--from-html needs --scrape-date to write to {' and '.join(dated)}, the saved pages have no date")
+    scrape_date = args.scrape_date or str(dt.date.today())
+    if args.from_archive is not None:
+        pages = report_archive.replay_pages(args.from_archive,args.archive_date)
+        if not pages:
+            sys.exit(f"No pages to replay in {args.from_archive}")
+        replay_dates = [date for date, _ in pages]
+        args.from_html = [path for _, path in pages]
+    elif args.from_html is not None:
+        replay_dates = [scrape_date] * len(args.from_html)
+    if args.from_html is not None:
+        urls = []
+    elif args.urls_file is not None:
+        with (sys.stdin if args.urls_file == '-' else open(args.urls_file)) as urls_file:
+            urls = read_report_urls(urls_file)
+    else:
+        urls = [args.url]
+    if args.from_html is None and not urls:
+        sys.exit("No report urls to scrape")
     
     gprint("Acquiring Housing data...")
-    
-    housing_df = pd.DataFrame({})
-    
-    for i in range(get_listing_total(soup)):
-        print (f"Acquiring Data for Listing {i}...")
-        listing_temp = get_listing_entry(i,soup)
-        temp_df = pd.DataFrame(get_results(listing_temp,driver),index=[i])
-        housing_df = housing_df.append(temp_df)
+    # scrape date -> rows scraped on that date
+    if args.from_html is not None:
+        print ("Replaying {} saved report{} scraped on {}".format(len(args.from_html), 's' if len(args.from_html) > 1 else '',
+                                                                ", ".join(sorted(set(replay_dates)))))
+        parse_workers = args.parse_workers if args.parse_workers is not None else min(len(args.from_html), os.cpu_count() or 1)
+        batches = replay_reports(args.from_html,
+                                 replay_dates,
+                                 parse_workers=parse_workers if len(args.from_html) > 1 else 0,
+                                 parser_name=args.parser,
+                                 schema_path=args.schema,
+                                 streaming=args.streaming)
+    elif len(urls) == 1:
+        print ("You Entered the url: {}\nSelenium URI: {}".format(urls[0], remote_selenium))
+        html = fetch_report_html(urls[0],remote_selenium,args.timeout,args.fetch)
+        if args.archive is not None:
+            report_archive.archive_page(args.archive,html,urls[0],scrape_date)
+        batches = {scrape_date:parse_report(html,args.parser,args.schema,args.streaming)}
+        if wait_times:
+            print("Page waits: " + ", ".join(f"{name} {seconds:.1f}s" for name, seconds in wait_times.items()))
+    else:
+        print ("You Entered the urls: {}\nSelenium URI: {}".format("\n".join(urls), remote_selenium))
+        parse_workers = args.parse_workers if args.parse_workers is not None else min(len(urls), os.cpu_count() or 1)
+        batches = {scrape_date:scrape_reports(urls,
+                                              remote_selenium,
+                                              sessions=min(args.sessions, len(urls)),
+                                              parse_workers=parse_workers,
+                                              timeout=args.timeout,
+                                              fetch_mode=args.fetch,
+                                              parser_name=args.parser,
+                                              schema_path=args.schema,
+                                              streaming=args.streaming,
+                                              archive=args.archive,
+                                              scrape_date=scrape_date)}
+    batches = {date:date_rows for date, date_rows in batches.items() if date_rows}
+    rows = [row for date_rows in batches.values() for row in date_rows]
     
     gprint("Data Acquisition Complete")
+    run_metrics.count('rows','scraped',len(rows))
+    if not rows:
+        sys.exit("No listings were scraped")
+    if args.photos is not None:
+        gprint(f"Checking listing photos ({args.photos})...")
+        with run_metrics.timer('photos'):
+            photo_prefetch.prefetch_rows(rows,
+                                         args.photo_cache,
+                                         args.photos,
+                                         concurrency=args.photo_workers,
+                                         rate=args.photo_rate,
+                                         timeout=args.timeout)
     
-    #print ("Deleting prior records from temp table...")
-    #query = """
-    #    #standardSQL
-    #    DELETE housing.mls_tmp
-    #    WHERE TRUE;"""
-    #client.query(query)
+    if args.history_db is not None:
+        history = price_history.connect(args.history_db)
+        with run_metrics.timer('history'):
+            recorded = sum(price_history.record_rows(history,date_rows,date) for date, date_rows in batches.items())
+        bprint(f"Added {recorded} listings to the price history in {args.history_db}")
     
+    # one tuple of sanitized text values per listing, in schema column order
+    # quotes are kept, rows are no longer pasted into a SQL string
     print ("Preping data for BigQuery...")
-    #dataset_id = 'housing'
-    #table_id = 'mls_tmp'
-    #table_ref = client.dataset(dataset_id).table(table_id)
-    #table = client.get_table(table_ref)
+    columns = [name for name, _ in extractor['columns']]
+    check_columns(rows,extractor)
+    with run_metrics.timer('sanitize'):
+        if args.no_pandas:
+            records = [sanitize_row(row,extractor,strip_quotes=False) for row in rows]
+        else:
+            # the scraped text is loaded as is, like sanitize_row() does
+            housing_df = build_housing_frame(rows,extractor,dtypes={})
+            records = sanitize_frame(housing_df,extractor,strip_quotes=False).itertuples(index=False,name=None)
+        bq_rows = [dict(zip(columns, values)) for values in records]
+    # the sanitized rows split up again by scrape date
+    bq_batches = {}
+    first = 0
+    for date, date_rows in batches.items():
+        bq_batches[date] = bq_rows[first:first + len(date_rows)]
+        first += len(date_rows)
+    if args.changes_only:
+        state = change_capture.load_state(args.state)
+        deltas = {}
+        for date in sorted(bq_batches):
+            bq_batches[date], deltas[date] = change_capture.split_changes(bq_batches[date],state,date)
+        print(f"{sum(map(len,bq_batches.values()))} new or changed listings, {sum(map(len,deltas.values()))} unchanged")
     
-    insert_rows = []
-    for _, \
-    bedrooms,  \
-    full_baths, \
-    half_baths, \
-    master_bath, \
-    for_lease, \
-    tax_condo_num, \
-    taxes, \
-    approx_lot_dimensions, \
-    sewer, \
-    water_source, \
-    style, \
-    sub_Style, \
-    monthly_maintenance, \
-    maintenance_includes, \
-    ground_floor, \
-    elementary_school, \
-    first_floor, \
-    jr_highschool, \
-    second_floor, \
-    high_school, \
-    third_floor, \
-    basement, \
-    assessments, \
-    municipal_assessment, \
-    easements, \
-    items_included, \
-    items_not_included, \
-    building_complex, \
-    unit_num, \
-    model_line, \
-    approx_unit_sqtf, \
-    underlying_mtg, \
-    yrs_remaining, \
-    number_of_shares, \
-    number_of_stories, \
-    stairs, \
-    building_assoc_charges, \
-    board_finance_requirements, \
-    management_company, \
-    management_phone, \
-    waterfront, \
-    garage, \
-    life_style, \
-    heating, \
-    cooling, \
-    fireplace, \
-    basement_features, \
-    building_amenities, \
-    maintenance_included, \
-    appliances_included, \
-    year_built, \
-    ownership, \
-    floor_plan, \
-    views, \
-    misc, \
-    pets, \
-    laundry, \
-    possession, \
-    last_price, \
-    ml_num, \
-    address, \
-    town, \
-    zipcode, \
-    county, \
-    county_locale, \
-    areacode, \
-    direct, \
-    original_lp, \
-    days_on_mkt, \
-    image_urls in housing_df.itertuples():
-        insert_rows.append((f"TIMESTAMP('{TODAY}')",
-                           str(bedrooms).replace('"','').replace("'",'') ,
-                            str(full_baths).replace('"','').replace("'",''),
-                            str(half_baths).replace('"','').replace("'",''),
-                            str(master_bath).replace('"','').replace("'",''),
-                            str(for_lease).replace('"','').replace("'",''),
-                            str(tax_condo_num).replace('"','').replace("'",''),
-                            str(taxes).replace('"','').replace("'",''),
-                            str(approx_lot_dimensions).replace('"','').replace("'",''),
-                            str(sewer).replace('"','').replace("'",''),
-                            str(water_source).replace('"','').replace("'",''),
-                            str(style).replace('"','').replace("'",''),
-                            str(sub_Style).replace('"','').replace("'",''),
-                            str(monthly_maintenance).replace('"','').replace("'",''),
-                            str(maintenance_includes).replace('"','').replace("'",''),
-                            str(ground_floor).replace('"','').replace("'",''),
-                            str(elementary_school).replace('"','').replace("'",''),
-                            str(first_floor).replace('"','').replace("'",''),
-                            str(jr_highschool).replace('"','').replace("'",''),
-                            str(second_floor).replace('"','').replace("'",''),
-                            str(high_school).replace('"','').replace("'",''),
-                            str(third_floor).replace('"','').replace("'",''),
-                            str(basement).replace('"','').replace("'",''),
-                            str(assessments).replace('"','').replace("'",''),
-                            str(municipal_assessment).replace('"','').replace("'",''),
-                            str(easements).replace('"','').replace("'",''),
-                            str(items_included).replace('"','').replace("'",''),
-                            str(items_not_included).replace('"','').replace("'",''),
-                            str(building_complex).replace('"','').replace("'",''),
-                            str(unit_num).replace('"','').replace("'",''),
-                            str(model_line).replace('"','').replace("'",''),
-                            str(approx_unit_sqtf).replace('"','').replace("'",''),
-                            str(underlying_mtg).replace('"','').replace("'",''),
-                            str(yrs_remaining).replace('"','').replace("'",''),
-                            str(number_of_shares).replace('"','').replace("'",''),
-                            str(number_of_stories).replace('"','').replace("'",''),
-                            str(stairs).replace('"','').replace("'",''),
-                            str(building_assoc_charges).replace('"','').replace("'",''),
-                            str(board_finance_requirements).replace('"','').replace("'",''),
-                            str(management_company).replace('"','').replace("'",''),
-                            str(management_phone).replace('"','').replace("'",''),
-                            str(waterfront).replace('"','').replace("'",''),
-                            str(garage).replace('"','').replace("'",''),
-                            str(life_style).replace('"','').replace("'",''),
-                            str(heating).replace('"','').replace("'",''),
-                            str(cooling).replace('"','').replace("'",''),
-                            str(fireplace).replace('"','').replace("'",''),
-                            str(basement_features).replace('"','').replace("'",''),
-                            str(building_amenities).replace('"','').replace("'",''),
-                            str(maintenance_included).replace('"','').replace("'",''),
-                            str(appliances_included).replace('"','').replace("'",''),
-                            str(year_built).replace('"','').replace("'",''),
-                            str(ownership).replace('"','').replace("'",''),
-                            str(floor_plan).replace('"','').replace("'",''),
-                            str(views).replace('"','').replace("'",''),
-                            str(misc).replace('"','').replace("'",''),
-                            str(pets).replace('"','').replace("'",''),
-                            str(laundry).replace('"','').replace("'",''),
-                            str(possession).replace('"','').replace("'",''),
-                            str(last_price).replace('"','').replace("'",''),
-                            str(ml_num).replace('"','').replace("'",''),
-                            str(address).replace('"','').replace("'",''),
-                            str(town).replace('"','').replace("'",''),
-                            str(zipcode).replace('"','').replace("'",''),
-                            str(county).replace('"','').replace("'",''),
-                            str(county_locale).replace('"','').replace("'",''),
-                            str(areacode).replace('"','').replace("'",''),
-                            str(direct).replace('"','').replace("'",''),
-                            str(original_lp).replace('"','').replace("'",''),
-                            str(days_on_mkt).replace('"','').replace("'",''),
-                            str(image_urls).replace('"','').replace("'",'')))
-        
-    #errors = client.insert_rows(table, insert_rows)  # API request - runs streaming insert
-    #assert errors == []
-    
-    VALUES_STRING = str(insert_rows)[1:-1]
-    gprint(" Insert results to Time Partitioned table - housing.mls")
-    query = \
-"""#standardSQL
-INSERT INTO housing.mls
-(_PARTITIONTIME,
-    bedrooms,
-    full_baths,
-    half_baths,
-    master_bath,
-    for_lease,
-    tax_condo_num,
-    taxes,
-    approx_lot_dimensions,
-    sewer,
-    water_source,
-    style,
-    sub_Style,
-    monthly_maintenance,
-    maintenance_includes,
-    ground_floor,
-    elementary_school,
-    first_floor,
-    jr_highschool,
-    second_floor,
-    high_school,
-    third_floor,
-    basement,
-    assessments,
-    municipal_assessment,
-    easements,
-    items_included,
-    items_not_included,
-    building_complex,
-    unit_num,
-    model_line,
-    approx_unit_sqtf,
-    underlying_mtg,
-    yrs_remaining,
-    number_of_shares,
-    number_of_stories,
-    stairs,
-    building_assoc_charges,
-    board_finance_requirements,
-    management_company,
-    management_phone,
-    waterfront,
-    garage,
-    life_style,
-    heating,
-    cooling,
-    fireplace,
-    basement_features,
-    building_amenities,
-    maintenance_included,
-    appliances_included,
-    year_built,
-    ownership,
-    floor_plan,
-    views,
-    misc,
-    pets,
-    laundry,
-    possession,
-    last_price,
-    ml_num,
-    address,
-    town,
-    zipcode,
-    county,
-    county_locale,
-    areacode,
-    direct,
-    original_lp,
-    days_on_mkt,
-    image_urls)
-VALUES {value}""".format(value=VALUES_STRING).replace('"','')
-    client.query(query)
+    if args.parquet_dir is not None:
+        gprint(f" Appending typed results to {args.parquet_dir}")
+        for date, date_rows in batches.items():
+            with run_metrics.timer('write_parquet'):
+                path = local_sink.write_parquet_partition(date_rows,args.parquet_dir,extractor['columns'],date)
+            run_metrics.count('rows','written',len(date_rows))
+            bprint(f"Wrote {len(date_rows)} rows to {path}")
+    if args.output is not None:
+        gprint(f" Writing results to {args.output}")
+        with run_metrics.timer('write_local'):
+            written = local_sink.write_rows(bq_rows,args.output,columns)
+        run_metrics.count('rows','written',written)
+        bprint(f"Wrote {written} rows")
+    elif args.parquet_dir is None:
+        for date in sorted(bq_batches):
+            gprint(f" Loading results scraped on {date} to Time Partitioned table - {args.table}")
+            with run_metrics.timer('load'):
+                stats = bq_sink.write_rows(get_client(),
+                                           bq_batches[date],
+                                           table_id=args.table,
+                                           partition_date=date,
+                                           mode=args.sink,
+                                           batch_size=args.batch_size)
+            run_metrics.count('rows','loaded',stats['rows'])
+            bprint("Loaded {rows} rows in {batches} batches, {seconds:.1f}s ({rows_per_sec:.0f} rows/sec)".format(**stats))
+            if args.changes_only:
+                gprint(f" Loading delta records scraped on {date} to Time Partitioned table - {args.delta_table}")
+                with run_metrics.timer('load_deltas'):
+                    stats = bq_sink.write_rows(get_client(),
+                                               deltas[date],
+                                               table_id=args.delta_table,
+                                               partition_date=date,
+                                               mode=args.sink,
+                                               batch_size=args.batch_size)
+                run_metrics.count('rows','deltas',stats['rows'])
+                bprint("Loaded {rows} delta records in {batches} batches, {seconds:.1f}s".format(**stats))
+        if args.changes_only:
+            # saved only once every load went through, a failed run is redone in full
+            change_capture.save_state(state,args.state)
     
     bprint("Done!")
-    driver.close()
     sys.exit(1)
+
+def main():
+    args = parser.parse_args()
+    start = time.perf_counter()
+    try:
+        run(args)
+    finally:
+        # also written when the run fails or exits early
+        if args.metrics is not None:
+            run_metrics.add_time('total',time.perf_counter() - start)
+            run_metrics.write(args.metrics)
         
 if __name__ == "__main__":
     main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3.6
+
+# Local file sink for scraped housing rows, used instead of BigQuery for
+# offline replays and backfills. The output format follows the file extension:
+# .csv, .ndjson/.jsonl or .parquet (parquet needs pandas with pyarrow or fastparquet)
+#
+# write_parquet_partition() writes typed columns instead of sanitized text into
+# a parquet dataset partitioned by scrape date, one new file per run:
+#
+#   <root>/scrape_date=2019-06-01/part-093000-1a2b3c4d.parquet
+
+import os
+import csv
+import json
+import uuid
+import datetime as dt
+
+# column types of the parquet dataset, every other column is a string
+PARQUET_INT_COLUMNS = ('last_price','original_lp','days_on_mkt','taxes')
+PARQUET_CATEGORY_COLUMNS = ('town','county','style')
+PARQUET_LIST_COLUMNS = ('image_urls',)
+LIST_SEPARATOR = '||'
+MISSING = 'empty'
+
+LOCAL_FORMATS = {'.csv':'csv',
+                 '.ndjson':'ndjson',
+                 '.jsonl':'ndjson',
+                 '.parquet':'parquet'}
+
+def output_format(path):
+    """
+    Returns the local output format for a file path, from its extension
+
+    Parameters
+    ----------
+    path : string path of the output file
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in LOCAL_FORMATS:
+        raise ValueError(f"Unknown output format {extension!r}, expected one of {tuple(LOCAL_FORMATS)}")
+    return LOCAL_FORMATS[extension]
+
+def write_rows(rows,path,columns):
+    """
+    Writes rows to a local csv, ndjson or parquet file, replacing the file.
+    Returns the number of rows written
+
+    Parameters
+    ----------
+    rows : list of dictionaries, column name -> value
+
+    path : string path of the output file, see output_format()
+
+    columns : list of column names, in output order
+    """
+    fmt = output_format(path)
+    if fmt == 'csv':
+        with open(path,'w',newline='',encoding='utf-8') as out:
+            writer = csv.DictWriter(out,fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+    elif fmt == 'ndjson':
+        with open(path,'w',encoding='utf-8') as out:
+            for row in rows:
+                out.write(json.dumps(row,ensure_ascii=False))
+                out.write('\n')
+    else:
+        import pandas as pd
+        pd.DataFrame(rows,columns=columns).to_parquet(path,index=False)
+    return len(rows)
+
+def to_int(value):
+    """
+    Returns a price, tax or day count as an int, or None when it isn't a number.
+    Dollar signs and thousands separators are ignored, cents are rounded
+
+    Parameters
+    ----------
+    value : int, float or string, e.g. '$10,588.50'
+    """
+    if isinstance(value,str):
+        value = value.replace('$','').replace(',','').strip()
+    try:
+        return int(round(float(value)))
+    except (TypeError, ValueError):
+        return None
+
+def parquet_schema(names):
+    """
+    Returns the pyarrow schema of the parquet dataset: int64 for
+    PARQUET_INT_COLUMNS, dictionary encoded strings for PARQUET_CATEGORY_COLUMNS,
+    lists of strings for PARQUET_LIST_COLUMNS and strings for the rest
+
+    Parameters
+    ----------
+    names : list of column names, in output order
+    """
+    import pyarrow as pa
+    def column_type(name):
+        if name in PARQUET_INT_COLUMNS:
+            return pa.int64()
+        if name in PARQUET_CATEGORY_COLUMNS:
+            return pa.dictionary(pa.int32(),pa.string())
+        if name in PARQUET_LIST_COLUMNS:
+            return pa.list_(pa.string())
+        return pa.string()
+    return pa.schema([(name, column_type(name)) for name in names])
+
+def typed_columns(rows,columns):
+    """
+    Converts get_results() dictionaries to one list of typed values per column,
+    see parquet_schema(). 'empty' and missing values become None
+
+    Parameters
+    ----------
+    rows : list of dictionaries returned from get_results()
+
+    columns : list of (column name, get_results() key) tuples, e.g. the
+              'columns' of listing_scraper.compile_schema()
+    """
+    def to_text(value):
+        if value is None or value == MISSING:
+            return None
+        return value if isinstance(value,str) else str(value)
+
+    def to_list(value):
+        text = to_text(value)
+        return [item for item in text.split(LIST_SEPARATOR) if item] if text is not None else []
+
+    typed = {}
+    for name, key in columns:
+        values = [row.get(key) for row in rows]
+        if name in PARQUET_INT_COLUMNS:
+            typed[name] = [to_int(value) for value in values]
+        elif name in PARQUET_LIST_COLUMNS:
+            typed[name] = [to_list(value) for value in values]
+        else:
+            typed[name] = [to_text(value) for value in values]
+    return typed
+
+def write_parquet_partition(rows,root,columns,scrape_date=None):
+    """
+    Appends rows to a parquet dataset partitioned by scrape date as a new file
+    in the scrape_date=YYYY-MM-DD folder. Files of earlier runs, also those of
+    the same day, are left as they are. Needs pyarrow. Returns the path written
+
+    Parameters
+    ----------
+    rows : list of dictionaries returned from get_results()
+
+    root : string path of the dataset directory, created when missing
+
+    columns : see typed_columns()
+
+    scrape_date : 'YYYY-MM-DD' string or datetime.date, today when not given
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    scrape_date = str(scrape_date or dt.date.today())
+    schema = parquet_schema([name for name, _ in columns])
+    typed = typed_columns(rows,columns)
+    arrays = []
+    for field in schema:
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(typed[field.name],type=pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(typed[field.name],type=field.type))
+    table = pa.Table.from_arrays(arrays,schema=schema)
+
+    folder = os.path.join(root,f'scrape_date={scrape_date}')
+    os.makedirs(folder,exist_ok=True)
+    path = os.path.join(folder,f"part-{dt.datetime.now():%H%M%S}-{uuid.uuid4().hex[:8]}.parquet")
+    # written under a dot name and renamed, readers skip hidden files
+    tmp_path = os.path.join(folder,'.' + os.path.basename(path))
+    pq.write_table(table,tmp_path)
+    os.replace(tmp_path,path)
+    return path
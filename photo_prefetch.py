@@ -0,0 +1,246 @@
+#!/usr/bin/env python3.6
+
+# Optional photo stage: checks (HEAD) or downloads (GET) the thumbnail urls
+# get_thumbnail_urls() builds, many at a time over one pooled requests.Session
+# and at most `rate` requests per second. Results are cached per listing id and
+# photo count, so a listing whose photo count didn't change is never requested
+# again. Downloaded images are stored once per content hash:
+#
+#   <cache>/listings/<listing id>/<photo count>.json   url -> status, hash, size
+#   <cache>/blobs/ab/ab12...ef.jpg
+#
+# The urls are requested as given, so the stage can be pointed at a local http
+# server by handing it listings with local urls.
+
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+
+import run_metrics
+
+PHOTO_MODES = ('head','get')
+DEFAULT_CACHE_DIR = 'photo_cache'
+URL_SEPARATOR = '||'
+
+class RateLimiter:
+    """
+    Spaces out requests made from one event loop to at most rate per second.
+    A rate of 0 or None doesn't limit
+    """
+    def __init__(self,rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_slot = 0.0
+
+    async def wait(self):
+        now = time.monotonic()
+        slot = max(now,self.next_slot)
+        self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+def manifest_path(cache_dir,listing_id,photo_count):
+    """
+    Returns the path of the cached results of one listing
+
+    Parameters
+    ----------
+    cache_dir : string path of the photo cache
+
+    listing_id : string listing id, e.g. the ml_num
+
+    photo_count : integer number of photo urls of the listing
+    """
+    safe_id = re.sub(r'[^\w.-]','_',str(listing_id))
+    return os.path.join(cache_dir,'listings',safe_id,f'{photo_count}.json')
+
+def load_manifest(path,mode):
+    """
+    Returns the cached results of a listing, or None when there are none that
+    serve this mode (HEAD results don't hold the images a GET run needs)
+
+    Parameters
+    ----------
+    path : string path returned from manifest_path()
+
+    mode : one of PHOTO_MODES
+    """
+    try:
+        with open(path) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (FileNotFoundError, ValueError):
+        return None
+    if mode == 'get' and manifest.get('mode') != 'get':
+        return None
+    return manifest
+
+def store_blob(cache_dir,content):
+    """
+    Stores downloaded image bytes once per content hash. Returns the hash
+
+    Parameters
+    ----------
+    cache_dir : string path of the photo cache
+
+    content : bytes of the image
+    """
+    digest = hashlib.sha256(content).hexdigest()
+    path = os.path.join(cache_dir,'blobs',digest[:2],digest + '.jpg')
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path,'wb') as blob:
+            blob.write(content)
+        os.replace(tmp_path,path)
+    return digest
+
+def request_photo(session,url,mode,cache_dir,timeout):
+    """
+    Requests one photo url (blocking). Servers that refuse HEAD get a streamed
+    GET that is closed before the body is read. Returns the url's cache entry:
+    the http status, whether it is a usable image and, for GET, its hash and size
+
+    Parameters
+    ----------
+    session : requests.Session
+
+    url : string photo url
+
+    mode : one of PHOTO_MODES
+
+    cache_dir : string path of the photo cache
+
+    timeout : seconds to wait for the response
+    """
+    if mode == 'head':
+        response = session.head(url,timeout=timeout,allow_redirects=True)
+        if response.status_code in (403, 405, 501):
+            with session.get(url,timeout=timeout,stream=True) as response:
+                pass
+    else:
+        response = session.get(url,timeout=timeout)
+    content_type = response.headers.get('Content-Type','')
+    entry = {'status':response.status_code,
+             'ok':response.status_code == 200 and content_type.startswith('image/')}
+    if mode == 'get' and entry['ok']:
+        entry['sha256'] = store_blob(cache_dir,response.content)
+        entry['bytes'] = len(response.content)
+    return entry
+
+async def prefetch_listing(listing_id,urls,cache_dir,mode,request,limiter,slots):
+    """
+    Checks or downloads the photos of one listing, unless they are cached.
+    The results are only cached when every url got an http response, so
+    network errors are retried on the next run. Returns the urls that are
+    usable images, and those that got no response and may still be
+
+    Parameters
+    ----------
+    listing_id : string listing id, e.g. the ml_num
+
+    urls : list of string photo urls
+
+    cache_dir : string path of the photo cache
+
+    mode : one of PHOTO_MODES
+
+    request : coroutine function taking a url, returning request_photo()'s entry
+
+    limiter : RateLimiter shared by every request
+
+    slots : asyncio.Semaphore bounding the requests in flight
+    """
+    path = manifest_path(cache_dir,listing_id,len(urls))
+    manifest = load_manifest(path,mode)
+    if manifest is not None and set(manifest['urls']) == set(urls):
+        run_metrics.count('photos','cached',len(urls))
+        return [url for url in urls if manifest['urls'][url]['ok']]
+
+    async def check(url):
+        async with slots:
+            await limiter.wait()
+            try:
+                return await request(url)
+            except Exception as e:
+                run_metrics.count('photos','errors')
+                return {'status':None,'ok':False,'error':repr(e)}
+
+    entries = dict(zip(urls,await asyncio.gather(*[check(url) for url in urls])))
+    run_metrics.count('photos','requested',len(urls))
+    run_metrics.count('photos','invalid',sum(1 for entry in entries.values() if not entry['ok']))
+    if all(entry['status'] is not None for entry in entries.values()):
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        with open(path,'w') as manifest_file:
+            json.dump({'mode':mode,'checked':str(dt.date.today()),'urls':entries},manifest_file)
+    # only a bad http response drops a url, a timeout says nothing about the photo
+    return [url for url in urls if entries[url]['ok'] or entries[url]['status'] is None]
+
+async def prefetch_all(listings,cache_dir,mode,concurrency,rate,timeout,session):
+    """
+    Coroutine behind prefetch_photos(), see there
+    """
+    loop = asyncio.get_running_loop()
+    limiter = RateLimiter(rate)
+    slots = asyncio.Semaphore(concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as requests_pool:
+        async def request(url):
+            return await loop.run_in_executor(requests_pool,request_photo,session,url,mode,cache_dir,timeout)
+        valid = await asyncio.gather(*[prefetch_listing(listing_id,urls,cache_dir,mode,request,limiter,slots)
+                                       for listing_id, urls in listings])
+    return {listing_id:urls for (listing_id, _), urls in zip(listings,valid)}
+
+def prefetch_photos(listings,cache_dir=DEFAULT_CACHE_DIR,mode='head',concurrency=8,rate=10.0,timeout=30,session=None):
+    """
+    Checks or downloads the photos of many listings at once. Returns a
+    dictionary of listing id -> list of the urls that weren't refused,
+    see prefetch_listing()
+
+    Parameters
+    ----------
+    listings : list of (listing id, list of photo urls) tuples
+
+    cache_dir : string path of the photo cache, created when missing
+
+    mode : 'head' only checks the urls, 'get' also downloads the images
+
+    concurrency : maximum number of requests in flight
+
+    rate : maximum number of requests started per second, 0 for no limit
+
+    timeout : seconds to wait for each response
+
+    session : requests.Session to use, see report_fetch.new_session().
+              A new one with a connection pool of size concurrency when not given
+    """
+    if mode not in PHOTO_MODES:
+        raise ValueError(f"Unknown photo mode {mode!r}, expected one of {PHOTO_MODES}")
+    if session is None:
+        import report_fetch
+        session = report_fetch.new_session(pool_size=concurrency)
+    return asyncio.run(prefetch_all(listings,cache_dir,mode,concurrency,rate,timeout,session))
+
+def prefetch_rows(rows,cache_dir=DEFAULT_CACHE_DIR,mode='head',**options):
+    """
+    prefetch_photos() for get_results() dictionaries, keyed by ml_num.
+    Each row's image_urls is updated in place to drop the refused urls.
+    Rows without an ml_num or photos are left alone
+
+    Parameters
+    ----------
+    rows : list of dictionaries returned from get_results()
+
+    cache_dir, mode, options : see prefetch_photos()
+    """
+    listings = {}
+    for row in rows:
+        if row.get('ml_num') and row.get('image_urls'):
+            listings.setdefault(row['ml_num'],row['image_urls'].split(URL_SEPARATOR))
+    valid = prefetch_photos(list(listings.items()),cache_dir,mode,**options)
+    for row in rows:
+        if row.get('ml_num') in valid and row.get('image_urls'):
+            row['image_urls'] = URL_SEPARATOR.join(valid[row['ml_num']])
+    return rows
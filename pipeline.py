@@ -0,0 +1,365 @@
+#!/usr/bin/env python3.6
+
+# token -> scrape -> load pipeline. The three stages run as asyncio tasks with
+# a bounded queue between each of them, so reports are scraped while gmail is
+# still being read and rows are loaded while other reports are still scraping:
+#
+#   harvest_urls --url_queue--> scrape_reports (x sessions) --report_queue--> load_rows
+#
+# Blocking work runs off the event loop: gmail and selenium/http calls in
+# threads, html parsing in a pool of worker processes, BigQuery batches in a thread.
+#
+# A gmail message only counts as done once the rows of its report are loaded.
+# Until then the state file lists it to retry, so a report that fails, or is
+# still queued when the process stops, is fetched again on the next check or run.
+
+import copy
+import time
+import asyncio
+import argparse
+import functools
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+
+import bq_sink
+import price_history
+import report_archive
+import run_metrics
+import get_listing_token as tokens
+import listing_scraper as scraper
+from listing_scraper import gprint, bprint
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--user",default="<email>")
+parser.add_argument("--sender",default="patty@paulaclarkrealtor.com",help="only messages from this address are read")
+parser.add_argument("--state",default="token_state.json",help="json file remembering which messages were already processed")
+parser.add_argument("--poll-interval",type=float,default=300,help="seconds between gmail checks, scraped rows are also loaded at least this often")
+parser.add_argument("--once",action="store_true",help="check gmail once, finish the scraped reports and exit")
+parser.add_argument("--selenium",default="http://selenium:4444/wd/hub")
+parser.add_argument("--sessions",type=int,default=4,help="reports scraped at the same time")
+parser.add_argument("--parse-workers",type=int,default=2,help="worker processes for html parsing")
+parser.add_argument("--fetch",default="auto",choices=scraper.FETCH_MODES)
+parser.add_argument("--timeout",type=float,default=scraper.DEFAULT_TIMEOUT)
+parser.add_argument("--parser",default=scraper.DEFAULT_PARSER,choices=scraper.PARSERS)
+parser.add_argument("--streaming",action="store_true",help="parse each report one listing at a time")
+parser.add_argument("--archive",default=None,metavar="DIR",help="keep a compressed copy of every fetched report page in this archive directory")
+parser.add_argument("--schema",default=scraper.SCHEMA_PATH)
+parser.add_argument("--table",default=bq_sink.DEFAULT_TABLE)
+parser.add_argument("--sink",default="load",choices=bq_sink.SINK_MODES)
+parser.add_argument("--batch-size",type=int,default=bq_sink.DEFAULT_BATCH_SIZE,help="rows per BigQuery load job / insert request")
+parser.add_argument("--history-db",default=None,help="also add the prices of every listing to this sqlite price history, see price_history.py")
+parser.add_argument("--metrics",default=None,help="write stage timings and per-field fallback counts to this file: .prom for a prometheus textfile, anything else appends json lines")
+parser.add_argument("--queue-size",type=int,default=10,help="parsed reports buffered between scraping and loading")
+
+class TokenTracker:
+    """
+    The gmail state shared by the stages. A message is marked processed as
+    soon as its report is queued, so the next check doesn't list it again,
+    but it is saved as one to retry until loaded() or failed() is called
+    for its report
+    """
+    def __init__(self,path):
+        self.path = path
+        self.state = tokens.LoadState(path)
+        # message ID -> failed attempts so far, for the reports being scraped or loaded
+        self.in_flight = {}
+
+    def snapshot(self):
+        """
+        Returns a copy of the state for a gmail check running in another thread
+        """
+        return copy.deepcopy(self.state)
+
+    def harvested(self,fetched,failed):
+        """
+        Records the messages of one gmail check and saves the state. Returns
+        the (message ID, Date header, tokenlogin url) tuples of the reports to scrape
+
+        Parameters
+        ----------
+        fetched, failed : tuple returned from fetch_reports()
+        """
+        reports = []
+        for msg_id, internal_date, date, url in fetched:
+            attempts = self.state['retry'].get(msg_id,0)
+            tokens.MarkProcessed(self.state,msg_id,internal_date)
+            if url is not None:
+                self.in_flight[msg_id] = attempts
+                reports.append((msg_id,date,url))
+        for msg_id in failed:
+            self.retry(msg_id,self.state['retry'].get(msg_id,0) + 1)
+        tokens.PruneProcessed(self.state)
+        self.save()
+        return reports
+
+    def loaded(self,msg_ids):
+        """
+        Marks the messages whose report rows are loaded as done and saves the state
+
+        Parameters
+        ----------
+        msg_ids : list of message IDs
+        """
+        for msg_id in msg_ids:
+            self.in_flight.pop(msg_id,None)
+        self.save()
+
+    def failed(self,msg_id):
+        """
+        Keeps the message of a report that could not be scraped to retry on
+        the next check and saves the state
+
+        Parameters
+        ----------
+        msg_id : message ID
+        """
+        self.retry(msg_id,self.in_flight.pop(msg_id) + 1)
+        self.save()
+
+    def retry(self,msg_id,attempts):
+        """
+        Keeps a message to fetch again on the next check, see get_listing_token.MarkRetry()
+        """
+        if not tokens.MarkRetry(self.state,msg_id,attempts):
+            bprint(f"Giving up on message {msg_id} after {attempts} failed attempts")
+
+    def save(self):
+        """
+        Writes the state file
+        """
+        # reports that are still being scraped or loaded are saved as retries
+        tokens.SaveState(self.path,dict(self.state,retry={**self.state['retry'],**self.in_flight}))
+
+def fetch_reports(service,user,sender,state):
+    """
+    Checks gmail for new messages and messages to retry (blocking). Returns a
+    tuple (fetched, failed): fetched is a list of (message ID, internalDate,
+    Date header, tokenlogin url or None) tuples, oldest first, failed lists
+    the IDs that could not be fetched
+
+    Parameters
+    ----------
+    service : gmail service from get_listing_token.GetService()
+
+    user, sender : see get_listing_token.FetchNewMessages()
+
+    state : copy of the state, see TokenTracker.snapshot()
+    """
+    fetched, failed = tokens.FetchNewMessages(service,user,sender,state)
+    return [(msg_id,internal_date,msg['Date'],tokens.GetSenderTokenUrl(msg,sender))
+            for msg_id, msg, internal_date in fetched], failed
+
+async def harvest_urls(args,url_queue,scrapers,tracker):
+    """
+    Token stage. Checks gmail for new listing emails every poll interval and
+    queues their tokenized report urls, along with their message IDs. A check
+    that fails is reported and the next one goes ahead as usual, only failing
+    to connect to gmail at all stops the pipeline. Sends one None per scraper
+    when done
+
+    Parameters
+    ----------
+    args : parsed command line arguments
+
+    url_queue : asyncio.Queue feeding scrape_reports()
+
+    scrapers : number of scrape_reports() tasks reading url_queue
+
+    tracker : TokenTracker
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        service = await loop.run_in_executor(None,tokens.GetService)
+        while True:
+            try:
+                checked = await loop.run_in_executor(None,fetch_reports,service,args.user,args.sender,tracker.snapshot())
+            except Exception as e:
+                run_metrics.count('report_failures','gmail')
+                bprint(f"Checking gmail failed, trying again on the next check: {e!r}")
+            else:
+                for msg_id, date, url in tracker.harvested(*checked):
+                    gprint(f"{date} - {url}")
+                    await url_queue.put((msg_id,url))
+            if args.once:
+                break
+            await asyncio.sleep(args.poll_interval)
+    finally:
+        for _ in range(scrapers):
+            await url_queue.put(None)
+
+async def scrape_reports(args,url_queue,report_queue,parse_pool,adapter,tracker):
+    """
+    Scrape stage. Fetches each queued report and parses it in parse_pool,
+    then queues a dictionary with its message ID, url, scrape date and rows.
+    Reports that fail are reported and left to retry, see TokenTracker.failed().
+    Sends None to report_queue when url_queue is exhausted
+
+    Parameters
+    ----------
+    args : parsed command line arguments
+
+    url_queue : asyncio.Queue filled by harvest_urls()
+
+    report_queue : asyncio.Queue feeding load_rows()
+
+    parse_pool : concurrent.futures.ProcessPoolExecutor used for parsing
+
+    adapter : connection pool shared by the direct downloads, see
+              listing_scraper.new_fetch_adapter()
+
+    tracker : TokenTracker
+    """
+    loop = asyncio.get_running_loop()
+    extractor = scraper.compile_schema(scraper.load_schema(args.schema))
+    try:
+        while True:
+            item = await url_queue.get()
+            if item is None:
+                break
+            msg_id, url = item
+            # taken per report, the pipeline keeps running past midnight
+            scrape_date = str(dt.date.today())
+            try:
+                html = await loop.run_in_executor(None,scraper.fetch_report_html,
+                                                  url,args.selenium,args.timeout,args.fetch,adapter)
+                if args.archive is not None:
+                    await loop.run_in_executor(None,report_archive.archive_page,
+                                               args.archive,html,url,scrape_date)
+                rows, metrics = await loop.run_in_executor(parse_pool,run_metrics.collected,scraper.parse_report,
+                                                           html,args.parser,args.schema,args.streaming)
+                scraper.check_columns(rows,extractor)
+            except Exception as e:
+                run_metrics.count('report_failures','scrape')
+                bprint(f"Report {url} failed, retrying on the next check: {e!r}")
+                tracker.failed(msg_id)
+                continue
+            run_metrics.merge(metrics)
+            bprint(f"Scraped {len(rows)} listings from {url}")
+            await report_queue.put({'msg_id':msg_id,'url':url,'date':scrape_date,'rows':rows})
+    finally:
+        await report_queue.put(None)
+
+async def load_rows(args,report_queue,scrapers,tracker):
+    """
+    Load stage. Sanitizes the rows of each queued report and writes them to
+    the BigQuery partition (and price history) of the date the report was
+    scraped on. Rows are written once batch_size new rows are waiting, at
+    least every poll interval, and once more after every scraper is done.
+    A report's message is marked done once its rows are loaded; when a load
+    fails its rows are kept and written again at the next flush. Returns the
+    total number of rows loaded
+
+    Parameters
+    ----------
+    args : parsed command line arguments
+
+    report_queue : asyncio.Queue filled by scrape_reports()
+
+    scrapers : number of scrape_reports() tasks writing to report_queue
+
+    tracker : TokenTracker
+    """
+    loop = asyncio.get_running_loop()
+    extractor = scraper.compile_schema(scraper.load_schema(args.schema))
+    columns = [name for name, _ in extractor['columns']]
+    history = price_history.connect(args.history_db) if args.history_db is not None else None
+    # scrape date -> reports waiting to be loaded
+    pending = {}
+
+    async def flush():
+        written = 0
+        for date in sorted(pending):
+            reports = pending[date]
+            bq_rows = [row for report in reports for row in report['bq_rows']]
+            try:
+                if history is not None:
+                    with run_metrics.timer('history'):
+                        price_history.record_rows(history,[row for report in reports for row in report['rows']],date)
+                start = time.perf_counter()
+                stats = await loop.run_in_executor(None,functools.partial(bq_sink.write_rows,
+                                                                          scraper.get_client(),
+                                                                          bq_rows,
+                                                                          table_id=args.table,
+                                                                          partition_date=date,
+                                                                          mode=args.sink,
+                                                                          batch_size=args.batch_size))
+            except Exception as e:
+                run_metrics.count('report_failures','load')
+                bprint(f"Loading {len(bq_rows)} rows scraped on {date} failed, keeping them for the next flush: {e!r}")
+                continue
+            run_metrics.add_time('load',time.perf_counter() - start)
+            run_metrics.count('rows','loaded',stats['rows'])
+            bprint("Loaded {rows} rows scraped on {date} in {seconds:.1f}s ({rows_per_sec:.0f} rows/sec)".format(date=date,**stats))
+            del pending[date]
+            tracker.loaded([report['msg_id'] for report in reports])
+            written += stats['rows']
+        return written
+
+    loaded = 0
+    # rows received since the last flush, a failed load is only retried once
+    # enough new rows come in or the poll interval is up
+    received = 0
+    next_flush = loop.time() + args.poll_interval
+    finished = 0
+    while finished < scrapers:
+        try:
+            report = await asyncio.wait_for(report_queue.get(),max(0.0,next_flush - loop.time()))
+        except asyncio.TimeoutError:
+            pass
+        else:
+            if report is None:
+                finished += 1
+                continue
+            with run_metrics.timer('sanitize'):
+                report['bq_rows'] = [dict(zip(columns,scraper.sanitize_row(row,extractor,strip_quotes=False)))
+                                     for row in report['rows']]
+            pending.setdefault(report['date'],[]).append(report)
+            received += len(report['rows'])
+        if received >= args.batch_size or loop.time() >= next_flush:
+            if pending:
+                loaded += await flush()
+            received = 0
+            next_flush = loop.time() + args.poll_interval
+    if pending:
+        loaded += await flush()
+    if pending:
+        bprint(f"{sum(len(reports) for reports in pending.values())} reports could not be loaded, they are fetched again on the next run")
+    return loaded
+
+async def run_pipeline(args):
+    """
+    Runs the three stages together until gmail polling stops (see --once)
+    and every queued report is loaded. Returns the number of rows loaded
+
+    Parameters
+    ----------
+    args : parsed command line arguments
+    """
+    tracker = TokenTracker(args.state)
+    url_queue = asyncio.Queue(maxsize=args.sessions * 2)
+    report_queue = asyncio.Queue(maxsize=args.queue_size)
+    adapter = scraper.new_fetch_adapter(args.fetch,args.sessions)
+    try:
+        with ProcessPoolExecutor(args.parse_workers) as parse_pool:
+            loaded, *_ = await asyncio.gather(load_rows(args,report_queue,args.sessions,tracker),
+                                              harvest_urls(args,url_queue,args.sessions,tracker),
+                                              *[scrape_reports(args,url_queue,report_queue,parse_pool,adapter,tracker)
+                                                for _ in range(args.sessions)])
+    finally:
+        if adapter is not None:
+            adapter.close()
+    return loaded
+
+def main():
+    args = parser.parse_args()
+    start = time.perf_counter()
+    try:
+        loaded = asyncio.run(run_pipeline(args))
+    finally:
+        if args.metrics is not None:
+            run_metrics.add_time('total',time.perf_counter() - start)
+            run_metrics.write(args.metrics)
+    gprint(f"Pipeline done, {loaded} rows loaded")
+
+if __name__ == "__main__":
+    main()
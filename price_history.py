@@ -0,0 +1,197 @@
+#!/usr/bin/env python3.6
+
+# Local price history of every listing, one row per ml_num and scrape date, in
+# a SQLite file that each scraper run adds to (see --history-db). Answers
+# per-listing questions without scanning BigQuery partitions:
+#
+#   python price_history.py history 1234567
+#   python price_history.py drops --since 2019-06-01
+#   python price_history.py time-on-market --date 2019-06-07
+
+import sys
+import sqlite3
+import argparse
+import datetime as dt
+
+from local_sink import to_int
+
+DEFAULT_DB_PATH = 'price_history.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS price_history (
+    ml_num TEXT NOT NULL,
+    scrape_date TEXT NOT NULL,
+    last_price INTEGER,
+    original_lp INTEGER,
+    days_on_mkt INTEGER,
+    address TEXT,
+    town TEXT,
+    PRIMARY KEY (ml_num, scrape_date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS price_history_by_date ON price_history (scrape_date, ml_num);
+"""
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--db",default=DEFAULT_DB_PATH,help="sqlite file written by listing_scraper.py --history-db")
+commands = parser.add_subparsers(dest="command")
+history_command = commands.add_parser("history",help="every scraped price of one listing")
+history_command.add_argument("ml_num")
+drops_command = commands.add_parser("drops",help="price drops seen since a date")
+drops_command.add_argument("--since",default=None,help="YYYY-MM-DD, a week ago when not given")
+drops_command.add_argument("--until",default=None,help="YYYY-MM-DD, no end when not given")
+market_command = commands.add_parser("time-on-market",help="first/last seen dates and days on market")
+market_command.add_argument("ml_num",nargs="?",default=None,help="one listing, otherwise every listing scraped on --date")
+market_command.add_argument("--date",default=None,help="YYYY-MM-DD, the latest scrape date when not given")
+
+def connect(path=DEFAULT_DB_PATH):
+    """
+    Opens the price history database, creating the table when missing.
+    Rows come back as sqlite3.Row, which converts with dict()
+
+    Parameters
+    ----------
+    path : string path of the sqlite file
+    """
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+def record_rows(conn,rows,scrape_date):
+    """
+    Adds one scrape of listings. Scraping the same day again replaces that
+    day's rows. Rows without an ml_num are skipped. Returns the number of rows written
+
+    Parameters
+    ----------
+    conn : connection returned from connect()
+
+    rows : list of get_results() dictionaries (or sanitized BigQuery rows)
+
+    scrape_date : 'YYYY-MM-DD' string or datetime.date
+    """
+    records = [(str(row['ml_num']),
+                str(scrape_date),
+                to_int(row.get('last_price')),
+                to_int(row.get('original_lp')),
+                to_int(row.get('days_on_mkt')),
+                row.get('address'),
+                row.get('town'))
+               for row in rows if row.get('ml_num') not in (None, '', 'empty')]
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO price_history "
+                         "(ml_num, scrape_date, last_price, original_lp, days_on_mkt, address, town) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)",records)
+    return len(records)
+
+def history(conn,ml_num):
+    """
+    Returns every scrape of one listing, oldest first, with the price change
+    against the scrape before
+
+    Parameters
+    ----------
+    conn : connection returned from connect()
+
+    ml_num : string listing number
+    """
+    return conn.execute("SELECT scrape_date, last_price, original_lp, days_on_mkt, address, town, "
+                        "last_price - LAG(last_price) OVER (ORDER BY scrape_date) AS change "
+                        "FROM price_history WHERE ml_num = ? ORDER BY scrape_date",(str(ml_num),)).fetchall()
+
+def price_drops(conn,since,until=None):
+    """
+    Returns every price drop between two consecutive scrapes of a listing
+    where the later scrape falls between since and until, biggest drop first
+
+    Parameters
+    ----------
+    conn : connection returned from connect()
+
+    since : 'YYYY-MM-DD' string, first scrape date to look at
+
+    until : 'YYYY-MM-DD' string, last scrape date to look at, None for no end
+    """
+    until = until or '9999-12-31'
+    # the scrape before each one in range is found through the primary key,
+    # so only the scrapes in range are read
+    return conn.execute("""
+        SELECT ml_num, address, town, previous_date, previous_price, scrape_date, last_price,
+               last_price - previous_price AS change
+        FROM (SELECT cur.ml_num, cur.address, cur.town, cur.scrape_date, cur.last_price,
+                     prev.scrape_date AS previous_date, prev.last_price AS previous_price
+              FROM price_history cur
+              JOIN price_history prev ON prev.ml_num = cur.ml_num
+               AND prev.scrape_date = (SELECT MAX(earlier.scrape_date) FROM price_history earlier
+                                       WHERE earlier.ml_num = cur.ml_num AND earlier.scrape_date < cur.scrape_date)
+              WHERE cur.scrape_date BETWEEN ? AND ?)
+        WHERE last_price < previous_price
+        ORDER BY change, ml_num""",(since,until)).fetchall()
+
+def time_on_market(conn,ml_num=None,date=None):
+    """
+    Returns, per listing, the first and last scrape it was seen in, the number
+    of scrapes, its latest days on market and its price change since the first
+    scrape. Either for one listing, or for every listing scraped on date
+    (the latest scrape date when not given), longest on market first
+
+    Parameters
+    ----------
+    conn : connection returned from connect()
+
+    ml_num : string listing number, None for every listing scraped on date
+
+    date : 'YYYY-MM-DD' string
+    """
+    summary = """
+        SELECT ml_num, MIN(scrape_date) AS first_seen, MAX(scrape_date) AS last_seen,
+               COUNT(*) AS scrapes,
+               (SELECT days_on_mkt FROM price_history latest
+                WHERE latest.ml_num = seen.ml_num ORDER BY scrape_date DESC LIMIT 1) AS days_on_mkt,
+               (SELECT last_price FROM price_history latest
+                WHERE latest.ml_num = seen.ml_num ORDER BY scrape_date DESC LIMIT 1)
+             - (SELECT last_price FROM price_history first
+                WHERE first.ml_num = seen.ml_num ORDER BY scrape_date LIMIT 1) AS change
+        FROM price_history seen"""
+    if ml_num is not None:
+        return conn.execute(summary + " WHERE ml_num = ? GROUP BY ml_num",(str(ml_num),)).fetchall()
+    if date is None:
+        date = conn.execute("SELECT MAX(scrape_date) FROM price_history").fetchone()[0]
+    return conn.execute(summary + " WHERE ml_num IN (SELECT ml_num FROM price_history WHERE scrape_date = ?) "
+                        "GROUP BY ml_num ORDER BY days_on_mkt DESC, ml_num",(date,)).fetchall()
+
+def print_rows(rows):
+    """
+    Prints query results as an aligned table
+
+    Parameters
+    ----------
+    rows : list of sqlite3.Row
+    """
+    if not rows:
+        print("No results")
+        return
+    names = rows[0].keys()
+    values = [["" if value is None else str(value) for value in row] for row in rows]
+    widths = [max(len(name), *(len(row[k]) for row in values)) for k, name in enumerate(names)]
+    print("  ".join(name.ljust(width) for name, width in zip(names, widths)))
+    for row in values:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)))
+
+def main():
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        sys.exit(2)
+    conn = connect(args.db)
+    if args.command == "history":
+        print_rows(history(conn,args.ml_num))
+    elif args.command == "drops":
+        since = args.since or str(dt.date.today() - dt.timedelta(days=7))
+        print_rows(price_drops(conn,since,args.until))
+    else:
+        print_rows(time_on_market(conn,args.ml_num,args.date))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3.6
+
+# Local archive of the raw printable reports pages, so history can be parsed
+# again when extraction changes. Pages are stored once per content hash and
+# compressed with zstd when the zstandard package is installed, gzip otherwise:
+#
+#   <root>/objects/ab/ab12...ef.html.zst
+#   <root>/index.ndjson    one line per fetched page: date, url, hash, path, size
+#
+# The index is append-only, so fetching the same page again only adds a line.
+# Both the index and the page objects are read through mmap.
+
+import os
+import gzip
+import json
+import mmap
+import hashlib
+import threading
+import datetime as dt
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+INDEX_NAME = 'index.ndjson'
+OBJECTS_DIR = 'objects'
+
+_index_lock = threading.Lock()
+
+def page_hash(data):
+    """
+    Returns the sha256 hex digest the archive keys a page by
+
+    Parameters
+    ----------
+    data : bytes of the utf-8 encoded page source
+    """
+    return hashlib.sha256(data).hexdigest()
+
+def compress(data):
+    """
+    Returns a tuple of (compressed bytes, file extension), zstd when available
+
+    Parameters
+    ----------
+    data : bytes
+    """
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress(data), '.html.zst'
+    return gzip.compress(data,compresslevel=6), '.html.gz'
+
+def read_object(path):
+    """
+    Reads and decompresses one archived page (.html.zst or .html.gz) through
+    mmap. Returns the page source
+
+    Parameters
+    ----------
+    path : string path of the object file
+    """
+    with open(path,'rb') as page, mmap.mmap(page.fileno(),0,access=mmap.ACCESS_READ) as data:
+        if path.endswith('.zst'):
+            if zstandard is None:
+                raise RuntimeError(f"{path} is zstd compressed, install zstandard to read it")
+            with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+                raw = reader.read()
+        else:
+            with gzip.GzipFile(fileobj=data) as reader:
+                raw = reader.read()
+    return raw.decode('utf-8',errors='replace')
+
+def find_object(root,digest):
+    """
+    Returns the path of a stored page with this hash, in either format, or None
+
+    Parameters
+    ----------
+    root : string path of the archive directory
+
+    digest : string hash returned from page_hash()
+    """
+    folder = os.path.join(root,OBJECTS_DIR,digest[:2])
+    for extension in ('.html.zst','.html.gz'):
+        path = os.path.join(folder,digest + extension)
+        if os.path.exists(path):
+            return path
+    return None
+
+def archive_page(root,html,url,date=None):
+    """
+    Stores a fetched page, unless a page with the same content is already
+    stored, and adds it to the index. Safe to call from several threads.
+    Returns the index entry
+
+    Parameters
+    ----------
+    root : string path of the archive directory, created when missing
+
+    html : string page source
+
+    url : string url the page was fetched for
+
+    date : 'YYYY-MM-DD' string of the scrape, today when not given
+    """
+    data = html.encode('utf-8')
+    digest = page_hash(data)
+    path = find_object(root,digest)
+    if path is None:
+        compressed, extension = compress(data)
+        path = os.path.join(root,OBJECTS_DIR,digest[:2],digest + extension)
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path,'wb') as page:
+            page.write(compressed)
+        os.replace(tmp_path,path)
+
+    entry = {'date':date or str(dt.date.today()),
+             'fetched_at':dt.datetime.now().isoformat(timespec='seconds'),
+             'url':url,
+             'hash':digest,
+             'path':os.path.relpath(path,root),
+             'bytes':len(data)}
+    with _index_lock, open(os.path.join(root,INDEX_NAME),'a',encoding='utf-8') as index:
+        index.write(json.dumps(entry) + '\n')
+    return entry
+
+def iter_index(root,date=None,url=None):
+    """
+    Streams the index entries of the archive, oldest first, optionally only
+    those of one scrape date and/or url
+
+    Parameters
+    ----------
+    root : string path of the archive directory
+
+    date : 'YYYY-MM-DD' string, None for every date
+
+    url : string url, None for every url
+    """
+    path = os.path.join(root,INDEX_NAME)
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path,'rb') as index, mmap.mmap(index.fileno(),0,access=mmap.ACCESS_READ) as data:
+        for line in iter(data.readline,b''):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if (date is None or entry['date'] == date) and (url is None or entry['url'] == url):
+                yield entry
+
+def object_paths(root,date=None,url=None):
+    """
+    Returns the paths of the stored pages matching the filters, each page once,
+    in the order they were first fetched, e.g. for benchmarks/bench_stages.py
+
+    Parameters
+    ----------
+    root, date, url : see iter_index()
+    """
+    paths = {}
+    for entry in iter_index(root,date,url):
+        paths.setdefault(entry['hash'],os.path.join(root,entry['path']))
+    return list(paths.values())
+
+def replay_pages(root,date=None,url=None):
+    """
+    Returns (scrape date, path) tuples of the stored pages matching the
+    filters, each page once per date it was scraped on, in the order they
+    were fetched. Used for replays, see listing_scraper.replay_reports()
+
+    Parameters
+    ----------
+    root, date, url : see iter_index()
+    """
+    pages = {}
+    for entry in iter_index(root,date,url):
+        pages.setdefault((entry['date'],entry['hash']),os.path.join(root,entry['path']))
+    return [(scrape_date, path) for (scrape_date, _), path in pages.items()]
+
+def iter_pages(root,date=None,url=None):
+    """
+    Streams (index entry, page source) tuples for the stored pages matching the
+    filters, each page once, reading one page at a time
+
+    Parameters
+    ----------
+    root, date, url : see iter_index()
+    """
+    seen = set()
+    for entry in iter_index(root,date,url):
+        if entry['hash'] in seen:
+            continue
+        seen.add(entry['hash'])
+        yield entry, read_object(os.path.join(root,entry['path']))
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3.6
+
+# Direct HTTP fetch of the printable reports page, without a browser.
+# The tokenized link logs the session in (the login cookies stay on the
+# requests.Session), the dashboard html holds the 'Printable Reports' link,
+# and the report page is then downloaded over the same kept-alive connection.
+# Batch runs give every report its own session, so the cookies of concurrent
+# logins never mix, and share one connection pool (an HTTPAdapter) between them.
+
+import re
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urljoin
+from bs4 import BeautifulSoup
+
+DASHBOARD_TITLE = 'Dashboard | Collab Center'
+REPORT_TITLE = 'Customer Report'
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0 Safari/537.36'
+
+TITLE = re.compile(r'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+PRINTABLE_REPORTS = re.compile(r'^\s*Printable Reports\s*$')
+
+class ReportFetchError(Exception):
+    """
+    The printable reports page could not be fetched without a browser,
+    e.g. the token expired or the link to the report is built with javascript
+    """
+
+def new_adapter(pool_size=4):
+    """
+    Creates the HTTPAdapter holding the kept-alive connections. One adapter
+    can be shared by the sessions of many reports, see fetch_report_direct()
+
+    Parameters
+    ----------
+    pool_size : number of kept-alive connections per host
+    """
+    return HTTPAdapter(pool_connections=pool_size,pool_maxsize=pool_size)
+
+def new_session(pool_size=4,adapter=None):
+    """
+    Creates a requests.Session with keep-alive connection pooling and a
+    browser user agent
+
+    Parameters
+    ----------
+    pool_size : number of kept-alive connections per host
+
+    adapter : HTTPAdapter to send the requests through, see new_adapter().
+              A new one with pool_size connections when not given
+    """
+    session = requests.Session()
+    session.headers['User-Agent'] = USER_AGENT
+    adapter = adapter if adapter is not None else new_adapter(pool_size)
+    session.mount('http://',adapter)
+    session.mount('https://',adapter)
+    return session
+
+def page_title(html):
+    """
+    Returns the stripped text of the <title> tag, or None when there is none
+
+    Parameters
+    ----------
+    html : string of HTML code
+    """
+    match = TITLE.search(html)
+    return ' '.join(match.group(1).split()) if match else None
+
+def find_printable_reports_url(html,base_url):
+    """
+    Finds the url behind the 'Printable Reports' link of the dashboard page,
+    the same link get_printable_reports_url() reads from the webdriver
+
+    Parameters
+    ----------
+    html : string of HTML code of the dashboard page
+
+    base_url : string url the dashboard was served from, relative links are resolved against it
+    """
+    link = BeautifulSoup(html,'lxml').find('a',string=PRINTABLE_REPORTS)
+    href = link.get('href','').strip() if link is not None else ''
+    if not href or href.startswith('#') or href.lower().startswith('javascript:'):
+        raise ReportFetchError("No plain 'Printable Reports' link on the dashboard page")
+    return urljoin(base_url,href)
+
+def fetch_report_direct(url,session=None,timeout=30,adapter=None):
+    """
+    Logs in with a tokenized mls link and downloads the printable reports page.
+    Returns the page source. Raises ReportFetchError, or a requests exception
+    for network and http errors, when the page can't be fetched this way
+
+    Parameters
+    ----------
+    url : string tokenized mls url, e.g. from get_listing_token.py
+
+    session : requests.Session to reuse, see new_session(). When not given a
+              new one is created for this login and closed afterwards
+
+    timeout : seconds to wait for each http response
+
+    adapter : HTTPAdapter shared between reports, see new_adapter(). The new
+              session then only keeps the cookies of this login, its
+              connections stay open in the adapter for the next report
+    """
+    if session is None:
+        session = new_session(adapter=adapter)
+        try:
+            return fetch_report_direct(url,session,timeout)
+        finally:
+            # closing the session would also close the shared adapter
+            if adapter is None:
+                session.close()
+    dashboard = session.get(url,timeout=timeout)
+    dashboard.raise_for_status()
+    if page_title(dashboard.text) != DASHBOARD_TITLE:
+        raise ReportFetchError(f"Token login landed on {page_title(dashboard.text)!r} instead of the dashboard")
+
+    report = session.get(find_printable_reports_url(dashboard.text,dashboard.url),timeout=timeout)
+    report.raise_for_status()
+    if page_title(report.text) != REPORT_TITLE:
+        raise ReportFetchError(f"Expected the {REPORT_TITLE!r} page, got {page_title(report.text)!r}")
+    return report.text
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3.6
+
+# Timers and counters for a scraper run. Stages add up their wall time under
+# a name ('soup', 'extract', 'load', ...) and fallbacks are counted per field,
+# e.g. how many listings had a field read by position or set to its default:
+#
+#   with run_metrics.timer('soup'):
+#       soup = parse_html(html)
+#   run_metrics.count('field_defaults','easements')
+#
+# Work done in worker processes is measured with collected() and merged back
+# into the parent with merge(), so stage times add up the time of every worker
+# and can exceed the wall time of the whole run. At the end of a run write()
+# appends the totals to a JSON lines file, or writes a Prometheus textfile
+# (.prom) for the node_exporter textfile collector.
+
+import os
+import json
+import time
+import threading
+import datetime as dt
+from contextlib import contextmanager
+
+METRIC_PREFIX = 'mls_scraper'
+# label name of each counter in the Prometheus output
+COUNT_LABELS = {'field_fallbacks':'field',
+                'field_defaults':'field',
+                'field_missing':'field',
+                'field_failures':'field',
+                'report_failures':'stage',
+                'rows':'kind'}
+
+_lock = threading.Lock()
+
+def _new_lock():
+    # a process forked while another thread held the lock would never see it released
+    global _lock
+    _lock = threading.Lock()
+
+if hasattr(os,'register_at_fork'):
+    os.register_at_fork(after_in_child=_new_lock)
+
+def new_registry():
+    """
+    Returns an empty registry: stage -> seconds and counter -> label -> count
+    """
+    return {'seconds':{},'counts':{}}
+
+_registry = new_registry()
+
+def add_time(stage,seconds):
+    """
+    Adds seconds to the wall time of a stage
+
+    Parameters
+    ----------
+    stage : string stage name
+
+    seconds : float
+    """
+    with _lock:
+        _registry['seconds'][stage] = _registry['seconds'].get(stage,0.0) + seconds
+
+@contextmanager
+def timer(stage):
+    """
+    Context manager adding the wall time of its block to a stage, also when
+    the block raises
+
+    Parameters
+    ----------
+    stage : string stage name
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(stage,time.perf_counter() - start)
+
+def count(name,label,n=1):
+    """
+    Increments a counter, e.g. count('field_defaults','easements')
+
+    Parameters
+    ----------
+    name : string counter name, see COUNT_LABELS
+
+    label : string the count is kept for, e.g. a field name
+
+    n : integer increment
+    """
+    with _lock:
+        counter = _registry['counts'].setdefault(name,{})
+        counter[label] = counter.get(label,0) + n
+
+def snapshot():
+    """
+    Returns a copy of the current registry
+    """
+    with _lock:
+        return {'seconds':dict(_registry['seconds']),
+                'counts':{name:dict(counter) for name, counter in _registry['counts'].items()}}
+
+def merge(registry):
+    """
+    Adds the timers and counters of another registry, e.g. one returned
+    from collected() in a worker process
+
+    Parameters
+    ----------
+    registry : dictionary returned from snapshot()
+    """
+    for stage, seconds in registry['seconds'].items():
+        add_time(stage,seconds)
+    for name, counter in registry['counts'].items():
+        for label, n in counter.items():
+            count(name,label,n)
+
+def reset():
+    """
+    Clears every timer and counter
+    """
+    global _registry
+    with _lock:
+        _registry = new_registry()
+
+def collected(function,*args,**kwargs):
+    """
+    Runs function(*args, **kwargs) with a fresh registry and returns a tuple
+    of (its result, the registry it filled). Meant for work submitted to a
+    process pool; merge() the registry in the parent. The outer registry is
+    restored afterwards, so calling it in-process and merging counts once
+
+    Parameters
+    ----------
+    function : picklable function, e.g. listing_scraper.parse_report
+
+    args, kwargs : arguments of function
+    """
+    global _registry
+    with _lock:
+        outer = _registry
+        _registry = new_registry()
+    try:
+        result = function(*args,**kwargs)
+    finally:
+        with _lock:
+            inner = _registry
+            _registry = outer
+    return result, inner
+
+def prometheus_text(registry,timestamp,run_info={}):
+    """
+    Formats a registry in the Prometheus text exposition format
+
+    Parameters
+    ----------
+    registry : dictionary returned from snapshot()
+
+    timestamp : float unix time of the run
+
+    run_info : dictionary of extra values, the numeric ones are written as
+               <prefix>_run_<name> gauges
+    """
+    def escape(value):
+        return str(value).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+
+    lines = [f"# HELP {METRIC_PREFIX}_stage_seconds Wall time spent in each stage of the last run",
+             f"# TYPE {METRIC_PREFIX}_stage_seconds gauge"]
+    for stage, seconds in sorted(registry['seconds'].items()):
+        lines.append(f'{METRIC_PREFIX}_stage_seconds{{stage="{escape(stage)}"}} {seconds:.6f}')
+    for name, counter in sorted(registry['counts'].items()):
+        label = COUNT_LABELS.get(name,'label')
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} Number of {name.replace('_',' ')} in the last run")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} gauge")
+        for value, n in sorted(counter.items()):
+            lines.append(f'{METRIC_PREFIX}_{name}{{{label}="{escape(value)}"}} {n}')
+    for name, value in sorted(run_info.items()):
+        if isinstance(value,(int,float)) and not isinstance(value,bool):
+            lines.append(f"# TYPE {METRIC_PREFIX}_run_{name} gauge")
+            lines.append(f"{METRIC_PREFIX}_run_{name} {value}")
+    lines.append(f"# HELP {METRIC_PREFIX}_last_run_timestamp_seconds Unix time the last run finished")
+    lines.append(f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge")
+    lines.append(f"{METRIC_PREFIX}_last_run_timestamp_seconds {timestamp:.0f}")
+    return '\n'.join(lines) + '\n'
+
+def write(path,**run_info):
+    """
+    Writes the current timers and counters. A path ending in .prom is
+    (re)written as a Prometheus textfile, any other path gets one JSON line
+    per run appended
+
+    Parameters
+    ----------
+    path : string path of the metrics file
+
+    run_info : extra values of the run, e.g. rows=120
+    """
+    registry = snapshot()
+    now = time.time()
+    if path.endswith('.prom'):
+        # written next to the target and renamed, the collector never reads a partial file
+        tmp_path = path + '.tmp'
+        with open(tmp_path,'w') as metrics:
+            metrics.write(prometheus_text(registry,now,run_info))
+        os.replace(tmp_path,path)
+    else:
+        line = dict(time=dt.datetime.fromtimestamp(now).isoformat(timespec='seconds'),**run_info,**registry)
+        with open(path,'a') as metrics:
+            metrics.write(json.dumps(line) + '\n')
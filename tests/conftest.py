@@ -0,0 +1,27 @@
+# shared helpers for the tests. The pages in fixtures/ are synthetic, written
+# by benchmarks/synthetic_report.py (report_small: 4 listings, seed 1,
+# report_small_vt: 6 listings, seed 2, Virtual Tour rows on listings 0 and 3).
+# The .json next to each page holds the dicts the original split based
+# get_results() gives for it, written by benchmarks/bench_baseline.py --write
+
+import os
+import sys
+import json
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, 'tests', 'fixtures')
+REPORT_PAGES = ('report_small', 'report_small_vt')
+sys.path.insert(0, ROOT)
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as fixture:
+        return fixture.read()
+
+@pytest.fixture(params=REPORT_PAGES)
+def report_page(request):
+    """
+    (page source, original get_results() dicts) of every synthetic report page
+    """
+    return read_fixture(request.param + '.html'), json.loads(read_fixture(request.param + '.json'))
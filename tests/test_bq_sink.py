@@ -0,0 +1,107 @@
+import json
+
+import pytest
+
+pytest.importorskip('google.cloud.bigquery')
+from google.api_core import exceptions as api_exceptions
+
+import bq_sink
+
+class StandInJob:
+    def __init__(self, rows, error=None):
+        self.output_rows = len(rows)
+        self.error = error
+        self.error_result = {'reason': 'backendError'} if error is not None else None
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self
+
+class StandInClient:
+    """
+    Records every batch written through it in place of bigquery.Client.
+    The exceptions in failures are raised by the first calls, after the
+    batch is written, as if the response got lost. The exceptions in
+    job_failures fail the first load jobs themselves, those write nothing.
+    Job ids are unique, like BigQuery's
+    """
+    def __init__(self, failures=(), job_failures=()):
+        self.failures = list(failures)
+        self.job_failures = list(job_failures)
+        self.jobs = {}
+        self.loads = []
+        self.inserts = []
+
+    def fail(self):
+        if self.failures:
+            raise self.failures.pop(0)
+
+    def load_table_from_file(self, buffer, table_id, job_id=None, job_config=None):
+        if job_id in self.jobs:
+            raise api_exceptions.Conflict(f'Already Exists: Job {job_id}')
+        rows = [json.loads(line) for line in buffer.read().decode('utf-8').splitlines()]
+        if self.job_failures:
+            self.jobs[job_id] = StandInJob(rows, self.job_failures.pop(0))
+        else:
+            self.jobs[job_id] = StandInJob(rows)
+            self.loads.append((table_id, rows))
+        self.fail()
+        return self.jobs[job_id]
+
+    def get_job(self, job_id):
+        return self.jobs[job_id]
+
+    def insert_rows_json(self, table_id, rows, row_ids=None):
+        self.inserts.append((table_id, list(rows), list(row_ids)))
+        self.fail()
+        return []
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(bq_sink.time, 'sleep', lambda seconds: None)
+
+ROWS = [{'ml_num': str(num), 'address': f"{num} O'Neil \"Rd\""} for num in range(1203)]
+
+def test_load_jobs_write_batches_to_the_partition():
+    client = StandInClient()
+    stats = bq_sink.write_rows(client, ROWS, table_id='housing.mls', partition_date='2019-06-01', batch_size=500)
+    assert stats['rows'] == 1203 and stats['batches'] == 3
+    assert [len(rows) for _, rows in client.loads] == [500, 500, 203]
+    assert {table_id for table_id, _ in client.loads} == {'housing.mls$20190601'}
+    # quotes are kept, the rows are no longer pasted into sql
+    assert [row for _, rows in client.loads for row in rows] == ROWS
+
+def test_lost_load_responses_are_not_loaded_twice():
+    client = StandInClient([api_exceptions.ServiceUnavailable('down')])
+    stats = bq_sink.write_rows(client, ROWS[:10], mode='load')
+    assert stats['rows'] == 10
+    assert client.loads == [('housing.mls', ROWS[:10])]
+    assert len(client.jobs) == 1
+
+def test_failed_load_jobs_are_retried_as_new_jobs():
+    client = StandInClient(job_failures=[api_exceptions.InternalServerError('backend error')])
+    stats = bq_sink.write_rows(client, ROWS[:10], mode='load')
+    assert stats['rows'] == 10
+    assert client.loads == [('housing.mls', ROWS[:10])]
+    assert len(client.jobs) == 2
+
+def test_other_errors_are_raised():
+    client = StandInClient([api_exceptions.BadRequest('bad row')])
+    with pytest.raises(api_exceptions.BadRequest):
+        bq_sink.write_rows(client, ROWS[:10])
+
+def test_streaming_retries_reuse_the_insert_ids():
+    client = StandInClient([api_exceptions.InternalServerError('written, then failed')])
+    stats = bq_sink.write_rows(client, ROWS[:700], mode='stream', batch_size=500)
+    assert (stats['rows'], stats['batches']) == (700, 2)
+    (_, first_rows, first_ids), (_, retry_rows, retry_ids), (_, _, next_ids) = client.inserts
+    assert first_rows == retry_rows == ROWS[:500]
+    assert first_ids == retry_ids
+    assert len(set(first_ids)) == 500 and not set(first_ids) & set(next_ids)
+
+def test_rejected_rows_raise():
+    client = StandInClient()
+    client.insert_rows_json = lambda table_id, rows, row_ids=None: [{'index': 0, 'errors': ['no such field']}]
+    with pytest.raises(RuntimeError, match='rejected 1 rows'):
+        bq_sink.write_rows(client, ROWS[:5], mode='stream')
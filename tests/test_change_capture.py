@@ -0,0 +1,55 @@
+import change_capture
+
+def listing(ml_num='3000001', last_price='450000', days_on_mkt='10', **values):
+    return {'ml_num': ml_num, 'last_price': last_price, 'days_on_mkt': days_on_mkt,
+            'address': '12 Maple Ave', **values}
+
+def first_run(row, date='2019-06-01'):
+    state = {}
+    change_capture.split_changes([row], state, date)
+    return state
+
+def test_new_listings_are_loaded_in_full():
+    state = {}
+    changed, deltas = change_capture.split_changes([listing()], state, '2019-06-01')
+    assert (changed, deltas) == ([listing()], [])
+    assert state['3000001']['days_on_mkt'] == 10 and state['3000001']['date'] == '2019-06-01'
+
+def test_unchanged_listings_become_deltas_as_days_on_market_grow():
+    state = first_run(listing())
+    # three days later the mls shows 3 more days on market, nothing else changed
+    changed, deltas = change_capture.split_changes([listing(days_on_mkt='13')], state, '2019-06-04')
+    assert changed == []
+    assert deltas == [{'ml_num': '3000001', 'last_price': '450000', 'days_on_mkt': '13'}]
+    assert state['3000001']['date'] == '2019-06-04'
+
+def test_relisted_listings_with_reset_days_on_market_are_loaded():
+    state = first_run(listing(days_on_mkt='90'))
+    changed, deltas = change_capture.split_changes([listing(days_on_mkt='0')], state, '2019-06-04')
+    assert (changed, deltas) == ([listing(days_on_mkt='0')], [])
+    assert state['3000001']['days_on_mkt'] == 0
+
+def test_price_changes_are_loaded():
+    state = first_run(listing())
+    changed, deltas = change_capture.split_changes([listing(last_price='435000', days_on_mkt='11')], state,
+                                                   '2019-06-02')
+    assert (changed, deltas) == ([listing(last_price='435000', days_on_mkt='11')], [])
+
+def test_same_day_reruns_give_deltas():
+    state = first_run(listing())
+    changed, deltas = change_capture.split_changes([listing()], state, '2019-06-01')
+    assert changed == [] and len(deltas) == 1
+    # an unchanged days on market a day later means the listing was off the market for a day
+    changed, deltas = change_capture.split_changes([listing()], state, '2019-06-02')
+    assert changed == [listing()] and deltas == []
+
+def test_rows_without_an_ml_num_are_always_loaded():
+    state = {}
+    rows = [listing(ml_num='empty'), listing(ml_num='empty')]
+    assert change_capture.split_changes(rows, state, '2019-06-01') == (rows, [])
+    assert state == {}
+
+def test_state_survives_a_save(tmp_path):
+    path = str(tmp_path / 'state.json')
+    change_capture.save_state(first_run(listing()), path)
+    assert change_capture.load_state(path) == first_run(listing())
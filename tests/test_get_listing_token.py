@@ -0,0 +1,124 @@
+import re
+import email.message
+import base64
+
+import pytest
+
+pytest.importorskip('apiclient')
+from apiclient.errors import HttpError
+from httplib2 import Response
+
+import get_listing_token as tokens
+
+SENDER = 'patty@paulaclarkrealtor.com'
+
+class FakeGmail:
+    """
+    Just enough of the gmail service for ListMessages() and batched
+    GetMimeMessages(). received maps ID -> internalDate in ms, fail_fetches
+    maps ID -> number of fetches to fail with an error, like a 429 inside a batch,
+    fail_lists is the number of list requests to fail with a 503
+    """
+    def __init__(self, received, fail_fetches=None, fail_lists=0):
+        self.received = received
+        self.fail_fetches = dict(fail_fetches or {})
+        self.fail_lists = fail_lists
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def list(self, userId, q='', pageToken=None):
+        if self.fail_lists:
+            self.fail_lists -= 1
+            return Request(HttpError(Response({'status': '503'}), b'backend error'))
+        after = re.search(r'after:(\d+)', q)
+        since = int(after.group(1)) * 1000 if after else 0
+        return Request({'messages': [{'id': msg_id} for msg_id, date in self.received.items()
+                                     if date >= since]})
+
+    def get(self, userId, id, format):
+        return id
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+    def raw_message(self, msg_id):
+        msg = email.message.Message()
+        msg['From'] = f'Patty <{SENDER}>'
+        msg['Date'] = msg_id
+        msg.set_payload(f'<a ?token=3D{msg_id}>listings</a>')
+        return {'raw': base64.urlsafe_b64encode(msg.as_bytes()).decode('ascii'),
+                'internalDate': str(self.received[msg_id])}
+
+class Request:
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self):
+        if isinstance(self.response, Exception):
+            raise self.response
+        return self.response
+
+class FakeBatch:
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.ids = []
+
+    def add(self, msg_id, request_id):
+        self.ids.append(msg_id)
+
+    def execute(self):
+        for msg_id in self.ids:
+            if self.service.fail_fetches.get(msg_id):
+                self.service.fail_fetches[msg_id] -= 1
+                self.callback(msg_id, None, RuntimeError('429 rate limit exceeded'))
+            else:
+                self.callback(msg_id, self.service.raw_message(msg_id), None)
+
+def harvest(service, state):
+    return [url.split('token=')[1] for _, url in tokens.HarvestTokenUrls(service, 'me', SENDER, state)]
+
+def test_messages_inside_the_query_overlap_are_not_emitted_again():
+    service = FakeGmail({'a': 9500, 'b': 10999})
+    state = tokens.LoadState('missing.json')
+    assert harvest(service, state) == ['a', 'b']
+    # the next query starts at 9000 ms and lists both again
+    assert harvest(service, state) == []
+    service.received['c'] = 11500
+    assert harvest(service, state) == ['c']
+
+def test_failed_fetches_are_retried_on_the_next_run():
+    service = FakeGmail({'a': 1000, 'b': 5000, 'c': 9000}, fail_fetches={'a': 1})
+    state = tokens.LoadState('missing.json')
+    assert harvest(service, state) == ['b', 'c']
+    assert state['retry'] == {'a': 1}
+    # 'a' is older than the high-water mark, the query alone would miss it
+    assert harvest(service, state) == ['a']
+    assert state['retry'] == {}
+    assert harvest(service, state) == []
+
+def test_failing_messages_are_given_up_on():
+    service = FakeGmail({'a': 1000}, fail_fetches={'a': tokens.MAX_ATTEMPTS})
+    state = tokens.LoadState('missing.json')
+    for _ in range(tokens.MAX_ATTEMPTS):
+        assert harvest(service, state) == []
+    assert state['retry'] == {}
+
+def test_state_survives_a_save(tmp_path):
+    path = str(tmp_path / 'token_state.json')
+    service = FakeGmail({'a': 1000, 'b': 2000}, fail_fetches={'b': 1})
+    state = tokens.LoadState(path)
+    harvest(service, state)
+    tokens.SaveState(path, state)
+    assert harvest(service, tokens.LoadState(path)) == ['b']
+
+def test_list_errors_are_raised_and_leave_the_state_alone():
+    service = FakeGmail({'a': 9500}, fail_lists=1)
+    state = tokens.LoadState('missing.json')
+    with pytest.raises(HttpError):
+        harvest(service, state)
+    assert harvest(service, state) == ['a']
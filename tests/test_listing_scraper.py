@@ -0,0 +1,149 @@
+import json
+
+import pytest
+from bs4 import BeautifulSoup
+
+import listing_scraper as scraper
+import report_archive
+from benchmarks import bench_baseline
+from conftest import REPORT_PAGES, read_fixture
+
+@pytest.mark.parametrize('parser_name', scraper.PARSERS)
+def test_parsers_match_the_original_extractor(report_page, parser_name):
+    html, expected = report_page
+    assert scraper.parse_report(html, parser_name) == expected
+
+def test_expected_results_come_from_the_original_extractor(report_page):
+    html, expected = report_page
+    assert bench_baseline.baseline_results(html) == expected
+
+def test_original_results_have_every_schema_column(report_page):
+    _, expected = report_page
+    scraper.check_columns(expected, scraper.get_extractor())
+
+def test_table_fallback_follows_the_virtual_tour_offset(report_page):
+    html, expected = report_page
+    extractor = scraper.get_extractor()
+    # without labels every field is read by its table and cell number
+    by_position = {**extractor, 'fields': [(name, '', table, cell, normalize, default)
+                                           for name, _, table, cell, normalize, default in extractor['fields']]}
+    index = scraper.get_listing_index(scraper.parse_html(html))
+    assert [scraper.get_results(index[num], by_position) for num in sorted(index)] == expected
+
+def label_tables_listing(bedrooms_label, taxes_label):
+    """
+    A listing whose label tables are the only tables on the page, read with
+    their schema table numbers, with the given text in the anchor cells
+    """
+    filler = '<table><tr><td>Section</td></tr></table>' * 15
+    return BeautifulSoup(
+        '<span id="L0">' + filler +
+        f'<table><tr><td>{bedrooms_label}</td><td> Full Baths </td><td>Tax Condo #</td></tr></table>'
+        '<table><tr><td>3</td><td>2</td><td>12</td></tr></table>'
+        f'<table><tr><td>{taxes_label}</td><td>Approx Lot Dimensions:</td><td>Sub-Style</td></tr></table>'
+        '<table><tr><td>$1,234</td><td>50x100</td><td>Ranch</td></tr></table>'
+        '</span>', 'lxml').find('span')
+
+@pytest.mark.parametrize('bedrooms_label, taxes_label', [('Bedrooms', 'Taxes'),
+                                                         ('\n\tBedrooms:\n', 'Taxes :'),
+                                                         ('BEDROOMS', '  taxes\xa0')])
+def test_label_table_keys_are_normalized(bedrooms_label, taxes_label):
+    tables, cells = scraper.index_listing(label_tables_listing(bedrooms_label, taxes_label))
+    fields = scraper.extract_fields({**scraper.get_extractor(), 'fields': []}, tables, cells)
+    assert fields == {'Bedrooms': '3', 'Full Baths': '2', 'Tax Condo #': '12',
+                      'Taxes': '1234', 'Approx Lot Dimensions': '50x100', 'Sub-Style': 'Ranch'}
+
+@pytest.mark.parametrize('table, cell, key', [(20, 1, 'gnd_flr'),
+                                              # an even cell, where labels sit in field tables
+                                              (16, 0, 'Bedrooms')])
+def test_values_that_read_like_a_label_stay_in_their_field(report_page, table, cell, key):
+    html, expected = report_page
+    index = scraper.get_listing_index(scraper.parse_html(html))
+    listing = index[1]
+    tables, cells = scraper.index_listing(listing)
+    cells[table][cell].string = 'Heating'
+    assert scraper.get_results(listing) == {**expected[1], key: 'Heating'}
+
+@pytest.mark.parametrize('strip_quotes', [True, False])
+def test_pandas_and_plain_sanitizing_give_the_same_text(report_page, strip_quotes):
+    pytest.importorskip('pandas')
+    _, expected = report_page
+    extractor = scraper.get_extractor()
+    rows = [dict(row) for row in expected]
+    rows[0].update({'Taxes': '10588.50', 'address': "12 O'Neil \"Rd\""})
+    rows[1].update({'Taxes': 'N/A', 'last_price': None})
+    del rows[2]['days_on_mkt']
+    housing_df = scraper.build_housing_frame(rows, extractor, dtypes={})
+    frame_rows = list(scraper.sanitize_frame(housing_df, extractor, strip_quotes).itertuples(index=False, name=None))
+    assert frame_rows == [scraper.sanitize_row(row, extractor, strip_quotes) for row in rows]
+    assert frame_rows[0][6] == '10588.50' and frame_rows[1][6] == 'N/A'
+
+BOX = (('LP', '$450,000'), ('ML#', '3000001'), ('Addr', '12 Maple Ave'), ('Town', 'Summit'), ('Zip', '07901'),
+       ('County', 'UNION'), ('County Locale#', '123'), ('Area#', '45'), ('Direct', 'Park St to Maple Ave'),
+       ('Orig LP', '$475,000'), ('DOM', '12'))
+BOX_VALS = {'last_price': 450000, 'ml_num': '3000001', 'address': '12 Maple Ave', 'town': 'Summit',
+            'zipcode': '07901', 'county': 'Union', 'county_locale': '123', 'areacode': '45',
+            'direct': 'Park St to Maple Ave', 'original_lp': 475000, 'days_on_mkt': 12}
+
+def box_text(fields):
+    """
+    The text of a listing box cell, laid out like on the synthetic pages
+    """
+    return '\n' + '\n'.join(f'{label}:\n{value}' for label, value in fields) + '\n'
+
+def test_box_fields_are_read_by_label():
+    assert scraper.parse_box_text(box_text(BOX)) == BOX_VALS
+
+def test_missing_box_fields_are_none():
+    fields = [(label, value) for label, value in BOX if label not in ('Zip', 'DOM')]
+    assert scraper.parse_box_text(box_text(fields)) == {**BOX_VALS, 'zipcode': None, 'days_on_mkt': None}
+
+def test_box_prices_that_arent_numbers_are_none():
+    fields = [(label, 'Call Agent' if label == 'LP' else value) for label, value in BOX]
+    assert scraper.parse_box_text(box_text(fields)) == {**BOX_VALS, 'last_price': None}
+
+def test_orig_lp_is_never_read_as_lp():
+    fields = [field for field in BOX if field[0] == 'Orig LP'] + [field for field in BOX if field[0] != 'Orig LP']
+    assert scraper.parse_box_text(box_text(fields)) == BOX_VALS
+    without_lp = [field for field in fields if field[0] != 'LP']
+    assert scraper.parse_box_text(box_text(without_lp)) == {**BOX_VALS, 'last_price': None}
+
+def test_missing_schema_column_fails_loudly(report_page):
+    _, expected = report_page
+    rows = [{key: value for key, value in row.items() if key != 'Sewer'} for row in expected]
+    with pytest.raises(ValueError, match='Sewer'):
+        scraper.check_columns(rows, scraper.get_extractor())
+
+@pytest.mark.parametrize('parser_name', scraper.PARSERS)
+def test_streaming_matches_the_full_document(report_page, parser_name):
+    html, expected = report_page
+    assert scraper.parse_report(html, parser_name, streaming=True) == expected
+
+def test_iter_listings_finds_the_same_listings_as_the_index(report_page):
+    html, _ = report_page
+    index = scraper.get_listing_index(scraper.parse_html(html))
+    streamed = [(num, str(listing)) for num, listing in scraper.iter_listings(html)]
+    assert streamed == [(num, str(index[num])) for num in sorted(index)]
+
+def test_archive_replays_keep_their_scrape_dates(tmp_path):
+    small, small_vt = (read_fixture(name + '.html') for name in REPORT_PAGES)
+    report_archive.archive_page(str(tmp_path), small, 'http://mls/report?id=1', '2018-06-01')
+    report_archive.archive_page(str(tmp_path), small_vt, 'http://mls/report?id=2', '2018-06-01')
+    # the same page again on the next day is replayed for both days
+    report_archive.archive_page(str(tmp_path), small, 'http://mls/report?id=1', '2018-06-02')
+    pages = report_archive.replay_pages(str(tmp_path))
+    assert [date for date, _ in pages] == ['2018-06-01', '2018-06-01', '2018-06-02']
+    batches = scraper.replay_reports([path for _, path in pages], [date for date, _ in pages])
+    expected_small, expected_small_vt = (json.loads(read_fixture(name + '.json')) for name in REPORT_PAGES)
+    assert batches == {'2018-06-01': expected_small + expected_small_vt, '2018-06-02': expected_small}
+
+@pytest.mark.parametrize('extra', [[],
+                                   ['--parquet-dir', 'parquet'],
+                                   ['--output', 'rows.csv', '--history-db', 'history.db'],
+                                   ['--scrape-date', '06/01/2018']])
+def test_html_replay_needs_a_scrape_date_to_write_dated_data(tmp_path, capsys, extra):
+    path = tmp_path / 'report.html'
+    path.write_text(read_fixture('report_small.html'))
+    with pytest.raises(SystemExit):
+        scraper.run(scraper.parser.parse_args(['--from-html', str(path)] + extra))
+    assert '--scrape-date' in capsys.readouterr().err
@@ -0,0 +1,88 @@
+import os
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import photo_prefetch
+from photo_prefetch import URL_SEPARATOR
+
+JPEG = b'\xff\xd8\xff\xe0 not really a jpeg'
+
+class StubPhotos(BaseHTTPRequestHandler):
+    """
+    Stand-in for the photo server: /ok.jpg is an image, /missing.jpg a 404,
+    /page.jpg an html page, /nohead.jpg refuses HEAD with a 405
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def reply(self, body=True):
+        self.server.requests.append((self.command, self.path))
+        if self.path == '/missing.jpg' or (self.path == '/nohead.jpg' and self.command == 'HEAD'):
+            status, content_type, data = (404 if self.path == '/missing.jpg' else 405), 'text/html', b'no'
+        elif self.path == '/page.jpg':
+            status, content_type, data = 200, 'text/html', b'<html></html>'
+        else:
+            status, content_type, data = 200, 'image/jpeg', JPEG
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+    def do_GET(self):
+        self.reply()
+
+    def do_HEAD(self):
+        self.reply(body=False)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def photos():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubPhotos)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def photo_url(server, name):
+    return f'http://127.0.0.1:{server.server_port}/{name}'
+
+def closed_port_url():
+    # a port nothing listens on, the request fails without an http response
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    return f'http://127.0.0.1:{port}/ok.jpg'
+
+@pytest.mark.parametrize('mode', photo_prefetch.PHOTO_MODES)
+def test_refused_urls_are_dropped(photos, tmp_path, mode):
+    urls = [photo_url(photos, name) for name in ('ok.jpg', 'missing.jpg', 'page.jpg', 'nohead.jpg')]
+    valid = photo_prefetch.prefetch_photos([('100', urls)], str(tmp_path), mode, rate=0)
+    assert valid == {'100': [urls[0], urls[3]]}
+    if mode == 'get':
+        assert len(os.listdir(tmp_path / 'blobs')) == 1
+
+def test_urls_without_a_response_are_kept_and_rechecked(photos, tmp_path):
+    unreachable = closed_port_url()
+    rows = [{'ml_num': '100', 'image_urls': URL_SEPARATOR.join([photo_url(photos, 'ok.jpg'), unreachable,
+                                                                photo_url(photos, 'missing.jpg')])}]
+    photo_prefetch.prefetch_rows(rows, str(tmp_path), 'head', rate=0, timeout=5)
+    assert rows[0]['image_urls'] == URL_SEPARATOR.join([photo_url(photos, 'ok.jpg'), unreachable])
+    # nothing was cached, the next run asks again
+    photos.requests.clear()
+    photo_prefetch.prefetch_rows(rows, str(tmp_path), 'head', rate=0, timeout=5)
+    assert ('HEAD', '/ok.jpg') in photos.requests
+
+def test_checked_listings_are_served_from_the_cache(photos, tmp_path):
+    urls = [photo_url(photos, 'ok.jpg'), photo_url(photos, 'missing.jpg')]
+    first = photo_prefetch.prefetch_photos([('100', urls)], str(tmp_path), 'head', rate=0)
+    photos.requests.clear()
+    assert photo_prefetch.prefetch_photos([('100', urls)], str(tmp_path), 'head', rate=0) == first
+    assert photos.requests == []
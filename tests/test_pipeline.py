@@ -0,0 +1,180 @@
+import json
+import asyncio
+import datetime as dt
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import pipeline
+from conftest import read_fixture
+
+ROWS = json.loads(read_fixture('report_small.json'))
+HTML = read_fixture('report_small.html')
+
+@pytest.fixture
+def args(tmp_path):
+    return pipeline.parser.parse_args(['--state', str(tmp_path / 'token_state.json'),
+                                       '--poll-interval', '60', '--parse-workers', '1'])
+
+@pytest.fixture
+def tracker(args):
+    tracker = pipeline.TokenTracker(args.state)
+    tracker.in_flight.update({'a': 0, 'b': 0, 'c': 0})
+    return tracker
+
+def saved_state(args):
+    with open(args.state) as state_file:
+        return json.load(state_file)
+
+class FakeBigQuery:
+    """
+    Records what bq_sink.write_rows() was asked to write, failing the first
+    failures calls
+    """
+    def __init__(self, failures=0, on_write=None):
+        self.failures = failures
+        self.on_write = on_write
+        self.writes = []
+
+    def write_rows(self, client, rows, table_id, partition_date, mode, batch_size):
+        if self.on_write is not None:
+            self.on_write()
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('503 backend error')
+        self.writes.append((partition_date, [row['ml_num'] for row in rows]))
+        return {'rows': len(rows), 'batches': 1, 'seconds': 0.1, 'rows_per_sec': len(rows) / 0.1}
+
+@pytest.fixture
+def bigquery(monkeypatch):
+    fake = FakeBigQuery()
+    monkeypatch.setattr(pipeline.bq_sink, 'write_rows', fake.write_rows)
+    monkeypatch.setattr(pipeline.scraper, 'get_client', lambda: None)
+    return fake
+
+def report(msg_id, date, rows):
+    return {'msg_id': msg_id, 'url': f'http://mls/{msg_id}', 'date': date, 'rows': rows}
+
+def run_load(args, tracker, reports, delay=0.0):
+    async def load():
+        queue = asyncio.Queue()
+        async def feed():
+            for item in reports:
+                await queue.put(item)
+                await asyncio.sleep(delay)
+            await queue.put(None)
+        loaded, _ = await asyncio.gather(pipeline.load_rows(args, queue, 1, tracker), feed())
+        return loaded
+    return asyncio.run(load())
+
+def test_rows_load_to_the_partition_of_their_scrape_date(args, tracker, bigquery):
+    loaded = run_load(args, tracker, [report('a', '2019-06-01', ROWS[:2]),
+                                      report('b', '2019-06-02', ROWS[2:]),
+                                      report('c', '2019-06-01', ROWS[2:3])])
+    assert loaded == 5
+    assert bigquery.writes == [('2019-06-01', [ROWS[0]['ml_num'], ROWS[1]['ml_num'], ROWS[2]['ml_num']]),
+                               ('2019-06-02', [ROWS[2]['ml_num'], ROWS[3]['ml_num']])]
+    assert tracker.in_flight == {}
+    assert saved_state(args)['retry'] == {}
+
+def test_failed_loads_are_kept_and_messages_stay_to_retry(args, tracker, bigquery):
+    args.batch_size = 1
+    bigquery.failures = 1
+    saved_at_write = []
+    bigquery.on_write = lambda: saved_at_write.append(saved_state(args)['retry'])
+    tracker.save()
+    loaded = run_load(args, tracker, [report('a', '2019-06-01', ROWS[:1]),
+                                      report('b', '2019-06-01', ROWS[1:2])])
+    # 'a' failed to load, it went out again along with 'b'
+    assert loaded == 2
+    assert bigquery.writes == [('2019-06-01', [ROWS[0]['ml_num'], ROWS[1]['ml_num']])]
+    assert saved_at_write[0] == {'a': 0, 'b': 0, 'c': 0}
+    assert saved_state(args)['retry'] == {'c': 0}
+
+def test_rows_are_loaded_every_poll_interval(args, tracker, bigquery):
+    args.poll_interval = 0.05
+    fed = []
+    reports = [report('a', '2019-06-01', ROWS[:1]), report('b', '2019-06-01', ROWS[1:2])]
+    bigquery.on_write = lambda: fed.append(len([r for r in reports if 'bq_rows' in r]))
+    run_load(args, tracker, reports, delay=0.2)
+    # far fewer rows than --batch-size, each report was loaded before the next one came in
+    assert fed == [1, 2]
+
+def test_unloaded_reports_are_saved_to_retry(args):
+    tracker = pipeline.TokenTracker(args.state)
+    reports = tracker.harvested([('a', 1000, 'Mon', 'http://mls/a'), ('b', 2000, 'Tue', None)], ['c'])
+    assert reports == [('a', 'Mon', 'http://mls/a')]
+    state = saved_state(args)
+    assert state['newest_internal_date'] == 2000
+    assert state['retry'] == {'a': 0, 'c': 1}
+    tracker.failed('a')
+    assert saved_state(args)['retry'] == {'a': 1, 'c': 1}
+    # a retried report that goes through is done
+    tracker.harvested([('a', 1000, 'Mon', 'http://mls/a')], [])
+    tracker.loaded(['a'])
+    assert saved_state(args)['retry'] == {'c': 1}
+
+def test_each_report_is_stamped_with_the_date_it_was_scraped(args, tracker, monkeypatch):
+    days = iter([dt.date(2019, 6, 1), dt.date(2019, 6, 2), dt.date(2019, 6, 2)])
+    class FakeDate:
+        @staticmethod
+        def today():
+            return next(days)
+    monkeypatch.setattr(pipeline, 'dt', SimpleNamespace(date=FakeDate))
+    def fetch(url, *options):
+        if url.endswith('c'):
+            raise RuntimeError('token expired')
+        return HTML
+    monkeypatch.setattr(pipeline.scraper, 'fetch_report_html', fetch)
+
+    async def scrape():
+        urls = asyncio.Queue()
+        reports = asyncio.Queue()
+        for msg_id in 'abc':
+            urls.put_nowait((msg_id, f'http://mls/{msg_id}'))
+        urls.put_nowait(None)
+        with ThreadPoolExecutor(1) as parse_pool:
+            await pipeline.scrape_reports(args, urls, reports, parse_pool, None, tracker)
+        return [reports.get_nowait() for _ in range(reports.qsize())]
+
+    reports = asyncio.run(scrape())
+    assert [(item['msg_id'], item['date'], len(item['rows'])) for item in reports[:-1]] == [('a', '2019-06-01', 4),
+                                                                                            ('b', '2019-06-02', 4)]
+    assert reports[-1] is None
+    assert saved_state(args)['retry'] == {'a': 0, 'b': 0, 'c': 1}
+
+def test_failed_gmail_checks_keep_the_poll_loop_running(args, monkeypatch):
+    args.poll_interval = 0
+    checks = []
+    def fetch(service, user, sender, state):
+        checks.append(state['newest_internal_date'])
+        if len(checks) == 1:
+            raise RuntimeError('503 backend error')
+        # stop after this check
+        args.once = True
+        return [('a', 1000, 'Mon', 'http://mls/a')], []
+    monkeypatch.setattr(pipeline.tokens, 'GetService', lambda: None)
+    monkeypatch.setattr(pipeline, 'fetch_reports', fetch)
+
+    async def harvest():
+        urls = asyncio.Queue()
+        await pipeline.harvest_urls(args, urls, 1, pipeline.TokenTracker(args.state))
+        return [urls.get_nowait() for _ in range(urls.qsize())]
+
+    assert asyncio.run(harvest()) == [('a', 'http://mls/a'), None]
+    assert len(checks) == 2
+
+def test_failing_to_connect_to_gmail_stops_the_pipeline(args, monkeypatch):
+    def no_service():
+        raise RuntimeError('invalid credentials')
+    monkeypatch.setattr(pipeline.tokens, 'GetService', no_service)
+
+    async def harvest():
+        urls = asyncio.Queue()
+        with pytest.raises(RuntimeError, match='invalid credentials'):
+            await pipeline.harvest_urls(args, urls, 2, pipeline.TokenTracker(args.state))
+        return [urls.get_nowait() for _ in range(urls.qsize())]
+
+    # the scrapers are still told to stop
+    assert asyncio.run(harvest()) == [None, None]
@@ -0,0 +1,47 @@
+import pytest
+
+import price_history
+
+def scrape(ml_num, last_price, days_on_mkt):
+    return {'ml_num': ml_num, 'last_price': str(last_price), 'original_lp': '500000',
+            'days_on_mkt': str(days_on_mkt), 'address': f'{ml_num} Maple Ave', 'town': 'Summit'}
+
+@pytest.fixture
+def conn():
+    conn = price_history.connect(':memory:')
+    # 'a' isn't scraped on 06-02 or 06-04, 'b' is only scraped on the first two days
+    price_history.record_rows(conn, [scrape('a', 500000, 10), scrape('b', 300000, 3)], '2019-06-01')
+    price_history.record_rows(conn, [scrape('b', 310000, 4)], '2019-06-02')
+    price_history.record_rows(conn, [scrape('a', 480000, 12)], '2019-06-03')
+    price_history.record_rows(conn, [scrape('a', 470000, 14)], '2019-06-05')
+    yield conn
+    conn.close()
+
+def drops(conn, since, until=None):
+    return [(row['ml_num'], row['previous_date'], row['scrape_date'], row['change'])
+            for row in price_history.price_drops(conn, since, until)]
+
+def test_drops_compare_with_the_scrape_before_across_skipped_days(conn):
+    assert drops(conn, '2019-06-01') == [('a', '2019-06-01', '2019-06-03', -20000),
+                                         ('a', '2019-06-03', '2019-06-05', -10000)]
+    # the scrape before the range is still used to compare with
+    assert drops(conn, '2019-06-04') == [('a', '2019-06-03', '2019-06-05', -10000)]
+
+def test_drops_stop_at_until(conn):
+    assert drops(conn, '2019-06-01', '2019-06-04') == [('a', '2019-06-01', '2019-06-03', -20000)]
+
+def test_scraping_the_same_day_again_replaces_it(conn):
+    assert price_history.record_rows(conn, [scrape('b', 290000, 4), scrape('empty', 1, 1)], '2019-06-02') == 1
+    assert [(row['scrape_date'], row['last_price'], row['change']) for row in price_history.history(conn, 'b')] == \
+        [('2019-06-01', 300000, None), ('2019-06-02', 290000, -10000)]
+    assert drops(conn, '2019-06-02', '2019-06-02') == [('b', '2019-06-01', '2019-06-02', -10000)]
+
+def test_time_on_market(conn):
+    summary = [dict(row) for row in price_history.time_on_market(conn)]
+    # only 'a' was scraped on the latest date
+    assert summary == [{'ml_num': 'a', 'first_seen': '2019-06-01', 'last_seen': '2019-06-05',
+                        'scrapes': 3, 'days_on_mkt': 14, 'change': -30000}]
+    on_first_day = price_history.time_on_market(conn, date='2019-06-01')
+    assert [(row['ml_num'], row['days_on_mkt'], row['change']) for row in on_first_day] == [('a', 14, -30000),
+                                                                                              ('b', 4, 10000)]
+    assert [row['scrapes'] for row in price_history.time_on_market(conn, 'b')] == [2]
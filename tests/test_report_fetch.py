@@ -0,0 +1,103 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import pytest
+import requests
+
+import report_fetch
+import listing_scraper as scraper
+from conftest import read_fixture
+
+REPORT = read_fixture('report_small.html')
+DASHBOARD = ('<html><head><title>Dashboard | Collab Center</title></head><body>'
+             '<a href="{href}">Printable Reports</a></body></html>')
+
+class StubMls(BaseHTTPRequestHandler):
+    """
+    Stand-in for the mls site: tokenlogin sets a session cookie holding the
+    token and serves the dashboard, /report serves the synthetic report to a
+    logged in session. Tokens starting with 'js' get a javascript link,
+    'forbidden' gets a 403
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def send(self, status, body, headers=()):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        path = urlsplit(self.path)
+        token = parse_qs(path.query).get('token', [''])[0]
+        if path.path == '/cc2/account/tokenlogin':
+            if token == 'forbidden':
+                return self.send(403, 'expired')
+            href = 'javascript:openReport()' if token.startswith('js') else f'/report?for={token}'
+            return self.send(200, DASHBOARD.format(href=href), [('Set-Cookie', f'session={token}; Path=/')])
+        if path.path == '/report':
+            cookie = self.headers.get('Cookie', '')
+            expected = parse_qs(path.query)['for'][0]
+            self.server.report_cookies.append(cookie)
+            if cookie != f'session={expected}':
+                return self.send(200, '<html><head><title>Login</title></head></html>')
+            return self.send(200, REPORT)
+        self.send(404, 'not found')
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def mls():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubMls)
+    server.connections = set()
+    server.report_cookies = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def token_url(server, token):
+    return f'http://127.0.0.1:{server.server_port}/cc2/account/tokenlogin?token={token}'
+
+def test_report_is_downloaded_unchanged(mls):
+    assert report_fetch.fetch_report_direct(token_url(mls, 'abc')) == REPORT
+
+def test_own_session_is_closed(mls, monkeypatch):
+    closed = []
+    monkeypatch.setattr(requests.Session, 'close', lambda session: closed.append(session))
+    report_fetch.fetch_report_direct(token_url(mls, 'abc'))
+    assert len(closed) == 1
+
+def test_shared_adapter_reuses_connections_and_keeps_logins_apart(mls):
+    adapter = report_fetch.new_adapter(pool_size=1)
+    try:
+        for token in ('first', 'second', 'third'):
+            assert report_fetch.fetch_report_direct(token_url(mls, token), adapter=adapter) == REPORT
+    finally:
+        adapter.close()
+    # every report ran on its own cookie jar over the same kept-alive connection
+    assert mls.report_cookies == ['session=first', 'session=second', 'session=third']
+    assert len(mls.connections) == 1
+
+def test_javascript_link_raises(mls):
+    with pytest.raises(report_fetch.ReportFetchError):
+        report_fetch.fetch_report_direct(token_url(mls, 'js-only'))
+
+def test_http_errors_raise(mls):
+    with pytest.raises(requests.HTTPError):
+        report_fetch.fetch_report_direct(token_url(mls, 'forbidden'))
+
+def test_auto_falls_back_to_selenium(mls, monkeypatch):
+    monkeypatch.setattr(scraper, 'fetch_report_selenium', lambda url, remote, timeout: 'from selenium')
+    assert scraper.fetch_report_html(token_url(mls, 'js-only'), 'http://selenium', 5, 'auto') == 'from selenium'
+    assert scraper.fetch_report_html(token_url(mls, 'abc'), 'http://selenium', 5, 'auto') == REPORT
+    with pytest.raises(requests.HTTPError):
+        scraper.fetch_report_html(token_url(mls, 'forbidden'), 'http://selenium', 5, 'direct')